@@ -0,0 +1 @@
+# Shared raster and vector helpers used by the Streamlit pages
@@ -0,0 +1,205 @@
+import ast
+
+import numpy as np
+
+from geo_utils.terrain import BLOCK_ROWS
+
+
+# Functions an expression may call, mapped to float32-preserving ufuncs
+BAND_FUNCTIONS = {
+    'sqrt': np.sqrt,
+    'abs': np.abs,
+    'log': np.log,
+    'exp': np.exp,
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+}
+
+
+class _Temporary(np.ndarray):
+    # Marks arrays created during evaluation, which later operations may
+    # overwrite in place instead of allocating a new block
+    pass
+
+
+def _temporary(value):
+    # Operations on constants only produce scalars, which stay as they are
+    return value.view(_Temporary) if isinstance(value, np.ndarray) else value
+
+
+def _compile(node, names):
+    # Turn an expression tree into a function of a dict of band blocks.
+    # Every operation writes into a temporary operand when there is one,
+    # so a block never holds more than a couple of float32 arrays.
+    if isinstance(node, ast.Expression):
+        return _compile(node.body, names)
+
+    if isinstance(node, ast.Name):
+        names.add(node.id)
+        return lambda blocks: blocks[node.id]
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        value = np.float32(node.value)
+        return lambda blocks: value
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = _compile(node.operand, names)
+        if isinstance(node.op, ast.UAdd):
+            return operand
+
+        def negate(blocks):
+            value = operand(blocks)
+            out = value if isinstance(value, _Temporary) else None
+            return _temporary(np.negative(value, out=out))
+        return negate
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        ufunc = _BINARY_OPERATORS[type(node.op)]
+        left, right = _compile(node.left, names), _compile(node.right, names)
+
+        def binary(blocks):
+            a, b = left(blocks), right(blocks)
+            out = a if isinstance(a, _Temporary) else b if isinstance(b, _Temporary) else None
+            if out is not None and np.shape(out) != np.broadcast_shapes(np.shape(a), np.shape(b)):
+                out = None
+            return _temporary(ufunc(a, b, out=out))
+        return binary
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+            and node.func.id in BAND_FUNCTIONS and not node.keywords:
+        ufunc = BAND_FUNCTIONS[node.func.id]
+        arguments = [_compile(argument, names) for argument in node.args]
+        if len(arguments) != ufunc.nin:
+            raise ValueError('{}() takes {} argument(s)'.format(node.func.id, ufunc.nin))
+
+        def call(blocks):
+            values = [argument(blocks) for argument in arguments]
+            out = next((value for value in values if isinstance(value, _Temporary)), None)
+            return _temporary(ufunc(*values, out=out))
+        return call
+
+    raise ValueError('Unsupported band math expression: {}'.format(ast.dump(node)))
+
+
+def compile_expression(expression):
+    # Parse an expression such as '(nir - red) / (nir + red)' into an
+    # evaluator and the set of band names it uses. Only arithmetic,
+    # numbers, band names and BAND_FUNCTIONS are accepted.
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as error:
+        raise ValueError('Invalid band math expression: {}'.format(error.msg)) from None
+    names = set()
+    evaluator = _compile(tree, names)
+    unknown = names & set(BAND_FUNCTIONS)
+    if unknown:
+        raise ValueError('Function names cannot be used as bands: {}'.format(', '.join(unknown)))
+    return evaluator, names
+
+
+def band_range(array, block_rows=BLOCK_ROWS, nodata=None):
+    # Minimum and maximum of a band, read in row blocks
+    low, high = np.inf, -np.inf
+    for start in range(0, array.shape[0], block_rows):
+        block = np.asarray(array[start:start + block_rows], dtype=np.float32)
+        if nodata is not None:
+            block = block[block != nodata]
+        if block.size:
+            low = min(low, float(np.nanmin(block)))
+            high = max(high, float(np.nanmax(block)))
+    return low, high
+
+
+def _common_shape(bands, names):
+    shapes = {np.shape(bands[name])[:2] for name in names}
+    if len(shapes) != 1:
+        raise ValueError('All bands in an expression must have the same shape')
+    return shapes.pop()
+
+
+def _band_blocks(bands, names, shape, scales, offsets, nodata, block_rows):
+    # Row blocks of the named bands as float32 (rescaled), together with
+    # the mask of cells where any of them is nodata. Each band is read once
+    # per block however many expressions use it.
+    for start in range(0, shape[0], block_rows):
+        stop = min(start + block_rows, shape[0])
+        blocks, invalid = {}, np.zeros((stop - start, shape[1]), dtype=bool)
+        for name in names:
+            raw = bands[name][start:stop]
+            if nodata.get(name) is not None:
+                invalid |= raw == nodata[name]
+            block = np.asarray(raw, dtype=np.float32)
+            if name in scales or name in offsets:
+                # float32 bands come back as views of the (possibly
+                # memory-mapped) source, which must never be written to
+                if np.may_share_memory(block, raw):
+                    block = block.copy()
+                if name in scales:
+                    block *= np.float32(scales[name])
+                if name in offsets:
+                    block += np.float32(offsets[name])
+            blocks[name] = block
+        yield start, stop, blocks, invalid
+
+
+def band_math_many(expressions, bands, scales=None, offsets=None, nodata=None,
+                   fill=np.nan, block_rows=BLOCK_ROWS):
+    # Evaluate several expressions ({output name: expression}) in a single
+    # blocked pass over the bands. Each band is read as float32 and
+    # rescaled as band * scale + offset before use. Cells where any band
+    # equals its `nodata` value are NaN; cells where a result is not finite
+    # (e.g. 0 / 0) get `fill`. Only the float32 outputs are allocated at
+    # full size.
+    compiled = {output: compile_expression(expression)
+                for output, expression in expressions.items()}
+    names = set().union(*(used for _, used in compiled.values()))
+    if not names:
+        raise ValueError('A band math expression must use at least one band')
+    missing = names - set(bands)
+    if missing:
+        raise ValueError('Unknown band(s): {}'.format(', '.join(sorted(missing))))
+    scales, offsets, nodata = scales or {}, offsets or {}, nodata or {}
+
+    shape = _common_shape(bands, names)
+    results = {output: np.empty(shape, dtype=np.float32) for output in compiled}
+    for start, stop, blocks, invalid in _band_blocks(
+            bands, names, shape, scales, offsets, nodata, block_rows):
+        for output, (evaluator, _) in compiled.items():
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                value = np.broadcast_to(evaluator(blocks), invalid.shape)
+            out = results[output][start:stop]
+            out[...] = value
+            out[~np.isfinite(out)] = fill
+            out[invalid] = np.nan
+    return results
+
+
+def band_math(expression, bands, scales=None, offsets=None, nodata=None,
+              fill=np.nan, block_rows=BLOCK_ROWS):
+    # Evaluate one band math expression over named 2D bands in row blocks
+    return band_math_many({'result': expression}, bands, scales, offsets, nodata,
+                          fill, block_rows)['result']
+
+
+def calculate_ndvi(red_band, nir_band, ranges=None, nodata=(None, None)):
+    # NDVI of min-max normalised red and NIR bands, as the NDVI pages have
+    # always shown it; 0 where both normalised bands are 0 and NaN where
+    # either band is nodata. `ranges` may give each band's (min, max) over
+    # its valid cells, e.g. from a cached histogram, to skip the min/max
+    # scans. `nodata` holds the red and NIR nodata values.
+    bands, scales, offsets = {'red': red_band, 'nir': nir_band}, {}, {}
+    band_nodata = dict(zip(bands, nodata))
+    ranges = ranges or [band_range(band, nodata=band_nodata[name])
+                        for name, band in bands.items()]
+    for (name, band), (low, high) in zip(bands.items(), ranges):
+        scales[name] = 1.0 / (high - low) if high > low else 0.0
+        offsets[name] = -low * scales[name]
+    return band_math('(nir - red) / (nir + red)', bands, scales, offsets, band_nodata, fill=0.0)
@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+
+def nbytes_of(value):
+    # Approximate memory held by a cached value (arrays, tuples, dicts)
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes_of(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes_of(item) for item in value.values())
+    return getattr(value, 'nbytes', 0)
+
+
+class LRUCache:
+    # Thread-safe least-recently-used cache bounded by a memory budget.
+    # Streamlit serves every session from the same process, so one instance
+    # is shared by all pages and users.
+
+    def __init__(self, max_bytes, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = nbytes_of(value)
+
+        # Values larger than the whole budget are returned but never stored
+        if nbytes > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+
+            self._entries[key] = value
+            self._sizes[key] = nbytes
+            self._total_bytes += nbytes
+            self._evict()
+        return value
+
+    def get_or_compute(self, key, compute, sizeof=None):
+        # `sizeof` estimates the size of values nbytes_of cannot measure
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value, None if sizeof is None else sizeof(value))
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._total_bytes -= self._sizes.pop(key)
+            return self._entries.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+    def _evict(self):
+        # Drop least recently used entries until both limits are respected
+        while self._entries and (
+                self._total_bytes > self.max_bytes or
+                (self.max_entries is not None and len(self._entries) > self.max_entries)):
+            key, _ = self._entries.popitem(last=False)
+            self._total_bytes -= self._sizes.pop(key)
+
+
+_MISSING = object()
@@ -0,0 +1,115 @@
+import math
+import os
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from geo_utils.cache import LRUCache
+from geo_utils.indices import NODATA_CLASS
+from geo_utils.raster_io import cache_budget
+from geo_utils.terrain import BLOCK_ROWS
+
+
+# Pixels drawn (one per stratum of a regular grid) to fit the clusters
+SAMPLE_SIZE = int(os.environ.get('GEO_APP_CLASSIFY_SAMPLE', 200_000))
+
+# Bits kept per channel in the optional colour lookup for uint8 RGB
+# images; 6 bits give a 262144-entry table
+QUANTIZE_BITS = 6
+
+_classifier_cache = LRUCache(cache_budget('classify'))
+
+
+def _invalid_mask(values, nodata):
+    # Pixels (rows of `values`) where any band is NaN or nodata
+    invalid = np.zeros(values.shape[0], dtype=bool)
+    if values.dtype.kind == 'f':
+        invalid |= np.isnan(values).any(axis=1)
+    if nodata is not None:
+        invalid |= (values == nodata).any(axis=1)
+    return invalid
+
+
+def stratified_sample(bands, size=SAMPLE_SIZE, nodata=None, seed=0):
+    # float32 pixel values (one column per band) drawn from a regular grid
+    # of about `size` strata, one random pixel in each, so every part of
+    # the image is represented. NaN / nodata pixels are dropped.
+    rows, cols = bands[0].shape
+    step = max(1.0, math.sqrt(rows * cols / size))
+    rng = np.random.default_rng(seed)
+    row_starts, col_starts = np.arange(0, rows, step), np.arange(0, cols, step)
+    shape = (len(row_starts), len(col_starts))
+    sample_rows = np.minimum(row_starts[:, None] + rng.random(shape) * step, rows - 1)
+    sample_cols = np.minimum(col_starts[None, :] + rng.random(shape) * step, cols - 1)
+    sample_rows, sample_cols = sample_rows.astype(np.intp).ravel(), sample_cols.astype(np.intp).ravel()
+
+    values = np.stack([np.asarray(band)[sample_rows, sample_cols] for band in bands], axis=1)
+    values = values[~_invalid_mask(values, nodata)]
+    return values.astype(np.float32)
+
+
+def fit_clusters(bands, k, nodata=None, sample_size=SAMPLE_SIZE):
+    # MiniBatchKMeans fitted in float32 on a stratified sample of the bands
+    sample = stratified_sample(bands, sample_size, nodata)
+    if len(sample) < k:
+        raise ValueError('The image has fewer valid pixels than clusters')
+    model = MiniBatchKMeans(n_clusters=k, batch_size=4096, n_init=3, random_state=0)
+    return model.fit(sample)
+
+
+def _colour_lookup(model, bits=QUANTIZE_BITS):
+    # Cluster of the centre of every quantized RGB colour
+    shift = 8 - bits
+    levels = ((np.arange(1 << bits) << shift) + ((1 << shift) - 1) / 2).astype(np.float32)
+    grid = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1)
+    return model.predict(grid.reshape(-1, 3)).astype(np.uint8)
+
+
+def assign_clusters(model, bands, nodata=None, quantize=False, block_rows=BLOCK_ROWS):
+    # uint8 cluster label of every pixel, NODATA_CLASS where any band is
+    # missing, predicted in row blocks. With `quantize`, uint8 RGB images
+    # go through a lookup table of the QUANTIZE_BITS-bit colour cells
+    # instead: much faster, but each pixel gets the cluster of its cell's
+    # centre, which differs from predict for roughly 1% of pixels (those
+    # near a cluster boundary).
+    rows, cols = bands[0].shape
+    labels = np.empty((rows, cols), dtype=np.uint8)
+    lookup = None
+    if quantize and len(bands) == 3 and all(np.asarray(band).dtype == np.uint8
+                                            for band in bands):
+        lookup = _colour_lookup(model)
+        shift = 8 - QUANTIZE_BITS
+
+    for start in range(0, rows, block_rows):
+        stop = min(start + block_rows, rows)
+        block = np.stack([np.asarray(band[start:stop]) for band in bands], axis=-1)
+        block = block.reshape(-1, len(bands))
+        if lookup is not None:
+            index = block >> shift
+            block_labels = lookup[(index[:, 0].astype(np.intp) << 2 * QUANTIZE_BITS)
+                                  | (index[:, 1].astype(np.intp) << QUANTIZE_BITS)
+                                  | index[:, 2]]
+        else:
+            block_labels = np.full(len(block), NODATA_CLASS, dtype=np.uint8)
+            valid = ~_invalid_mask(block, nodata)
+            if valid.any():
+                block_labels[valid] = model.predict(block[valid].astype(np.float32))
+        if lookup is not None and nodata is not None:
+            block_labels[_invalid_mask(block, nodata)] = NODATA_CLASS
+        labels[start:stop] = block_labels.reshape(stop - start, cols)
+    return labels
+
+
+def classify_bands(key, bands, k, nodata=None, sample_size=SAMPLE_SIZE, quantize=False):
+    # Cluster centres (k x bands, float32) and label raster of an image
+    # given as a list of equally shaped 2D bands, cached per (image, k).
+    # `quantize` is passed on to assign_clusters.
+    cache_key = (key, 'clusters', k, nodata, sample_size, quantize)
+
+    def compute():
+        model = fit_clusters(bands, k, nodata, sample_size)
+        labels = assign_clusters(model, bands, nodata, quantize)
+        labels.flags.writeable = False
+        return model.cluster_centers_.astype(np.float32), labels
+
+    return _classifier_cache.get_or_compute(cache_key, compute)
@@ -0,0 +1,142 @@
+import json
+import os
+import tempfile
+
+import contourpy
+import geopandas as gpd
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.warp import transform as transform_coordinates
+from shapely import LineString, get_num_coordinates, simplify
+
+from geo_utils.cache import LRUCache
+from geo_utils.profile import pixel_to_map
+from geo_utils.raster_io import cache_budget
+
+
+# Guard against intervals so small that tracing would never finish
+MAX_CONTOUR_LEVELS = 1000
+
+_contour_cache = LRUCache(cache_budget('contours'))
+
+
+def contour_levels(elevation_min, elevation_max, interval, base=0.0):
+    # Levels base + k * interval that fall inside the elevation range
+    first = np.ceil((elevation_min - base) / interval)
+    last = np.floor((elevation_max - base) / interval)
+    if last - first + 1 > MAX_CONTOUR_LEVELS:
+        raise ValueError('Contour interval {} gives more than {} levels'.format(
+            interval, MAX_CONTOUR_LEVELS))
+    return base + interval * np.arange(first, last + 1)
+
+
+def trace_contours(dem_array, transform, levels, nodata=None):
+    # Marching-squares isolines for every level, as (level, LineString)
+    # pairs in map coordinates. The contour generator is built once and
+    # reused for all levels.
+    elevation = np.ma.masked_invalid(np.asarray(dem_array, dtype=np.float64))
+    if nodata is not None:
+        elevation = np.ma.masked_equal(elevation, nodata)
+    generator = contourpy.contour_generator(
+        z=elevation, line_type=contourpy.LineType.Separate)
+
+    contours = []
+    for level in levels:
+        for line in generator.lines(level):
+            if len(line) < 2:
+                continue
+            x, y = pixel_to_map(transform, line[:, 1], line[:, 0])
+            contours.append((float(level), LineString(np.column_stack([x, y]))))
+    return contours
+
+
+def _contours_nbytes(contours):
+    # Coordinates dominate the memory held by cached contours
+    return sum(16 * get_num_coordinates(line) + 64 for _, line in contours)
+
+
+def _chaikin(line, iterations):
+    # Corner-cutting smoothing that keeps the end points of open lines
+    coords = np.asarray(line.coords)
+    closed = len(coords) > 2 and np.array_equal(coords[0], coords[-1])
+    for _ in range(iterations):
+        if len(coords) < 3:
+            break
+        q = 0.75 * coords[:-1] + 0.25 * coords[1:]
+        r = 0.25 * coords[:-1] + 0.75 * coords[1:]
+        smoothed = np.empty((2 * len(q), 2))
+        smoothed[0::2], smoothed[1::2] = q, r
+        if closed:
+            coords = np.vstack([smoothed, smoothed[:1]])
+        else:
+            coords = np.vstack([coords[:1], smoothed, coords[-1:]])
+    return LineString(coords)
+
+
+def dem_contours(dem, interval, base=0.0, simplify_tolerance=0.0, smooth_iterations=0):
+    # Cached contours of a DemData. Lines are traced once per
+    # (DEM, interval, base); simplification and smoothing are cached on top,
+    # so restyling a map never re-traces.
+    raster_key = (dem.key, dem.array.shape, tuple(dem.transform))
+
+    def trace():
+        valid = dem.array if dem.nodata is None else dem.array[dem.array != dem.nodata]
+        levels = contour_levels(float(np.nanmin(valid)), float(np.nanmax(valid)),
+                                interval, base)
+        return trace_contours(dem.array, dem.transform, levels, dem.nodata)
+
+    contours = _contour_cache.get_or_compute(
+        raster_key + ('traced', interval, base), trace, _contours_nbytes)
+    if not simplify_tolerance and not smooth_iterations:
+        return contours
+
+    def refine():
+        refined = []
+        for level, line in contours:
+            if simplify_tolerance:
+                line = simplify(line, simplify_tolerance)
+            if smooth_iterations:
+                line = _chaikin(line, smooth_iterations)
+            refined.append((level, line))
+        return refined
+
+    return _contour_cache.get_or_compute(
+        raster_key + ('refined', interval, base, simplify_tolerance, smooth_iterations),
+        refine, _contours_nbytes)
+
+
+def iter_geojson(contours, crs=None):
+    # Stream contours as a GeoJSON FeatureCollection, one feature at a time.
+    # Coordinates are reprojected to WGS84 as RFC 7946 requires.
+    # Any CRS but WGS84 itself (other geographic ones included) is reprojected
+    reproject = crs is not None and CRS.from_user_input(crs) != CRS.from_epsg(4326)
+    yield '{"type": "FeatureCollection", "features": ['
+    for index, (level, line) in enumerate(contours):
+        x, y = np.asarray(line.coords).T
+        if reproject:
+            x, y = transform_coordinates(crs, 'EPSG:4326', x, y)
+        feature = {
+            'type': 'Feature',
+            'properties': {'elevation': level},
+            'geometry': {'type': 'LineString',
+                         'coordinates': np.column_stack([x, y]).round(7).tolist()},
+        }
+        yield (',' if index else '') + json.dumps(feature)
+    yield ']}'
+
+
+def contours_geojson(contours, crs=None):
+    return ''.join(iter_geojson(contours, crs)).encode('utf-8')
+
+
+def contours_geopackage(contours, crs=None):
+    # GeoPackage bytes with one LineString feature per contour, kept in the
+    # DEM's own coordinate reference system
+    frame = gpd.GeoDataFrame(
+        {'elevation': [level for level, _ in contours]},
+        geometry=[line for _, line in contours], crs=crs)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'contours.gpkg')
+        frame.to_file(path, driver='GPKG', layer='contours')
+        with open(path, 'rb') as geopackage:
+            return geopackage.read()
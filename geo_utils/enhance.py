@@ -0,0 +1,121 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+from scipy.ndimage import gaussian_filter
+from skimage import exposure
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import DISPLAY_MAX_SIZE, EXPORT_BLOCK_ROWS, cache_budget
+from geo_utils.stats import Histogram, band_histogram, equalization_cdf, histogram_percentiles
+
+
+# Gaussian kernels reach this many sigmas, as in skimage.filters.gaussian
+GAUSSIAN_TRUNCATE = 4.0
+
+_preview_cache = LRUCache(cache_budget('preview'))
+
+_RAMP = np.arange(256, dtype=np.uint8)
+
+
+def display_preview(key, image, max_size=DISPLAY_MAX_SIZE):
+    # Box-filtered copy of a uint8 image whose longest side is at most
+    # `max_size`, cached by `key` so slider changes reuse it
+    factor = math.ceil(max(image.shape[:2]) / max_size)
+    if factor <= 1:
+        return image
+
+    def compute():
+        preview = np.asarray(Image.fromarray(np.asarray(image)).reduce(factor))
+        preview.flags.writeable = False
+        return preview
+
+    return _preview_cache.get_or_compute((key, 'preview', max_size), compute)
+
+
+def gamma_lut(gamma):
+    # skimage's uint8 gamma adjustment as a 256-entry lookup table
+    return exposure.adjust_gamma(_RAMP, gamma)
+
+
+def stretch_lut(histogram, percent):
+    # skimage rescale_intensity between the `percent` and 100 - `percent`
+    # percentiles of a uint8 histogram (the values np.percentile would give)
+    if percent <= 0:
+        return _RAMP
+    low, high = histogram_percentiles(histogram, [percent, 100 - percent])
+    return exposure.rescale_intensity(_RAMP, in_range=(low, high))
+
+
+def _uint8_histogram(counts):
+    present = np.flatnonzero(counts)
+    return Histogram(counts, 0.0, 1.0, float(present[0]), float(present[-1]))
+
+
+def tone_lut(histogram, brightness, equalize, gamma):
+    # Brightness gamma, optional histogram equalisation and gamma
+    # correction folded into one float LUT from uint8 values to [0, 1]
+    brightness_lut = gamma_lut(brightness)
+    if not equalize:
+        return gamma_lut(gamma)[brightness_lut] / np.float32(255)
+
+    # Equalise the brightness-adjusted values with their own histogram
+    adjusted = np.bincount(brightness_lut, weights=histogram.counts, minlength=256)
+    centres, cdf = equalization_cdf(_uint8_histogram(adjusted.astype(np.int64)))
+    return (np.interp(brightness_lut, centres, cdf) ** gamma).astype(np.float32)
+
+
+def _sharpen_block(image, tones, start, stop, radius, amount):
+    # skimage unsharp_mask (channels blurred like any other axis, reflected
+    # edges, clipped to [0, 1]) on rows start:stop, read with enough halo
+    # rows for the blur to match the whole-image result, then img_as_ubyte
+    halo = int(GAUSSIAN_TRUNCATE * radius + 0.5)
+    halo_start, halo_stop = max(start - halo, 0), min(stop + halo, image.shape[0])
+    block = tones[np.asarray(image[halo_start:halo_stop])]
+    if amount:
+        blurred = gaussian_filter(block, sigma=radius, mode='reflect',
+                                  truncate=GAUSSIAN_TRUNCATE)
+        block += (block - blurred) * np.float32(amount)
+        np.clip(block, 0, 1, out=block)
+    block = block[start - halo_start:block.shape[0] - (halo_stop - stop)]
+    return np.rint(block * 255).astype(np.uint8)
+
+
+def enhance_image(image, brightness=0.5, equalize=False, gamma=1.0, sharpness=1.0,
+                  stretch=0, level=1.0, radius=1, histogram=None,
+                  block_rows=EXPORT_BLOCK_ROWS, workers=None):
+    # The Color Composite enhancement chain (brightness gamma, histogram
+    # equalisation, gamma correction, unsharp mask, percentile stretch and
+    # a final gamma) on a uint8 image. Point operations run as lookup
+    # tables; the unsharp mask runs in parallel row blocks. `histogram`
+    # (stats.band_histogram of the image) may be passed when the caller
+    # already has it.
+    if histogram is None:
+        histogram = band_histogram(image, block_rows=block_rows)
+    tones = tone_lut(histogram, brightness, equalize, gamma)
+
+    rows = image.shape[0]
+    sharpened = np.empty(image.shape, dtype=np.uint8)
+    counts = np.zeros((math.ceil(rows / block_rows), 256), dtype=np.int64)
+
+    def sharpen(index):
+        start = index * block_rows
+        stop = min(start + block_rows, rows)
+        sharpened[start:stop] = _sharpen_block(image, tones, start, stop, radius, sharpness)
+        if stretch > 0:
+            counts[index] = np.bincount(sharpened[start:stop].ravel(), minlength=256)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        list(executor.map(sharpen, range(len(counts))))
+
+    # Stretch and final gamma read the sharpened histogram, so they are
+    # applied as one combined LUT after all blocks are done
+    final_lut = gamma_lut(level)
+    if stretch > 0:
+        final_lut = final_lut[stretch_lut(_uint8_histogram(counts.sum(axis=0)), stretch)]
+    if not np.array_equal(final_lut, _RAMP):
+        for start in range(0, rows, block_rows):
+            sharpened[start:start + block_rows] = final_lut[sharpened[start:start + block_rows]]
+    return sharpened
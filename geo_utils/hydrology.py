@@ -0,0 +1,275 @@
+import numpy as np
+from skimage.morphology import reconstruction
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import cache_budget
+from geo_utils.terrain import cell_size
+
+
+# ESRI D8 direction codes and the (row, col) step each one points to.
+# 0 marks outlets and cells that do not drain anywhere.
+D8_CODES = np.array([1, 2, 4, 8, 16, 32, 64, 128], dtype=np.uint8)
+D8_STEPS = [(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)]
+
+_hydrology_cache = LRUCache(cache_budget('hydrology'))
+
+
+def _valid_mask(dem_array, nodata):
+    valid = np.isfinite(dem_array)
+    if nodata is not None:
+        valid &= dem_array != nodata
+    return valid
+
+
+def fill_depressions(dem_array, nodata=None):
+    # Raise every pit to its spill elevation. Morphological reconstruction
+    # by erosion from the raster edges (and nodata holes) is a priority
+    # flood: cells are settled in order of the lowest path to an outlet.
+    valid = _valid_mask(dem_array, nodata)
+    elevation = np.where(valid, dem_array, 0).astype(np.float32)
+    if not valid.any():
+        return elevation
+
+    # Nodata cells become the lowest cells of the grid, so terrain next to
+    # them drains into them like into the raster edge
+    elevation[~valid] = elevation[valid].min() - 1
+
+    seed = np.full_like(elevation, elevation.max())
+    seed[0, :], seed[-1, :] = elevation[0, :], elevation[-1, :]
+    seed[:, 0], seed[:, -1] = elevation[:, 0], elevation[:, -1]
+    seed[~valid] = elevation[~valid]
+
+    filled = reconstruction(seed, elevation, method='erosion')
+    filled[~valid] = np.nan
+    return filled
+
+
+def d8_flow_directions(filled, dx=1.0, dy=1.0):
+    # Steepest-descent D8 direction per cell of a depression-filled DEM.
+    # Flats left by the filling drain towards their nearest outlet by a
+    # breadth-first search over cells of equal elevation.
+    rows, cols = filled.shape
+    width = cols + 2
+
+    # Pad with NaN walls so neighbour indices never leave the array
+    padded = np.pad(filled, 1, constant_values=np.nan)
+    valid = np.isfinite(padded)
+    height = np.where(valid, padded, -np.inf)
+
+    # Nodata cells act as sinks at -inf; the walls never receive flow
+    walls = np.zeros_like(valid)
+    walls[0, :] = walls[-1, :] = walls[:, 0] = walls[:, -1] = True
+    height[walls] = np.inf
+
+    centre = height[1:-1, 1:-1]
+    best_drop = np.zeros((rows, cols), dtype=np.float32)
+    direction = np.zeros((rows, cols), dtype=np.uint8)
+    for code, (dr, dc) in zip(D8_CODES, D8_STEPS):
+        neighbour = height[1 + dr:rows + 1 + dr, 1 + dc:cols + 1 + dc]
+        with np.errstate(invalid='ignore'):
+            drop = (centre - neighbour) / np.hypot(dr * dy, dc * dx)
+        steeper = drop > best_drop
+        best_drop[steeper] = drop[steeper]
+        direction[steeper] = code
+    direction[~valid[1:-1, 1:-1]] = 0
+
+    # Cells on the raster edge without a lower neighbour drain off the grid
+    edge = np.zeros((rows, cols), dtype=bool)
+    edge[0, :] = edge[-1, :] = edge[:, 0] = edge[:, -1] = True
+    unresolved = np.zeros(valid.shape, dtype=bool)
+    unresolved[1:-1, 1:-1] = valid[1:-1, 1:-1] & (direction == 0) & ~edge
+    if not unresolved.any():
+        return direction
+
+    # Breadth-first search from resolved cells into equal-elevation flats
+    flat_direction = np.pad(direction, 1)
+    flat_height = padded.ravel()
+    unresolved = unresolved.ravel()
+    flat_direction = flat_direction.ravel()
+    offsets = [dr * width + dc for dr, dc in D8_STEPS]
+
+    resolved = valid.ravel() & ~unresolved
+    touching = np.zeros(valid.size, dtype=bool)
+    for offset in offsets:
+        touching |= np.roll(unresolved, offset)
+    frontier = np.flatnonzero(resolved & touching)
+
+    while frontier.size:
+        reached = []
+        for code, offset in zip(D8_CODES, offsets):
+            neighbours = frontier + offset
+            take = unresolved[neighbours] & (
+                flat_height[neighbours] == flat_height[frontier])
+            neighbours = np.unique(neighbours[take])
+            if neighbours.size:
+                # The neighbour drains back into the frontier cell, i.e.
+                # in the opposite direction of `code`
+                flat_direction[neighbours] = _opposite(code)
+                unresolved[neighbours] = False
+                reached.append(neighbours)
+        frontier = np.concatenate(reached) if reached else frontier[:0]
+
+    return flat_direction.reshape(rows + 2, cols + 2)[1:-1, 1:-1]
+
+
+def _opposite(code):
+    return D8_CODES[(int(np.log2(code)) + 4) % 8]
+
+
+def flow_receivers(direction):
+    # Flat index of the downstream cell of every cell, -1 for outlets
+    rows, cols = direction.shape
+    receivers = np.full(direction.size, -1, dtype=np.int64)
+    flat_direction = direction.ravel()
+    index = np.arange(direction.size, dtype=np.int64)
+    row, col = np.divmod(index, cols)
+    for code, (dr, dc) in zip(D8_CODES, D8_STEPS):
+        cells = flat_direction == code
+        target_row, target_col = row[cells] + dr, col[cells] + dc
+        inside = ((target_row >= 0) & (target_row < rows) &
+                  (target_col >= 0) & (target_col < cols))
+        receivers[index[cells][inside]] = (target_row[inside] * cols +
+                                           target_col[inside])
+    return receivers
+
+
+def flow_accumulation(direction, valid=None):
+    # Number of cells draining through every cell (itself included).
+    # Cells are visited in topological order (Kahn's algorithm): each step
+    # processes the whole front of cells whose donors are all finished, so
+    # the work is linear in the number of cells and nothing recurses.
+    receivers = flow_receivers(direction)
+    if valid is None:
+        valid = np.ones(direction.size, dtype=bool)
+    else:
+        valid = valid.ravel()
+
+    # Flow into nodata cells leaves the grid
+    draining = receivers >= 0
+    draining[draining] = valid[receivers[draining]]
+    receivers[~draining] = -1
+
+    accumulation = valid.astype(np.uint32)
+    donors = np.bincount(receivers[draining], minlength=direction.size)
+
+    frontier = np.flatnonzero(valid & (donors == 0))
+    while frontier.size:
+        frontier = frontier[receivers[frontier] >= 0]
+        targets, inverse = np.unique(receivers[frontier], return_inverse=True)
+        accumulation[targets] += np.bincount(
+            inverse, weights=accumulation[frontier]).astype(np.uint32)
+        donors[targets] -= np.bincount(inverse)
+        frontier = targets[donors[targets] == 0]
+
+    return accumulation.reshape(direction.shape)
+
+
+def dem_flow(dem):
+    # Cached D8 directions and flow accumulation for a DemData. The
+    # accumulation is returned as contributing area in square metres.
+    key = (dem.key, dem.array.shape, tuple(dem.transform))
+
+    def compute():
+        dx, dy = cell_size(dem.transform, dem.crs, dem.array.shape)
+        filled = fill_depressions(dem.array, dem.nodata)
+        direction = d8_flow_directions(filled, dx, dy)
+        accumulation = flow_accumulation(direction, np.isfinite(filled))
+        area = accumulation.astype(np.float32) * np.float32(dx * dy)
+        for values in (filled, direction, area):
+            values.flags.writeable = False
+        return {'filled': filled, 'direction': direction, 'area': area}
+
+    return _hydrology_cache.get_or_compute(key, compute)
+
+
+def extract_streams(contributing_area, threshold_area):
+    # Stream cells are those draining at least `threshold_area` (m^2)
+    return contributing_area >= threshold_area
+
+
+def flood_seeds(shape, points=(), edges=False, streams=None):
+    # Cells water enters from: user (row, col) points, the raster edges
+    # and/or a stream mask
+    seeds = np.zeros(shape, dtype=bool)
+    for row, col in points:
+        if 0 <= row < shape[0] and 0 <= col < shape[1]:
+            seeds[int(row), int(col)] = True
+    if edges:
+        seeds[0, :] = seeds[-1, :] = seeds[:, 0] = seeds[:, -1] = True
+    if streams is not None:
+        seeds |= streams
+    return seeds
+
+
+def spill_levels(dem_array, seeds, nodata=None):
+    # Lowest water level at which every cell is connected to a seed: the
+    # minimum over all paths from the seeds of the highest cell crossed.
+    # This is the same priority flood as fill_depressions, seeded from the
+    # water sources instead of the outlets; a cell is inundated at level L
+    # exactly when its spill level is <= L. Nodata cells block the water
+    # and get NaN.
+    valid = _valid_mask(dem_array, nodata)
+    seeds = seeds & valid
+    levels = np.full(dem_array.shape, np.nan, dtype=np.float32)
+    if not seeds.any():
+        return levels
+
+    elevation = np.where(valid, dem_array, 0).astype(np.float32)
+    wall = elevation[valid].max() + 1
+    elevation[~valid] = wall
+
+    marker = np.full_like(elevation, wall)
+    marker[seeds] = elevation[seeds]
+    filled = reconstruction(marker, elevation, method='erosion')
+
+    # Cells cut off from every seed by nodata stay dry at any level
+    reachable = valid & (filled < wall)
+    levels[reachable] = filled[reachable]
+    return levels
+
+
+def dem_spill_levels(dem, points=(), edges=False, stream_area=None):
+    # Cached spill levels of a DemData for a set of water sources.
+    # `stream_area` (m^2) seeds every stream cell draining at least that area.
+    points = tuple((int(row), int(col)) for row, col in points)
+    key = (dem.key, dem.array.shape, tuple(dem.transform), 'spill', points, edges, stream_area)
+
+    def compute():
+        streams = None
+        if stream_area is not None:
+            streams = extract_streams(dem_flow(dem)['area'], stream_area)
+        seeds = flood_seeds(dem.array.shape, points, edges, streams)
+        levels = spill_levels(dem.array, seeds, dem.nodata)
+        levels.flags.writeable = False
+        return levels
+
+    return _hydrology_cache.get_or_compute(key, compute)
+
+
+def inundation(dem_array, spill, level, cell_area=1.0):
+    # Flooded extent, water depth (NaN where dry) and volume (cell_area
+    # units x elevation units) for one water level
+    with np.errstate(invalid='ignore'):
+        flooded = spill <= level
+    depth = np.full(dem_array.shape, np.nan, dtype=np.float32)
+    depth[flooded] = level - dem_array[flooded]
+    volume = float(depth[flooded].sum(dtype=np.float64)) * cell_area
+    return flooded, depth, volume
+
+
+def inundation_sweep(dem_array, spill, levels, cell_area=1.0):
+    # Flooded area and volume for many water levels in one pass. Cells are
+    # ordered by spill level once; for a level L the flooded cells are a
+    # prefix of that order, so with a running sum of their elevations the
+    # volume is count * L - sum(elevation), read off per level.
+    flooded = np.isfinite(spill)
+    order = np.argsort(spill[flooded], kind='stable')
+    sorted_spill = spill[flooded][order]
+    elevation_sum = np.concatenate([[0.0], np.cumsum(
+        np.asarray(dem_array)[flooded][order], dtype=np.float64)])
+
+    levels = np.asarray(levels, dtype=np.float64)
+    counts = np.searchsorted(sorted_spill, levels, side='right')
+    areas = counts * cell_area
+    volumes = (counts * levels - elevation_sum[counts]) * cell_area
+    return areas, volumes
@@ -0,0 +1,103 @@
+import numpy as np
+
+from geo_utils.bandmath import band_math_many, calculate_ndvi, compile_expression
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import cache_budget
+from geo_utils.terrain import BLOCK_ROWS
+
+
+# Band roles an index can refer to
+SPECTRAL_BANDS = ('blue', 'green', 'red', 'nir', 'swir1', 'swir2')
+
+# Index name -> (band math expression, value range for display). SAVI, EVI
+# and MSAVI expect surface reflectance in 0..1, so bands stored as scaled
+# integers need their reflectance scale factor.
+SPECTRAL_INDICES = {
+    'NDVI': ('(nir - red) / (nir + red)', (-1.0, 1.0)),
+    'NDWI': ('(green - nir) / (green + nir)', (-1.0, 1.0)),
+    'SAVI': ('1.5 * (nir - red) / (nir + red + 0.5)', (-1.0, 1.0)),
+    'EVI': ('2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)', (-1.0, 1.0)),
+    'MSAVI': ('(2 * nir + 1 - sqrt((2 * nir + 1) ** 2 - 8 * (nir - red))) / 2', (-1.0, 1.0)),
+    'NDBI': ('(swir1 - nir) / (swir1 + nir)', (-1.0, 1.0)),
+    'NBR': ('(nir - swir2) / (nir + swir2)', (-1.0, 1.0)),
+}
+
+_index_cache = LRUCache(cache_budget('indices'))
+
+
+def index_bands(name):
+    # Band roles used by a spectral index
+    return compile_expression(SPECTRAL_INDICES[name][0])[1]
+
+
+def available_indices(band_roles):
+    # Indices whose bands have all been assigned
+    return [name for name in SPECTRAL_INDICES if index_bands(name) <= set(band_roles)]
+
+
+def spectral_indices(names, bands, scale=1.0, nodata=None):
+    # Compute the requested indices in one blocked pass. `bands` maps band
+    # roles to DemData (one per band of the scene); every band is read once
+    # per block and shared by all the indices that use it. Returns one
+    # float32 layer per index.
+    names = tuple(names)
+    used = set().union(*(index_bands(name) for name in names)) if names else set()
+    missing = used - set(bands)
+    if missing:
+        raise ValueError('Assign the {} band(s) first'.format(', '.join(sorted(missing))))
+
+    key = (tuple(sorted((role, bands[role].key, bands[role].array.shape) for role in used)),
+           names, scale, nodata)
+
+    def compute():
+        arrays = {role: bands[role].array for role in used}
+        band_nodata = {role: nodata if nodata is not None else bands[role].nodata
+                       for role in used}
+        layers = band_math_many(
+            {name: SPECTRAL_INDICES[name][0] for name in names}, arrays,
+            scales={role: scale for role in used}, nodata=band_nodata)
+        for layer in layers.values():
+            layer.flags.writeable = False
+        return layers
+
+    return _index_cache.get_or_compute(key, compute)
+
+
+def cached_ndvi(key, red_band, nir_band, ranges=None, nodata=(None, None)):
+    # bandmath.calculate_ndvi cached by the identity of the two bands, so
+    # class thresholds and other widgets never recompute it
+    cache_key = (key, 'ndvi', tuple(map(tuple, ranges or ())), tuple(nodata))
+
+    def compute():
+        ndvi = calculate_ndvi(red_band, nir_band, ranges, nodata)
+        ndvi.flags.writeable = False
+        return ndvi
+
+    return _index_cache.get_or_compute(cache_key, compute)
+
+
+# Class of NaN / nodata cells in a label raster
+NODATA_CLASS = 255
+
+# Default NDVI classes as the NDVI pages have always drawn them:
+# water below 0, vegetation from 0 to 0.2 and soil from 0.2
+NDVI_CLASSES = ('Water', 'Vegetation', 'Soil')
+NDVI_THRESHOLDS = (0.0, 0.2)
+
+
+def classify_index(values, thresholds, block_rows=BLOCK_ROWS):
+    # One uint8 label raster: class k holds the values between
+    # thresholds[k - 1] and thresholds[k], via np.digitize in row blocks
+    thresholds = np.sort(np.asarray(thresholds, dtype=np.float64))
+    labels = np.empty(values.shape, dtype=np.uint8)
+    for start in range(0, values.shape[0], block_rows):
+        block = values[start:start + block_rows]
+        block_labels = np.digitize(block, thresholds).astype(np.uint8)
+        block_labels[~np.isfinite(block)] = NODATA_CLASS
+        labels[start:start + block_rows] = block_labels
+    return labels
+
+
+def class_counts(labels, class_count):
+    # Pixel count of every class (nodata excluded) with one bincount
+    return np.bincount(labels.ravel(), minlength=NODATA_CLASS + 1)[:class_count]
@@ -0,0 +1,85 @@
+import numpy as np
+from affine import Affine
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import DemData, cache_budget
+
+
+# Default number of vertices sent to the browser for a 3D view
+DEFAULT_VERTEX_BUDGET = 250_000
+
+# Source rows reduced at a time, to keep float temporaries small
+CHUNK_ROWS = 2048
+
+_mesh_cache = LRUCache(cache_budget('mesh'))
+
+
+def block_mean(dem_array, factor, nodata=None):
+    # Average non-overlapping factor x factor blocks, ignoring nodata/NaN.
+    # Edge blocks that are only partly inside the raster use the cells they
+    # have.
+    rows, cols = dem_array.shape
+    out_rows, out_cols = -(-rows // factor), -(-cols // factor)
+    result = np.empty((out_rows, out_cols), dtype=np.float32)
+
+    chunk = max(1, CHUNK_ROWS // factor) * factor
+    padded_cols = out_cols * factor
+    for row_start in range(0, rows, chunk):
+        block = np.asarray(dem_array[row_start:row_start + chunk], dtype=np.float32)
+        if nodata is not None:
+            block = np.where(block == nodata, np.float32(np.nan), block)
+        block_rows = -(-block.shape[0] // factor) * factor
+        block = np.pad(block, ((0, block_rows - block.shape[0]), (0, padded_cols - cols)),
+                       constant_values=np.nan)
+        block = block.reshape(block_rows // factor, factor, out_cols, factor)
+
+        valid = np.isfinite(block)
+        totals = np.where(valid, block, 0).sum(axis=(1, 3))
+        counts = valid.sum(axis=(1, 3))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+        out_start = row_start // factor
+        result[out_start:out_start + means.shape[0]] = np.where(counts > 0, means, np.nan)
+    return result
+
+
+def decimation_factor(shape, max_vertices=DEFAULT_VERTEX_BUDGET):
+    # Smallest block size that brings a grid within the vertex budget
+    rows, cols = shape
+    return max(1, int(np.ceil(np.sqrt(rows * cols / max_vertices))))
+
+
+def decimate_dem(dem, max_vertices=DEFAULT_VERTEX_BUDGET):
+    # Level-of-detail copy of a DemData with at most `max_vertices` cells,
+    # built by block-mean downsampling. The transform is scaled to the new
+    # grid so coordinates stay georeferenced; nodata becomes NaN.
+    factor = decimation_factor(dem.array.shape, max_vertices)
+    key = (dem.key, dem.array.shape, tuple(dem.transform), factor)
+
+    def compute():
+        if factor == 1:
+            array = np.asarray(dem.array, dtype=np.float32)
+            if dem.nodata is not None:
+                array = np.where(array == dem.nodata, np.float32(np.nan), array)
+        else:
+            array = block_mean(dem.array, factor, dem.nodata)
+        array.flags.writeable = False
+        return DemData(array, dem.transform * Affine.scale(factor), dem.crs, None, dem.key)
+
+    return _mesh_cache.get_or_compute(key, compute)
+
+
+def crop_dem(dem, row_start, row_stop, col_start, col_stop):
+    # Sub-region of a DemData with its transform moved to the region origin
+    array = dem.array[row_start:row_stop, col_start:col_stop]
+    return DemData(array, dem.transform * Affine.translation(col_start, row_start),
+                   dem.crs, dem.nodata, dem.key)
+
+
+def mesh_coordinates(dem):
+    # Map x coordinates of the columns and y coordinates of the rows of a
+    # DemData grid (pixel centres), for plotly surfaces and scatters
+    rows, cols = dem.array.shape
+    x = dem.transform.c + (np.arange(cols) + 0.5) * dem.transform.a
+    y = dem.transform.f + (np.arange(rows) + 0.5) * dem.transform.e
+    return x, y
@@ -0,0 +1,144 @@
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+from geo_utils.cache import LRUCache
+from geo_utils.hydrology import dem_flow, extract_streams
+from geo_utils.raster_io import cache_budget
+from geo_utils.terrain import BLOCK_ROWS, cell_size, dem_terrain
+
+
+# Factors the overlay can combine
+OVERLAY_FACTORS = ('elevation', 'slope', 'aspect', 'curvature', 'ndvi', 'stream_distance')
+
+# Score given to cells whose factor value is missing
+NODATA_SCORE = 255
+
+# Cells draining at least this area (m^2) count as streams
+DEFAULT_STREAM_AREA = 1e6
+
+# Default reclassification tables: `breaks` split the factor values into
+# classes (np.digitize) and `scores` (one more than breaks) rate each class
+# from 1 (least) to 5 (most suitable / susceptible). Elevation has no fixed
+# breaks because they depend on the area; pages derive them from quantiles.
+RECLASS_TABLES = {
+    'cultivation': {
+        'elevation': {'breaks': None, 'scores': (5, 4, 3, 2, 1)},
+        'slope': {'breaks': (2, 5, 10, 15, 25), 'scores': (5, 5, 4, 3, 2, 1)},
+        'aspect': {'breaks': (0, 45, 135, 225, 315), 'scores': (3, 2, 3, 4, 3, 2)},
+        'curvature': {'breaks': (-0.5, 0.5), 'scores': (4, 5, 3)},
+        'ndvi': {'breaks': (0, 0.2, 0.5), 'scores': (1, 2, 4, 5)},
+        'stream_distance': {'breaks': (100, 500, 1000, 2000), 'scores': (5, 4, 3, 2, 1)},
+    },
+    'landslide': {
+        'elevation': {'breaks': None, 'scores': (1, 2, 3, 4, 4)},
+        'slope': {'breaks': (5, 15, 25, 35, 45), 'scores': (1, 2, 3, 4, 5, 5)},
+        'aspect': {'breaks': (0, 45, 135, 225, 315), 'scores': (1, 2, 3, 3, 3, 2)},
+        'curvature': {'breaks': (-0.5, 0.5), 'scores': (4, 2, 3)},
+        'ndvi': {'breaks': (0, 0.2, 0.5), 'scores': (5, 4, 2, 1)},
+        'stream_distance': {'breaks': (100, 500, 1000, 2000), 'scores': (5, 4, 3, 2, 1)},
+    },
+}
+
+_factor_cache = LRUCache(cache_budget('overlay'))
+
+
+def dem_factor(dem, name, stream_area=DEFAULT_STREAM_AREA):
+    # Factor raster derived from a DemData: elevation, slope (degrees),
+    # aspect (degrees, -1 on flats), curvature (1/100 m) or distance to the
+    # nearest stream (metres). Missing cells are NaN.
+    if name == 'elevation':
+        return dem.array
+    if name in ('slope', 'aspect', 'curvature'):
+        return dem_terrain(dem, products=(name,))[name]
+    if name != 'stream_distance':
+        raise ValueError('Unknown DEM factor {!r}'.format(name))
+
+    key = (dem.key, dem.array.shape, tuple(dem.transform), 'stream_distance', stream_area)
+
+    def compute():
+        area = dem_flow(dem)['area']
+        dx, dy = cell_size(dem.transform, dem.crs, dem.array.shape)
+        streams = extract_streams(area, stream_area)
+        distance = distance_transform_edt(~streams, sampling=(dy, dx)).astype(np.float32)
+        distance[~np.isfinite(area)] = np.nan
+        distance.flags.writeable = False
+        return distance
+
+    return _factor_cache.get_or_compute(key, compute)
+
+
+def ndvi_factor(red, nir):
+    # Standard NDVI from red and near-infrared DemData on the DEM grid.
+    # DemData keys carry the band number, so two bands of one scene never
+    # share a cache entry.
+    if red.array.shape != nir.array.shape:
+        raise ValueError('Red and NIR rasters must have the same shape')
+    key = (red.key, nir.key, red.array.shape, 'ndvi')
+
+    def compute():
+        red_band = red.array.astype(np.float32)
+        nir_band = nir.array.astype(np.float32)
+        total = nir_band + red_band
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ndvi = np.where(total != 0, (nir_band - red_band) / total, np.nan)
+        for band in (red, nir):
+            if band.nodata is not None:
+                ndvi[band.array == band.nodata] = np.nan
+        ndvi = ndvi.astype(np.float32)
+        ndvi.flags.writeable = False
+        return ndvi
+
+    return _factor_cache.get_or_compute(key, compute)
+
+
+def reclassify(array, breaks, scores, nodata=None):
+    # Class scores (uint8) through a lookup table indexed by np.digitize;
+    # NaN and nodata cells get NODATA_SCORE
+    if len(scores) != len(breaks) + 1:
+        raise ValueError('Reclassification needs one more score than breaks')
+    lut = np.asarray(scores, dtype=np.uint8)
+    scored = np.empty(array.shape, dtype=np.uint8)
+    for start in range(0, array.shape[0], BLOCK_ROWS):
+        block = np.asarray(array[start:start + BLOCK_ROWS])
+        scored_block = lut[np.digitize(block, breaks)]
+        invalid = ~np.isfinite(block) if block.dtype.kind == 'f' else np.zeros(block.shape, bool)
+        if nodata is not None:
+            invalid |= block == nodata
+        scored_block[invalid] = NODATA_SCORE
+        scored[start:start + BLOCK_ROWS] = scored_block
+    return scored
+
+
+def cached_reclassify(key, array, breaks, scores, nodata=None):
+    # Reclassified factor cached by the factor's identity and its table, so
+    # changing weights never reclassifies
+    cache_key = (key, tuple(breaks), tuple(scores))
+
+    def compute():
+        scored = reclassify(array, breaks, scores, nodata)
+        scored.flags.writeable = False
+        return scored
+
+    return _factor_cache.get_or_compute(cache_key, compute)
+
+
+def weighted_overlay(scored_factors, weights, block_rows=BLOCK_ROWS):
+    # Weighted mean of reclassified factors, in float32 row blocks. Weights
+    # are normalised to sum to one; cells missing any factor are NaN.
+    weights = np.asarray(weights, dtype=np.float32)
+    if not len(scored_factors) or weights.sum() <= 0:
+        raise ValueError('The overlay needs at least one factor with a positive weight')
+    weights = weights / weights.sum()
+
+    rows = scored_factors[0].shape[0]
+    result = np.empty(scored_factors[0].shape, dtype=np.float32)
+    for start in range(0, rows, block_rows):
+        total = np.zeros(result[start:start + block_rows].shape, dtype=np.float32)
+        missing = np.zeros(total.shape, dtype=bool)
+        for scored, weight in zip(scored_factors, weights):
+            block = scored[start:start + block_rows]
+            missing |= block == NODATA_SCORE
+            total += weight * block
+        total[missing] = np.nan
+        result[start:start + block_rows] = total
+    return result
@@ -0,0 +1,250 @@
+import math
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import cache_budget, dataset_path, file_digest
+from geo_utils.tiles import MERCATOR_EXTENT, TILE_SIZE
+
+
+# Bytes of CSV text parsed per streamed batch
+CSV_BLOCK_BYTES = 16 * 1024 * 1024
+
+# Rows shown when previewing a CSV
+PREVIEW_ROWS = 5
+
+# Rough memory held by one shapely point, for cache accounting
+POINT_BYTES = 100
+
+# Raw points are only sent to the map when this few fall in the view
+RAW_POINT_BUDGET = int(os.environ.get('GEO_APP_RAW_POINT_BUDGET', 200_000))
+
+# Screen size (pixels) of one aggregate cell at the zoom it is built for
+AGGREGATE_CELL_PIXELS = 24
+
+# Map size (pixels) assumed when working out what a zoom level shows
+MAP_WIDTH = 1000
+MAP_HEIGHT = 600
+
+# Web Mercator stops at this latitude
+MAX_LATITUDE = 85.05112878
+
+# Point aggregation shapes
+AGGREGATE_KINDS = ('hexagon', 'grid')
+
+_points_cache = LRUCache(cache_budget('points'))
+
+
+def csv_preview(uploaded_file, rows=PREVIEW_ROWS):
+    # Column names and the first rows of a CSV, parsing only its first block
+    reader = pa_csv.open_csv(dataset_path(uploaded_file),
+                             read_options=pa_csv.ReadOptions(block_size=1024 * 1024))
+    try:
+        batch = reader.read_next_batch()
+    except StopIteration:
+        return reader.schema.names, pd.DataFrame(columns=reader.schema.names)
+    return reader.schema.names, batch.slice(0, rows).to_pandas()
+
+
+def _csv_batches(path, columns, column_types, block_size):
+    # Record batches holding only the wanted columns
+    return pa_csv.open_csv(
+        path, read_options=pa_csv.ReadOptions(block_size=block_size),
+        convert_options=pa_csv.ConvertOptions(include_columns=columns,
+                                              column_types=column_types))
+
+
+def _coordinates(batch, column):
+    # float64 values of a coordinate column, NaN where missing or not a number
+    values = batch.column(column)
+    if pa.types.is_string(values.type):
+        return pd.to_numeric(values.to_pandas(), errors='coerce').to_numpy(dtype=np.float64)
+    return values.to_numpy(zero_copy_only=False).astype(np.float64, copy=False)
+
+
+def read_points(uploaded_file, latitude_col, longitude_col, columns=(),
+                block_size=CSV_BLOCK_BYTES):
+    # WGS84 GeoDataFrame of the points of a CSV, streamed in batches with
+    # pyarrow reading only the coordinate and requested columns. Rows whose
+    # latitude / longitude is missing or outside [-90, 90] / [-180, 180]
+    # are dropped on the way. Geometry is one vectorized points_from_xy
+    # array. Returns the GeoDataFrame and the number of dropped rows.
+    coordinate_columns = list(dict.fromkeys([latitude_col, longitude_col]))
+    wanted = coordinate_columns + [column for column in dict.fromkeys(columns)
+                                   if column not in coordinate_columns]
+    path = dataset_path(uploaded_file)
+
+    def collect(coordinate_type, other_type=None):
+        latitudes, longitudes, tables = [], [], []
+        dropped = 0
+        column_types = {column: other_type for column in wanted} if other_type else {}
+        column_types.update({column: coordinate_type for column in coordinate_columns})
+        for batch in _csv_batches(path, wanted, column_types, block_size):
+            latitude = _coordinates(batch, latitude_col)
+            longitude = _coordinates(batch, longitude_col)
+            with np.errstate(invalid='ignore'):
+                valid = (np.abs(latitude) <= 90) & (np.abs(longitude) <= 180)
+            dropped += int(len(valid) - valid.sum())
+            latitudes.append(latitude[valid])
+            longitudes.append(longitude[valid])
+            tables.append(pa.Table.from_batches([batch]).filter(pa.array(valid)))
+        return latitudes, longitudes, tables, dropped
+
+    # Types are inferred from the first block. When a later block does not
+    # fit them (e.g. integers, then text), the other columns are re-read as
+    # strings, and then coordinates holding text that is not a number are
+    # re-read as strings and converted batch by batch
+    for coordinate_type, other_type in ((pa.float64(), None), (pa.float64(), pa.string()),
+                                        (pa.string(), pa.string())):
+        try:
+            latitudes, longitudes, tables, dropped = collect(coordinate_type, other_type)
+            break
+        except pa.ArrowInvalid:
+            if coordinate_type == pa.string():
+                raise
+
+    if not tables:
+        return gpd.GeoDataFrame(columns=wanted, geometry=[], crs='EPSG:4326'), dropped
+    latitude = np.concatenate(latitudes)
+    longitude = np.concatenate(longitudes)
+    data = pa.concat_tables(tables).drop_columns(coordinate_columns).to_pandas()
+    data.insert(0, latitude_col, latitude)
+    if longitude_col != latitude_col:
+        data.insert(1, longitude_col, longitude)
+    geometry = gpd.points_from_xy(longitude, latitude, crs='EPSG:4326')
+    return gpd.GeoDataFrame(data, geometry=geometry), dropped
+
+
+def cached_points(uploaded_file, latitude_col, longitude_col, columns=()):
+    # read_points cached by the CSV's content hash and the selected columns
+    key = (file_digest(uploaded_file), 'points', latitude_col, longitude_col, tuple(columns))
+
+    def sizeof(result):
+        gdf = result[0]
+        return int(gdf.memory_usage(index=True, deep=True).sum()) + len(gdf) * POINT_BYTES
+
+    return _points_cache.get_or_compute(
+        key, lambda: read_points(uploaded_file, latitude_col, longitude_col, columns), sizeof)
+
+
+def to_mercator(longitude, latitude):
+    # Web Mercator x / y (metres) of WGS84 coordinates
+    latitude = np.clip(latitude, -MAX_LATITUDE, MAX_LATITUDE)
+    x = np.radians(longitude) * (MERCATOR_EXTENT / math.pi)
+    y = np.log(np.tan(np.pi / 4 + np.radians(latitude) / 2)) * (MERCATOR_EXTENT / math.pi)
+    return x, y
+
+
+def from_mercator(x, y):
+    # WGS84 longitude / latitude of Web Mercator coordinates
+    longitude = np.degrees(np.asarray(x) / (MERCATOR_EXTENT / math.pi))
+    latitude = np.degrees(2 * np.arctan(np.exp(np.asarray(y) / (MERCATOR_EXTENT / math.pi))) - np.pi / 2)
+    return longitude, latitude
+
+
+def cached_mercator(key, longitude, latitude):
+    # to_mercator of every point, cached with the points so each rerun only
+    # compares coordinates against the view
+    def compute():
+        x, y = to_mercator(np.asarray(longitude, dtype=np.float64),
+                           np.asarray(latitude, dtype=np.float64))
+        x.flags.writeable = False
+        y.flags.writeable = False
+        return x, y
+
+    return _points_cache.get_or_compute((key, 'mercator'), compute)
+
+
+def zoom_resolution(zoom):
+    # Metres (Web Mercator) per screen pixel at a zoom level
+    return 2 * MERCATOR_EXTENT / (TILE_SIZE * 2 ** zoom)
+
+
+def fit_zoom(x, y, width=MAP_WIDTH, height=MAP_HEIGHT):
+    # Largest whole zoom level whose view holds every point
+    span = max((np.max(x) - np.min(x)) / width, (np.max(y) - np.min(y)) / height)
+    if span <= 0:
+        return 15
+    return int(np.clip(math.floor(math.log2(2 * MERCATOR_EXTENT / (TILE_SIZE * span))), 0, 20))
+
+
+def view_bounds(center_x, center_y, zoom, width=MAP_WIDTH, height=MAP_HEIGHT):
+    # Web Mercator bounds (left, bottom, right, top) a map of the given
+    # size shows around a centre at a zoom level
+    half_width = width / 2 * zoom_resolution(zoom)
+    half_height = height / 2 * zoom_resolution(zoom)
+    return (center_x - half_width, center_y - half_height,
+            center_x + half_width, center_y + half_height)
+
+
+def in_view(x, y, bounds):
+    # Mask of the points inside view bounds
+    left, bottom, right, top = bounds
+    return (x >= left) & (x <= right) & (y >= bottom) & (y <= top)
+
+
+def _hexagon_cells(x, y, size):
+    # Axial coordinates of the pointy-top hexagon (circumradius `size`)
+    # holding each point, by cube rounding
+    q = (math.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+    rounded_q, rounded_r, rounded_s = np.rint(q), np.rint(r), np.rint(s)
+    q_error, r_error, s_error = (np.abs(rounded_q - q), np.abs(rounded_r - r),
+                                 np.abs(rounded_s - s))
+    fix_q = (q_error > r_error) & (q_error > s_error)
+    fix_r = ~fix_q & (r_error > s_error)
+    rounded_q[fix_q] = -rounded_r[fix_q] - rounded_s[fix_q]
+    rounded_r[fix_r] = -rounded_q[fix_r] - rounded_s[fix_r]
+    return rounded_q.astype(np.int64), rounded_r.astype(np.int64)
+
+
+def aggregate_points(x, y, cell_size, kind='hexagon'):
+    # Point counts per hexagon (circumradius `cell_size`) or square cell
+    # (side `cell_size`) in Web Mercator, as cell centre x, y and counts
+    if kind not in AGGREGATE_KINDS:
+        raise ValueError('Unknown aggregation {!r}'.format(kind))
+    if kind == 'hexagon':
+        first, second = _hexagon_cells(x, y, cell_size)
+    else:
+        first = np.floor(x / cell_size).astype(np.int64)
+        second = np.floor(y / cell_size).astype(np.int64)
+
+    # One int64 id per cell, so counting is a 1D unique
+    first_low, second_low = first.min(), second.min()
+    rows = int(second.max() - second_low) + 1
+    ids, counts = np.unique((first - first_low) * rows + (second - second_low), return_counts=True)
+    cells = np.stack([ids // rows + first_low, ids % rows + second_low], axis=1)
+    if kind == 'hexagon':
+        centre_x = cell_size * math.sqrt(3) * (cells[:, 0] + cells[:, 1] / 2)
+        centre_y = cell_size * 1.5 * cells[:, 1]
+    else:
+        centre_x = (cells[:, 0] + 0.5) * cell_size
+        centre_y = (cells[:, 1] + 0.5) * cell_size
+    return centre_x, centre_y, counts
+
+
+def cached_aggregates(key, x, y, zoom, kind='hexagon'):
+    # aggregate_points of all points with cells sized for a zoom level,
+    # cached per zoom so panning and returning to a zoom reuse them
+    def compute():
+        return aggregate_points(x, y, AGGREGATE_CELL_PIXELS * zoom_resolution(zoom), kind)
+
+    return _points_cache.get_or_compute((key, 'aggregates', zoom, kind), compute)
+
+
+def cell_polygons(centre_x, centre_y, cell_size, kind='hexagon'):
+    # WGS84 outline (list of [lon, lat]) of every aggregate cell
+    if kind == 'hexagon':
+        angles = np.radians(30 + 60 * np.arange(6))
+        offsets_x, offsets_y = cell_size * np.cos(angles), cell_size * np.sin(angles)
+    else:
+        half = cell_size / 2
+        offsets_x, offsets_y = np.array([-half, half, half, -half]), np.array([-half, -half, half, half])
+    longitude, latitude = from_mercator(centre_x[:, None] + offsets_x, centre_y[:, None] + offsets_y)
+    return np.stack([longitude, latitude], axis=-1).round(6).tolist()
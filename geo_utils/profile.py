@@ -0,0 +1,133 @@
+import numpy as np
+
+from geo_utils.terrain import EARTH_RADIUS
+
+
+def bilinear_sample(dem_array, rows, cols, nodata=None):
+    # Bilinearly interpolated values at fractional array indices (pixel
+    # centres sit on whole numbers). Points outside the raster or next to
+    # nodata cells come back as NaN. Only the four neighbours of each point
+    # are read, so memory-mapped rasters are never loaded in full.
+    height, width = dem_array.shape
+    rows = np.asarray(rows, dtype=np.float64)
+    cols = np.asarray(cols, dtype=np.float64)
+
+    inside = ((rows >= -0.5) & (rows <= height - 0.5) &
+              (cols >= -0.5) & (cols <= width - 0.5))
+    rows = np.clip(rows, 0, height - 1)
+    cols = np.clip(cols, 0, width - 1)
+
+    row0 = np.minimum(np.floor(rows).astype(np.int64), max(height - 2, 0))
+    col0 = np.minimum(np.floor(cols).astype(np.int64), max(width - 2, 0))
+    row1 = np.minimum(row0 + 1, height - 1)
+    col1 = np.minimum(col0 + 1, width - 1)
+    row_weight = (rows - row0).astype(np.float32)
+    col_weight = (cols - col0).astype(np.float32)
+
+    corners = [np.asarray(dem_array[r, c], dtype=np.float32)
+               for r, c in ((row0, col0), (row0, col1), (row1, col0), (row1, col1))]
+    top = corners[0] * (1 - col_weight) + corners[1] * col_weight
+    bottom = corners[2] * (1 - col_weight) + corners[3] * col_weight
+    values = top * (1 - row_weight) + bottom * row_weight
+
+    invalid = ~inside
+    if nodata is not None:
+        for corner in corners:
+            invalid |= corner == nodata
+    return np.where(invalid, np.float32(np.nan), values)
+
+
+def pixel_to_map(transform, rows, cols):
+    # Map coordinates of fractional array indices (pixel centres)
+    x = transform.c + (np.asarray(cols) + 0.5) * transform.a + \
+        (np.asarray(rows) + 0.5) * transform.b
+    y = transform.f + (np.asarray(cols) + 0.5) * transform.d + \
+        (np.asarray(rows) + 0.5) * transform.e
+    return x, y
+
+
+def map_to_pixel(transform, x, y):
+    # Fractional array indices (pixel centres on whole numbers) of map points
+    cols, rows = ~transform * (np.asarray(x, dtype=np.float64),
+                               np.asarray(y, dtype=np.float64))
+    return rows - 0.5, cols - 0.5
+
+
+def ground_distance(x1, y1, x2, y2, crs=None):
+    # Distance in metres between map points; haversine for geographic CRSs
+    if crs is not None and crs.is_geographic:
+        lon1, lat1, lon2, lat2 = map(np.radians, (x1, y1, x2, y2))
+        a = (np.sin((lat2 - lat1) / 2) ** 2 +
+             np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+    return np.hypot(np.asarray(x2) - x1, np.asarray(y2) - y1)
+
+
+def _resample_polylines(polylines, samples, crs):
+    # Evenly spaced points along every polyline, as (lines, samples) arrays
+    xs = np.empty((len(polylines), samples))
+    ys = np.empty((len(polylines), samples))
+    for index, line in enumerate(polylines):
+        line = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+        segment = ground_distance(line[:-1, 0], line[:-1, 1],
+                                  line[1:, 0], line[1:, 1], crs)
+        vertex_distance = np.concatenate([[0.0], np.cumsum(segment)])
+        targets = np.linspace(0.0, vertex_distance[-1], samples)
+        xs[index] = np.interp(targets, vertex_distance, line[:, 0])
+        ys[index] = np.interp(targets, vertex_distance, line[:, 1])
+    return xs, ys
+
+
+def sample_profiles(dem, polylines, samples=256, pixel_coordinates=False):
+    # Terrain profiles along many polylines in one batched call.
+    # `polylines` is a sequence of (n_vertices, 2) vertex lists given as
+    # map (x, y) or, with pixel_coordinates=True, as (col, row) indices.
+    # Returns cumulative ground distance in metres and bilinearly
+    # interpolated elevations, both shaped (lines, samples), plus the map
+    # coordinates of every sample.
+    polylines = [np.asarray(line, dtype=np.float64).reshape(-1, 2)
+                 for line in polylines]
+    if pixel_coordinates:
+        polylines = [np.column_stack(pixel_to_map(dem.transform, line[:, 1], line[:, 0]))
+                     for line in polylines]
+
+    xs, ys = _resample_polylines(polylines, samples, dem.crs)
+    rows, cols = map_to_pixel(dem.transform, xs, ys)
+    elevations = bilinear_sample(dem.array, rows, cols, dem.nodata)
+
+    steps = ground_distance(xs[:, :-1], ys[:, :-1], xs[:, 1:], ys[:, 1:], dem.crs)
+    distances = np.concatenate(
+        [np.zeros((len(polylines), 1)), np.cumsum(steps, axis=1)], axis=1)
+    return distances, elevations, xs, ys
+
+
+def sample_profile(dem, polyline, samples=None, pixel_coordinates=False):
+    # Profile along a single polyline. By default one sample is taken per
+    # pixel of line length, and coincident end points give a single sample.
+    if samples is None:
+        line = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+        if pixel_coordinates:
+            pixel_length = np.hypot(*np.diff(line, axis=0).T).sum()
+        else:
+            rows, cols = map_to_pixel(dem.transform, line[:, 0], line[:, 1])
+            pixel_length = np.hypot(np.diff(rows), np.diff(cols)).sum()
+        samples = int(np.ceil(pixel_length)) + 1
+
+    distances, elevations, xs, ys = sample_profiles(
+        dem, [polyline], samples, pixel_coordinates)
+    return distances[0], elevations[0], xs[0], ys[0]
+
+
+def corridor_polylines(polyline, width, count):
+    # `count` polylines parallel to `polyline`, spread evenly across a
+    # corridor `width` map units wide (offsets applied per segment normal)
+    line = np.asarray(polyline, dtype=np.float64).reshape(-1, 2)
+    direction = np.diff(line, axis=0)
+    length = np.hypot(direction[:, 0], direction[:, 1])
+    length[length == 0] = 1
+    normal = np.column_stack([-direction[:, 1], direction[:, 0]]) / length[:, None]
+
+    # Vertex normals average the normals of the adjoining segments
+    vertex_normal = np.vstack([normal[:1], (normal[:-1] + normal[1:]) / 2, normal[-1:]])
+    offsets = np.linspace(-width / 2, width / 2, count) if count > 1 else [0.0]
+    return [line + offset * vertex_normal for offset in offsets]
@@ -0,0 +1,340 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import namedtuple
+
+import numpy as np
+import rasterio
+import tifffile
+from affine import Affine
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+from geo_utils.cache import LRUCache
+
+
+# Memory budget for decoded rasters shared by all pages and sessions
+RASTER_CACHE_BYTES = int(os.environ.get(
+    'GEO_APP_RASTER_CACHE_MB', '1024')) * 1024 * 1024
+
+# Share of RASTER_CACHE_BYTES given to each module's cache. The shares add
+# up to one, so all caches together stay within the configured budget.
+CACHE_SHARES = {
+    'raster': 0.25,
+    'terrain': 0.15,
+    'hydrology': 0.10,
+    'indices': 0.06,
+    'overlay': 0.06,
+    'threshold': 0.05,
+    'zonal': 0.04,
+    'classify': 0.04,
+    'composite': 0.04,
+    'points': 0.04,
+    'tile_layers': 0.04,
+    'preview': 0.03,
+    'mesh': 0.03,
+    'contours': 0.03,
+    'tile_levels': 0.03,
+    'histogram': 0.01,
+}
+
+# Uploads are hashed and spooled to disk in chunks of this size
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Uploads are spooled to content-addressed files in this directory, which is
+# kept under its own disk budget
+SCRATCH_DIR = os.environ.get(
+    'GEO_APP_SCRATCH_DIR', os.path.join(tempfile.gettempdir(), 'geo_app'))
+SCRATCH_MAX_BYTES = int(os.environ.get(
+    'GEO_APP_SCRATCH_MB', '10240')) * 1024 * 1024
+
+# Largest side, in pixels, of arrays served for display
+DISPLAY_MAX_SIZE = 1024
+
+# Rows written at a time when exporting GeoTIFFs
+EXPORT_BLOCK_ROWS = 1024
+
+# Overviews are built until the smallest level fits in this many pixels
+OVERVIEW_MIN_SIZE = 256
+
+# Decoded band plus the georeferencing needed by the analysis pages.
+# `key` is the content hash of the source file (with the band number for
+# any band but the first) and identifies the band in the other caches
+# (contours, histograms, indices, tiles, ...).
+DemData = namedtuple('DemData', ['array', 'transform', 'crs', 'nodata', 'key'])
+
+def cache_budget(name):
+    # Bytes of the shared memory budget that one module's cache may hold
+    return int(RASTER_CACHE_BYTES * CACHE_SHARES[name])
+
+
+_raster_cache = LRUCache(cache_budget('raster'))
+
+# Streamlit gives every upload a stable file_id, so the hash of a file only
+# has to be computed once and not on every widget interaction
+_digest_cache = LRUCache(0, max_entries=256)
+
+_scratch_lock = threading.Lock()
+_overview_lock = threading.Lock()
+
+
+def file_digest(uploaded_file):
+    # Content hash of an uploaded file, computed in chunks
+    file_id = getattr(uploaded_file, 'file_id', None)
+    if file_id is not None:
+        digest = _digest_cache.get(file_id)
+        if digest is not None:
+            return digest
+
+    digest = hashlib.blake2b(digest_size=16)
+    position = uploaded_file.tell()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(HASH_CHUNK_BYTES), b''):
+        digest.update(chunk)
+    uploaded_file.seek(position)
+    digest = digest.hexdigest()
+
+    if file_id is not None:
+        _digest_cache.put(file_id, digest, nbytes=0)
+    return digest
+
+
+def dataset_path(uploaded_file):
+    # Stream the upload once to a scratch file named after its content hash.
+    # Every reader (rasterio, tifffile, np.memmap) then opens the file from
+    # disk instead of holding extra in-memory copies of the upload.
+    key = file_digest(uploaded_file)
+    extension = os.path.splitext(getattr(uploaded_file, 'name', ''))[1]
+    path = os.path.join(SCRATCH_DIR, key + (extension.lower() or '.tif'))
+
+    if os.path.exists(path):
+        # Refresh the timestamp so eviction removes least recently used files
+        os.utime(path)
+        return path
+
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    partial_path = '{}.{}.part'.format(path, threading.get_ident())
+    position = uploaded_file.tell()
+    uploaded_file.seek(0)
+    with open(partial_path, 'wb') as scratch:
+        shutil.copyfileobj(uploaded_file, scratch, HASH_CHUNK_BYTES)
+    uploaded_file.seek(position)
+    os.replace(partial_path, path)
+
+    _evict_scratch(keep=path)
+    return path
+
+
+def _evict_scratch(keep):
+    # Remove the oldest scratch files once the directory exceeds its budget
+    with _scratch_lock:
+        entries = []
+        for entry in os.scandir(SCRATCH_DIR):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= SCRATCH_MAX_BYTES:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # Still mapped or open by another session (Windows)
+                continue
+            total_bytes -= size
+
+
+def _memmap_band(path, band):
+    # Zero-copy view of one band when the TIFF stores it uncompressed and
+    # contiguously; returns None for anything rasterio has to decode
+    try:
+        with tifffile.TiffFile(path) as tif:
+            page = tif.pages[0]
+            if not page.is_contiguous:
+                return None
+            separate = page.planarconfig == tifffile.PLANARCONFIG.SEPARATE
+        array = tifffile.memmap(path, mode='r')
+    except (ValueError, tifffile.TiffFileError):
+        return None
+
+    if array.ndim == 2:
+        return array if band == 1 else None
+    if array.ndim != 3:
+        return None
+    return array[band - 1] if separate else array[..., band - 1]
+
+
+def band_key(uploaded_file, band=1):
+    # Identity of one band of an uploaded raster for DemData.key
+    key = file_digest(uploaded_file)
+    return key if band == 1 else '{}:{}'.format(key, band)
+
+
+def load_dem(uploaded_file, band=1):
+    # Decode one band of an uploaded GeoTIFF, reusing the cached result when
+    # the same file content has already been read by any page
+    key = band_key(uploaded_file, band)
+    cache_key = (file_digest(uploaded_file), band)
+
+    dem = _raster_cache.get(cache_key)
+    if dem is None:
+        path = dataset_path(uploaded_file)
+        with rasterio.open(path) as dataset:
+            array = _memmap_band(path, band)
+            if array is None:
+                array = dataset.read(band)
+            dem = DemData(array, dataset.transform, dataset.crs,
+                          dataset.nodata, key)
+
+        # Cached arrays are shared between reruns, so guard against in-place
+        # edits leaking from one page into another
+        array.flags.writeable = False
+        _raster_cache.put(cache_key, dem)
+    return dem
+
+
+def load_image(uploaded_file):
+    # Plain (non-georeferenced) TIFF image as tifffile returns it, memory
+    # mapped when uncompressed and otherwise decoded from the scratch file
+    key = file_digest(uploaded_file)
+    cache_key = (key, 'image')
+
+    image = _raster_cache.get(cache_key)
+    if image is None:
+        path = dataset_path(uploaded_file)
+        try:
+            image = tifffile.memmap(path, mode='r')
+        except (ValueError, tifffile.TiffFileError):
+            image = tifffile.imread(path)
+            image.flags.writeable = False
+        _raster_cache.put(cache_key, image)
+    return image
+
+
+def load_photo(uploaded_file):
+    # RGB uint8 array of a JPEG / PNG photo, decoded once per file content
+    key = file_digest(uploaded_file)
+    cache_key = (key, 'photo')
+
+    image = _raster_cache.get(cache_key)
+    if image is None:
+        with Image.open(dataset_path(uploaded_file)) as photo:
+            image = np.asarray(photo.convert('RGB'))
+        image.flags.writeable = False
+        _raster_cache.put(cache_key, image)
+    return image
+
+
+def ensure_overviews(path, band=1):
+    # Build overviews when the file has none, so decimated reads
+    # come from a small pyramid level instead of the full band
+    with _overview_lock:
+        with rasterio.open(path) as dataset:
+            if dataset.overviews(band):
+                return
+            factors = []
+            factor = 2
+            while min(dataset.width, dataset.height) // factor >= OVERVIEW_MIN_SIZE:
+                factors.append(factor)
+                factor *= 2
+        if not factors:
+            return
+        # Store the pyramid in an external .ovr file so the spooled TIFF,
+        # which may be memory mapped, is never rewritten
+        with rasterio.Env(TIFF_USE_OVR=True):
+            with rasterio.open(path, 'r+') as dataset:
+                dataset.build_overviews(factors, Resampling.average)
+
+
+def raster_shape(uploaded_file):
+    # Height and width of the uploaded raster without reading any pixels
+    with rasterio.open(dataset_path(uploaded_file)) as dataset:
+        return dataset.height, dataset.width
+
+
+def band_count(uploaded_file):
+    # Number of bands in the uploaded raster
+    with rasterio.open(dataset_path(uploaded_file)) as dataset:
+        return dataset.count
+
+
+def read_dem_preview(uploaded_file, max_size=DISPLAY_MAX_SIZE, band=1):
+    # Decimated band whose longest side is at most `max_size` pixels, read
+    # from the closest overview level. Small rasters are returned unchanged.
+    height, width = raster_shape(uploaded_file)
+    if max(height, width) <= max_size:
+        return load_dem(uploaded_file, band)
+
+    key = band_key(uploaded_file, band)
+    cache_key = (file_digest(uploaded_file), band, 'preview', max_size)
+    dem = _raster_cache.get(cache_key)
+    if dem is None:
+        path = dataset_path(uploaded_file)
+        ensure_overviews(path, band)
+
+        scale = max(height, width) / max_size
+        out_shape = (max(1, int(round(height / scale))),
+                     max(1, int(round(width / scale))))
+        with rasterio.open(path) as dataset:
+            array = dataset.read(band, out_shape=out_shape,
+                                 resampling=Resampling.average)
+            transform = dataset.transform * Affine.scale(
+                width / out_shape[1], height / out_shape[0])
+            dem = DemData(array, transform, dataset.crs, dataset.nodata, key)
+
+        array.flags.writeable = False
+        _raster_cache.put(cache_key, dem)
+    return dem
+
+
+def read_dem_window(uploaded_file, row_start, row_stop, col_start, col_stop, band=1):
+    # Full-resolution block covering only the requested pixel region
+    key = band_key(uploaded_file, band)
+    row_stop = max(row_stop, row_start + 1)
+    col_stop = max(col_stop, col_start + 1)
+    window = Window.from_slices((row_start, row_stop), (col_start, col_stop))
+    cache_key = (file_digest(uploaded_file), band, 'window',
+                 row_start, row_stop, col_start, col_stop)
+
+    dem = _raster_cache.get(cache_key)
+    if dem is None:
+        with rasterio.open(dataset_path(uploaded_file)) as dataset:
+            window = window.intersection(
+                Window(0, 0, dataset.width, dataset.height))
+            array = dataset.read(band, window=window)
+            dem = DemData(array, dataset.window_transform(window),
+                          dataset.crs, dataset.nodata, key)
+
+        array.flags.writeable = False
+        _raster_cache.put(cache_key, dem)
+    return dem
+
+
+def geotiff_bytes(layers, transform, crs, nodata=None, block_rows=EXPORT_BLOCK_ROWS):
+    # Tiled, deflate-compressed GeoTIFF of one or more equally shaped 2D
+    # layers (one band each), keeping the source georeferencing. Layers are
+    # written in row blocks so memory-mapped inputs are never copied whole.
+    layers = list(layers)
+    height, width = layers[0].shape
+    profile = dict(driver='GTiff', height=height, width=width, count=len(layers),
+                   dtype=layers[0].dtype, transform=transform, crs=crs, nodata=nodata,
+                   compress='deflate', tiled=True, blockxsize=256, blockysize=256)
+    if height < 256 or width < 256:
+        profile.update(tiled=False, blockxsize=None, blockysize=None)
+        profile = {name: value for name, value in profile.items() if value is not None}
+
+    with MemoryFile() as memory_file:
+        with memory_file.open(**profile) as dataset:
+            for band, layer in enumerate(layers, start=1):
+                for start in range(0, height, block_rows):
+                    block = np.asarray(layer[start:start + block_rows])
+                    dataset.write(block, band, window=Window(0, start, width, block.shape[0]))
+        return memory_file.read()
@@ -0,0 +1,253 @@
+import io
+import math
+from functools import lru_cache
+
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.colors import Colormap, to_rgba
+from PIL import Image, ImageDraw, ImageFont
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import DISPLAY_MAX_SIZE, cache_budget
+from geo_utils.stats import band_histogram, cached_histogram, histogram_percentiles, stretch_band
+
+
+# Number of colours sampled from a colormap
+LUT_SIZE = 256
+
+# Extra LUT entry used for NaN / nodata cells (fully transparent)
+_NODATA_INDEX = LUT_SIZE
+
+# Fast PNG settings: pages rerender on every interaction, so encoding speed
+# matters more than the last few percent of file size
+PNG_COMPRESS_LEVEL = 1
+WEBP_QUALITY = 90
+
+LEGEND_WIDTH = 400
+LEGEND_BAR_HEIGHT = 16
+
+# Rows converted at a time when building RGB composites
+COMPOSITE_BLOCK_ROWS = 512
+
+_composite_cache = LRUCache(cache_budget('composite'))
+
+
+@lru_cache(maxsize=64)
+def _named_lut(name):
+    return _sample_lut(colormaps[name])
+
+
+def _sample_lut(cmap):
+    lut = np.zeros((LUT_SIZE + 1, 4), dtype=np.uint8)
+    lut[:LUT_SIZE] = np.round(cmap(np.linspace(0, 1, LUT_SIZE)) * 255)
+    lut.flags.writeable = False
+    return lut
+
+
+def colormap_lut(cmap):
+    # 256-entry RGBA table for a colormap name or matplotlib Colormap, with
+    # a transparent entry appended for nodata
+    if isinstance(cmap, Colormap):
+        return _sample_lut(cmap)
+    return _named_lut(cmap)
+
+
+def _valid_mask(array, nodata=None):
+    valid = np.isfinite(array) if array.dtype.kind == 'f' else np.ones(array.shape, dtype=bool)
+    if nodata is not None:
+        valid &= array != nodata
+    return valid
+
+
+def value_range(array, nodata=None):
+    # (min, max) of the finite, non-nodata values; (0, 1) when there are none
+    array = np.asarray(array)
+    values = array[_valid_mask(array, nodata)]
+    if not values.size:
+        return 0.0, 1.0
+    return float(values.min()), float(values.max())
+
+
+def colorize(array, cmap='viridis', vmin=None, vmax=None, nodata=None, alpha=1.0):
+    # RGBA uint8 image of a 2D array. Values are scaled linearly from
+    # vmin..vmax onto the LUT (clipping outside the range); NaN and nodata
+    # cells are transparent.
+    array = np.asarray(array)
+    valid = _valid_mask(array, nodata)
+    if vmin is None or vmax is None:
+        low, high = value_range(array, nodata)
+        vmin = low if vmin is None else vmin
+        vmax = high if vmax is None else vmax
+
+    scale = (LUT_SIZE - 1) / (vmax - vmin) if vmax > vmin else 0.0
+    scaled = (array.astype(np.float32) - np.float32(vmin)) * np.float32(scale)
+    scaled[~valid] = 0
+    np.clip(scaled, 0, LUT_SIZE - 1, out=scaled)
+    indices = scaled.astype(np.uint16)
+    indices[~valid] = _NODATA_INDEX
+
+    lut = colormap_lut(cmap)
+    if alpha != 1.0:
+        lut = lut.copy()
+        lut[:LUT_SIZE, 3] = np.round(lut[:LUT_SIZE, 3] * alpha)
+    return lut[indices]
+
+
+def mask_layer(mask, color, alpha=0.5):
+    # RGBA image that paints the True cells of a mask in one colour
+    rgba = np.zeros(mask.shape + (4,), dtype=np.uint8)
+    rgba[mask] = np.round(np.array(to_rgba(color, alpha)) * 255)
+    return rgba
+
+
+def composite(*layers):
+    # Alpha-composite RGBA layers, bottom first
+    image = Image.fromarray(layers[0], 'RGBA')
+    for layer in layers[1:]:
+        image = Image.alpha_composite(image, Image.fromarray(layer, 'RGBA'))
+    return np.asarray(image)
+
+
+def draw_markers(rgba, rows, cols, color='blue', size=6):
+    # Triangle markers at pixel positions, drawn onto a copy of the image
+    image = Image.fromarray(rgba, 'RGBA')
+    draw = ImageDraw.Draw(image)
+    fill = tuple(int(round(channel * 255)) for channel in to_rgba(color))
+    for row, col in zip(np.atleast_1d(rows), np.atleast_1d(cols)):
+        draw.polygon([(col, row - size), (col - size, row + size), (col + size, row + size)],
+                     fill=fill)
+    return np.asarray(image)
+
+
+def encode_image(rgba, format='PNG'):
+    # PNG or WebP bytes of an RGBA array, ready for st.image
+    image = Image.fromarray(rgba, 'RGBA')
+    buffer = io.BytesIO()
+    if format.upper() == 'WEBP':
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY)
+    else:
+        image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def display_step(shape, max_size=DISPLAY_MAX_SIZE):
+    # Stride display_sample uses for an array of this shape
+    return max(1, math.ceil(max(shape[:2]) / max_size))
+
+
+def display_sample(array, max_size=DISPLAY_MAX_SIZE):
+    # Strided view of a 2D array whose longest side is at most `max_size`,
+    # so display images never colour or encode more cells than are shown.
+    # Nearest sampling keeps NaN / nodata cells and class labels intact.
+    step = display_step(array.shape, max_size)
+    return array[::step, ::step] if step > 1 else array
+
+
+def render_raster(array, cmap='viridis', vmin=None, vmax=None, nodata=None, format='PNG',
+                  max_size=DISPLAY_MAX_SIZE):
+    # Display image of a 2D array, coloured at no more than `max_size`
+    # pixels a side; a missing vmin / vmax comes from the full array
+    if vmin is None or vmax is None:
+        low, high = value_range(array, nodata)
+        vmin = low if vmin is None else vmin
+        vmax = high if vmax is None else vmax
+    return encode_image(colorize(display_sample(array, max_size), cmap, vmin, vmax, nodata),
+                        format)
+
+
+def colorize_classes(labels, colors, alpha=1.0):
+    # RGBA image of a uint8 label raster, class k painted colors[k]; any
+    # other label (e.g. nodata) is transparent
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:len(colors)] = np.round(np.array([to_rgba(color, alpha) for color in colors]) * 255)
+    return lut[labels]
+
+
+def render_classes(labels, colors, format='PNG', max_size=DISPLAY_MAX_SIZE):
+    return encode_image(colorize_classes(display_sample(labels, max_size), colors), format)
+
+
+def render_class_legend(names, colors, width=LEGEND_WIDTH):
+    # One swatch and name per class, as PNG bytes
+    font = ImageFont.load_default()
+    row_height = 18
+    image = Image.new('RGBA', (width, row_height * len(names) + 8), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for row, (name, color) in enumerate(zip(names, colors)):
+        top = 4 + row * row_height
+        fill = tuple(int(round(channel * 255)) for channel in to_rgba(color))
+        draw.rectangle([10, top, 10 + row_height - 4, top + row_height - 4], fill=fill,
+                       outline=(0, 0, 0, 255))
+        draw.text((10 + row_height + 4, top + 1), name, fill=(0, 0, 0, 255), font=font)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
+
+
+def rgb_composite(red, green, blue, clip=0.0, histograms=None, block_rows=COMPOSITE_BLOCK_ROWS):
+    # uint8 RGB image of three bands, each stretched to 0..255 between its
+    # `clip` and 100 - `clip` percentiles (min-max when clip is 0). The
+    # limits come from one histogram per band (pass `histograms` to reuse
+    # them) and bands are converted in row blocks.
+    bands = (red, green, blue)
+    if histograms is None:
+        histograms = [band_histogram(band, block_rows=block_rows) for band in bands]
+    rgb = np.empty(red.shape[:2] + (3,), dtype=np.uint8)
+    for channel, (band, histogram) in enumerate(zip(bands, histograms)):
+        if clip > 0:
+            low, high = histogram_percentiles(histogram, [clip, 100 - clip])
+        else:
+            low, high = histogram.minimum, histogram.maximum
+        rgb[..., channel] = stretch_band(band, low, high, block_rows)
+    return rgb
+
+
+def cached_composite(key, red, green, blue, clip=0.0):
+    # rgb_composite cached by the identity of its bands, so widget changes
+    # on the composite page never rebuild it. Band histograms are cached
+    # separately, so changing the clip only re-stretches.
+    def compute():
+        histograms = [cached_histogram((key, channel), band)
+                      for channel, band in enumerate((red, green, blue))]
+        rgb = rgb_composite(red, green, blue, clip, histograms)
+        rgb.flags.writeable = False
+        return rgb
+
+    return _composite_cache.get_or_compute((key, 'composite', clip), compute)
+
+
+def _format_tick(value):
+    return '{:.3g}'.format(value)
+
+
+def render_legend(cmap, vmin, vmax, label='', width=LEGEND_WIDTH):
+    # Horizontal colour bar with end and middle ticks, as PNG bytes
+    lut = colormap_lut(cmap)[:LUT_SIZE]
+    font = ImageFont.load_default()
+    text_height = 14
+    height = LEGEND_BAR_HEIGHT + 2 * text_height + 12
+    image = Image.new('RGBA', (width, height), (255, 255, 255, 255))
+
+    bar = np.repeat(lut[np.linspace(0, LUT_SIZE - 1, width - 20).astype(int)][None],
+                    LEGEND_BAR_HEIGHT, axis=0)
+    image.paste(Image.fromarray(np.ascontiguousarray(bar), 'RGBA'), (10, 4))
+
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([10, 4, width - 11, 4 + LEGEND_BAR_HEIGHT], outline=(0, 0, 0, 255))
+    tick_top = 4 + LEGEND_BAR_HEIGHT
+    for fraction in (0.0, 0.5, 1.0):
+        x = 10 + fraction * (width - 21)
+        draw.line([(x, tick_top), (x, tick_top + 3)], fill=(0, 0, 0, 255))
+        text = _format_tick(vmin + fraction * (vmax - vmin))
+        text_width = draw.textlength(text, font=font)
+        draw.text((min(max(x - text_width / 2, 0), width - text_width), tick_top + 4),
+                  text, fill=(0, 0, 0, 255), font=font)
+    if label:
+        label_width = draw.textlength(label, font=font)
+        draw.text(((width - label_width) / 2, tick_top + 4 + text_height), label,
+                  fill=(0, 0, 0, 255), font=font)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return buffer.getvalue()
@@ -0,0 +1,176 @@
+from collections import namedtuple
+
+import numpy as np
+
+from geo_utils.bandmath import band_range
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import cache_budget
+from geo_utils.terrain import BLOCK_ROWS
+
+
+# Bins used for float bands; 8- and 16-bit integer bands get one bin per
+# possible value, so their statistics are exact
+HISTOGRAM_BINS = 4096
+
+# Band histogram: counts[i] is the number of valid cells in
+# [low + i * width, low + (i + 1) * width); minimum and maximum are exact
+Histogram = namedtuple('Histogram', ['counts', 'low', 'width', 'minimum', 'maximum'])
+
+_histogram_cache = LRUCache(cache_budget('histogram'))
+
+
+def _integer_bins(dtype):
+    # Value range covered by one bin per value, for small integer types
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'ui' and dtype.itemsize <= 2:
+        info = np.iinfo(dtype)
+        return int(info.min), int(info.max) - int(info.min) + 1
+    return None
+
+
+def band_histogram(array, nodata=None, bins=HISTOGRAM_BINS, block_rows=BLOCK_ROWS):
+    # Histogram of a band (any number of trailing channels pooled) built in
+    # row blocks. 8/16-bit integer bands take one pass with one bin per
+    # value; other bands take a min/max pass first. NaN and nodata cells
+    # are left out.
+    integer_bins = _integer_bins(array.dtype)
+    if integer_bins is not None:
+        low, bins = integer_bins
+        width = 1.0
+        counts = np.zeros(bins, dtype=np.int64)
+        for start in range(0, array.shape[0], block_rows):
+            block = np.ravel(array[start:start + block_rows])
+            if nodata is not None:
+                block = block[block != nodata]
+            counts += np.bincount(block.astype(np.int64) - low, minlength=bins)
+        present = np.flatnonzero(counts)
+        if not present.size:
+            return Histogram(counts, float(low), width, np.nan, np.nan)
+        return Histogram(counts, float(low), width, float(low + present[0]),
+                         float(low + present[-1]))
+
+    minimum, maximum = band_range(array, block_rows, nodata)
+    counts = np.zeros(bins, dtype=np.int64)
+    if minimum > maximum:
+        return Histogram(counts, 0.0, 1.0, np.nan, np.nan)
+    width = (maximum - minimum) / bins or 1.0
+    for start in range(0, array.shape[0], block_rows):
+        block = np.asarray(array[start:start + block_rows], dtype=np.float64).ravel()
+        valid = np.isfinite(block)
+        if nodata is not None:
+            valid &= block != nodata
+        index = ((block[valid] - minimum) / width).astype(np.int64)
+        counts += np.bincount(np.minimum(index, bins - 1), minlength=bins)
+    return Histogram(counts, minimum, width, minimum, maximum)
+
+
+def cached_histogram(key, array, nodata=None):
+    # band_histogram cached by the identity of the band, so every stretch,
+    # percentile and equalisation of an unchanged band reuses one pass
+    return _histogram_cache.get_or_compute(
+        (key, 'histogram', nodata), lambda: band_histogram(array, nodata))
+
+
+def _is_integer_histogram(histogram):
+    return histogram.width == 1.0 and float(histogram.low).is_integer()
+
+
+def histogram_percentiles(histogram, percents):
+    # Percentiles with np.percentile's linear interpolation between order
+    # statistics. Exact for integer histograms; float histograms place a
+    # value evenly inside its bin.
+    counts = histogram.counts
+    cumulative = np.cumsum(counts)
+    total = cumulative[-1]
+    if not total:
+        return np.full(np.shape(percents), np.nan)
+
+    def order_statistic(rank):
+        index = np.searchsorted(cumulative, rank, side='right')
+        if _is_integer_histogram(histogram):
+            return histogram.low + index
+        before = cumulative[index] - counts[index]
+        offset = (rank - before + 0.5) / counts[index]
+        value = histogram.low + (index + offset) * histogram.width
+        return min(max(value, histogram.minimum), histogram.maximum)
+
+    values = []
+    for percent in np.atleast_1d(percents):
+        position = percent / 100 * (total - 1)
+        below, above = np.floor(position), np.ceil(position)
+        low_value = order_statistic(below)
+        high_value = order_statistic(above)
+        values.append(low_value + (high_value - low_value) * (position - below))
+    values = np.asarray(values, dtype=np.float64)
+    return values if np.ndim(percents) else values[0]
+
+
+def equalization_cdf(histogram):
+    # Bin centres between the band's minimum and maximum and the
+    # cumulative distribution at them, as skimage.exposure.equalize_hist
+    # interpolates it (integer bins are centred on their value)
+    present = np.flatnonzero(histogram.counts)
+    first, last = present[0], present[-1]
+    cdf = np.cumsum(histogram.counts[first:last + 1], dtype=np.float64)
+    cdf /= cdf[-1]
+    centres = histogram.low + np.arange(first, last + 1) * histogram.width
+    if _is_integer_histogram(histogram):
+        return centres, cdf
+    return centres + histogram.width / 2, cdf
+
+
+def stretch_band(array, low, high, block_rows=BLOCK_ROWS):
+    # uint8 copy of a band linearly stretched from [low, high] to 0..255 and
+    # clipped, in row blocks; NaN cells become 0
+    scale = np.float32(255 / (high - low)) if high > low else np.float32(0)
+    stretched = np.empty(array.shape, dtype=np.uint8)
+    for start in range(0, array.shape[0], block_rows):
+        block = np.asarray(array[start:start + block_rows], dtype=np.float32)
+        block = (block - np.float32(low)) * scale
+        np.clip(block, 0, 255, out=block)
+        stretched[start:start + block_rows] = np.nan_to_num(block)
+    return stretched
+
+
+# ITU-R BT.601 luma weights in 14-bit fixed point, as OpenCV's RGB to gray
+# conversion applies them to 8-bit images (red, green, blue)
+LUMA_WEIGHTS = (4899, 9617, 1868)
+_LUMA_SHIFT = 14
+
+
+def _luminance(block, channel_order):
+    # Rounded luminance of an RGB / BGR block in its own integer type
+    red, green, blue = (block[..., channel_order.index(name)].astype(np.int64)
+                        for name in 'rgb')
+    luma = red * LUMA_WEIGHTS[0] + green * LUMA_WEIGHTS[1] + blue * LUMA_WEIGHTS[2]
+    return (luma + (1 << (_LUMA_SHIFT - 1))) >> _LUMA_SHIFT
+
+
+def channel_histograms(image, channel_order='rgb', block_rows=BLOCK_ROWS):
+    # Counts of every value of each channel of a uint8 / uint16 image and of
+    # its luminance, in one pass over row blocks: {'red', 'green', 'blue',
+    # 'luminance': counts}. Single-band images only have 'luminance'.
+    if image.dtype not in (np.uint8, np.uint16):
+        raise ValueError('Channel histograms need a uint8 or uint16 image')
+    bins = np.iinfo(image.dtype).max + 1
+    colour = image.ndim == 3 and image.shape[2] >= 3
+    names = [{'r': 'red', 'g': 'green', 'b': 'blue'}[name] for name in channel_order] \
+        if colour else []
+    counts = {name: np.zeros(bins, dtype=np.int64) for name in names + ['luminance']}
+
+    for start in range(0, image.shape[0], block_rows):
+        block = np.asarray(image[start:start + block_rows])
+        if not colour:
+            counts['luminance'] += np.bincount(block.ravel(), minlength=bins)
+            continue
+        for channel, name in enumerate(names):
+            counts[name] += np.bincount(block[..., channel].ravel(), minlength=bins)
+        counts['luminance'] += np.bincount(
+            _luminance(block, channel_order).ravel(), minlength=bins)
+    return counts
+
+
+def cached_channel_histograms(key, image, channel_order='rgb'):
+    # channel_histograms cached by the image's content hash
+    return _histogram_cache.get_or_compute(
+        (key, 'channels', channel_order), lambda: channel_histograms(image, channel_order))
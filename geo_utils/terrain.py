@@ -0,0 +1,163 @@
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import cache_budget
+
+
+# Products the terrain engine can compute in a single pass
+TERRAIN_PRODUCTS = ('slope', 'aspect', 'plan_curvature',
+                    'profile_curvature', 'curvature', 'hillshade')
+
+# Rows per block processed by one worker; each block carries a one-row halo
+BLOCK_ROWS = 512
+
+# Mean earth radius in metres, used for geographic (degree) rasters
+EARTH_RADIUS = 6371008.8
+
+_terrain_cache = LRUCache(cache_budget('terrain'))
+
+
+def cell_size(transform, crs=None, shape=None):
+    # Pixel width and height in metres. Geographic rasters are converted
+    # from degrees at the latitude of the raster centre.
+    dx, dy = abs(transform.a), abs(transform.e)
+    if crs is not None and crs.is_geographic:
+        rows = shape[0] if shape is not None else 0
+        latitude = transform.f + transform.e * rows / 2
+        metres_per_degree = math.pi * EARTH_RADIUS / 180
+        dx *= metres_per_degree * math.cos(math.radians(latitude))
+        dy *= metres_per_degree
+    return dx, dy
+
+
+def _derivatives_block(padded, dx, dy, products, azimuth, altitude, z_factor):
+    # Horn slope/aspect and Zevenbergen-Thorne curvature on a halo-padded
+    # block. Neighbours are named after their position in the 3x3 window:
+    #   z1 z2 z3
+    #   z4 z5 z6
+    #   z7 z8 z9
+    z1, z2, z3 = padded[:-2, :-2], padded[:-2, 1:-1], padded[:-2, 2:]
+    z4, z5, z6 = padded[1:-1, :-2], padded[1:-1, 1:-1], padded[1:-1, 2:]
+    z7, z8, z9 = padded[2:, :-2], padded[2:, 1:-1], padded[2:, 2:]
+
+    results = {}
+
+    # Horn's third-order finite difference (x east, y north)
+    dz_dx = ((z3 + 2 * z6 + z9) - (z1 + 2 * z4 + z7)) / (8 * dx)
+    dz_dy = ((z1 + 2 * z2 + z3) - (z7 + 2 * z8 + z9)) / (8 * dy)
+    gradient = np.hypot(dz_dx, dz_dy)
+
+    if 'slope' in products or 'hillshade' in products:
+        slope = np.arctan(gradient)
+        if 'slope' in products:
+            results['slope'] = np.degrees(slope)
+
+    if 'aspect' in products or 'hillshade' in products:
+        # Downslope direction measured counter-clockwise from east
+        aspect_math = np.arctan2(-dz_dy, -dz_dx)
+        if 'aspect' in products:
+            # Compass bearing (0 = north, clockwise); flat cells are -1
+            aspect = np.degrees(np.pi / 2 - aspect_math) % 360
+            aspect[gradient == 0] = -1
+            results['aspect'] = aspect
+
+    if 'hillshade' in products:
+        # Hillshade uses the exaggerated slope, like matplotlib's vert_exag
+        shade_slope = np.arctan(z_factor * gradient) if z_factor != 1 else slope
+        zenith = math.radians(90 - altitude)
+        sun = math.radians((450 - azimuth) % 360)
+        hillshade = (math.cos(zenith) * np.cos(shade_slope) +
+                     math.sin(zenith) * np.sin(shade_slope) * np.cos(sun - aspect_math))
+        results['hillshade'] = np.clip(hillshade, 0, 1, out=hillshade)
+
+    curvatures = {'plan_curvature', 'profile_curvature', 'curvature'}
+    if curvatures & set(products):
+        # Zevenbergen-Thorne quadratic surface coefficients and their sign
+        # conventions. Values are reported in 1/100 m like the ArcGIS
+        # curvature tools.
+        d = ((z4 + z6) / 2 - z5) / (dx * dx)
+        e = ((z2 + z8) / 2 - z5) / (dy * dy)
+        f = (z3 + z7 - z1 - z9) / (4 * dx * dy)
+        g = (z6 - z4) / (2 * dx)
+        h = (z2 - z8) / (2 * dy)
+        g2, h2 = g * g, h * h
+        denominator = g2 + h2
+        flat = denominator == 0
+        denominator[flat] = 1
+
+        if 'curvature' in products:
+            results['curvature'] = -200 * (d + e)
+        if 'profile_curvature' in products:
+            profile = -200 * (d * g2 + e * h2 + f * g * h) / denominator
+            profile[flat] = 0
+            results['profile_curvature'] = profile
+        if 'plan_curvature' in products:
+            plan = 200 * (d * h2 + e * g2 - f * g * h) / denominator
+            plan[flat] = 0
+            results['plan_curvature'] = plan
+
+    # Cells that are nodata themselves get no value either
+    missing = np.isnan(z5)
+    if missing.any():
+        for values in results.values():
+            values[missing] = np.nan
+
+    return results
+
+
+def terrain_derivatives(dem_array, transform, crs=None, nodata=None,
+                        products=TERRAIN_PRODUCTS, azimuth=315, altitude=45,
+                        z_factor=1.0, block_rows=BLOCK_ROWS, workers=None):
+    # Compute the requested terrain products in one pass over the DEM. The
+    # raster is split into row blocks padded with a one-row halo and the
+    # blocks are processed in parallel (numpy releases the GIL). Outputs
+    # are float32 and NaN where the 3x3 window touches nodata.
+    unknown = set(products) - set(TERRAIN_PRODUCTS)
+    if unknown:
+        raise ValueError('Unknown terrain products: {}'.format(sorted(unknown)))
+
+    rows, cols = dem_array.shape
+    dx, dy = cell_size(transform, crs, dem_array.shape)
+    outputs = {name: np.empty((rows, cols), dtype=np.float32)
+               for name in products}
+
+    def process(row_start):
+        row_stop = min(row_start + block_rows, rows)
+
+        # Read the block with its halo and replicate the raster edges
+        halo_start, halo_stop = max(row_start - 1, 0), min(row_stop + 1, rows)
+        block = np.asarray(dem_array[halo_start:halo_stop], dtype=np.float32)
+        if nodata is not None:
+            block = np.where(block == nodata, np.float32(np.nan), block)
+        pad_top = 1 - (row_start - halo_start)
+        pad_bottom = row_stop + 1 - halo_stop
+        padded = np.pad(block, ((pad_top, pad_bottom), (1, 1)), mode='edge')
+
+        results = _derivatives_block(padded, dx, dy, products,
+                                     azimuth, altitude, z_factor)
+        for name, values in results.items():
+            outputs[name][row_start:row_stop] = values
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        list(executor.map(process, range(0, rows, block_rows)))
+    return outputs
+
+
+def dem_terrain(dem, products=TERRAIN_PRODUCTS, **kwargs):
+    # Cached terrain products for a DemData, so widget interactions reuse
+    # the derivatives of an unchanged DEM
+    key = (dem.key, dem.array.shape, tuple(dem.transform), tuple(products),
+           tuple(sorted(kwargs.items())))
+
+    def compute():
+        outputs = terrain_derivatives(dem.array, dem.transform, dem.crs,
+                                      dem.nodata, products, **kwargs)
+        for values in outputs.values():
+            values.flags.writeable = False
+        return outputs
+
+    return _terrain_cache.get_or_compute(key, compute)
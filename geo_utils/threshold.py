@@ -0,0 +1,122 @@
+from collections import namedtuple
+
+import numpy as np
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import cache_budget
+from geo_utils.terrain import cell_size
+
+
+# Valid cells of a raster ordered by value: `order` holds flat cell indices
+# and `values` the matching sorted values. `cell_area` is in square metres.
+SortedIndex = namedtuple('SortedIndex', ['order', 'values', 'shape', 'cell_area'])
+
+_index_cache = LRUCache(cache_budget('threshold'))
+
+
+def sorted_index(array, transform=None, crs=None, nodata=None):
+    # Sort the valid cells once so any threshold query becomes a binary
+    # search. NaN and nodata cells are left out of the index.
+    flat = np.asarray(array).ravel()
+    valid = np.isfinite(flat) if flat.dtype.kind == 'f' else np.ones(flat.shape, dtype=bool)
+    if nodata is not None:
+        valid &= flat != nodata
+
+    cells = np.flatnonzero(valid)
+    order_dtype = np.uint32 if flat.size < 2 ** 32 else np.intp
+    values = flat[cells]
+    ranks = np.argsort(values, kind='stable')
+    order = cells[ranks].astype(order_dtype)
+    values = values[ranks]
+
+    cell_area = 1.0
+    if transform is not None:
+        dx, dy = cell_size(transform, crs, array.shape)
+        cell_area = dx * dy
+    return SortedIndex(order, values, array.shape, cell_area)
+
+
+def dem_sorted_index(dem, array=None, product='elevation'):
+    # Cached sorted index of a DemData, or of a derived `array` on its grid.
+    # Derived products mark missing cells with NaN; the DEM's nodata value
+    # is a valid value there (e.g. a slope of 0).
+    nodata = dem.nodata if array is None else None
+    array = dem.array if array is None else array
+    key = (dem.key, product, array.shape, tuple(dem.transform))
+    return _index_cache.get_or_compute(
+        key, lambda: sorted_index(array, dem.transform, dem.crs, nodata))
+
+
+def value_bounds(index):
+    # Lowest and highest indexed value, or None when the raster has no
+    # valid cells (every mask of such an index stays empty)
+    if not index.values.size:
+        return None
+    return index.values[0], index.values[-1]
+
+
+def threshold_position(index, threshold, above=False):
+    # Split point in the sorted values: cells [:position] are <= threshold,
+    # or with `above`, cells [position:] are >= threshold
+    return int(np.searchsorted(index.values, threshold, side='left' if above else 'right'))
+
+
+def threshold_stats(index, threshold, above=False):
+    # Cell count, share of valid cells and area in hectares on one side of
+    # the threshold, without touching the raster
+    position = threshold_position(index, threshold, above)
+    cells = index.values.size - position if above else position
+    percent = 100.0 * cells / index.values.size if index.values.size else 0.0
+    return {'cells': cells, 'percent': percent, 'hectares': cells * index.cell_area / 1e4}
+
+
+class ThresholdMask:
+    # Boolean mask of the cells below (or above) a threshold that is updated
+    # incrementally: moving the threshold only flips the cells whose values
+    # lie between the old and the new position in the sorted index. With a
+    # `factor` > 1 a per-block count of selected cells is kept up to date
+    # the same way, for displays that show the mask decimated.
+
+    def __init__(self, index, above=False, factor=1):
+        self.index = index
+        self.above = above
+        self.factor = factor
+        self.mask = np.zeros(index.shape, dtype=bool)
+        self.position = 0
+
+        rows, cols = index.shape
+        self.block_shape = (-(-rows // factor), -(-cols // factor))
+        if factor > 1:
+            self.totals = self._block_counts(index.order)
+            self.counts = np.zeros_like(self.totals)
+        if above:
+            self.mask.flat[index.order] = True
+            if factor > 1:
+                self.counts += self.totals
+
+    def _block_counts(self, cells):
+        rows, cols = divmod(cells.astype(np.intp), self.index.shape[1])
+        blocks = (rows // self.factor) * self.block_shape[1] + cols // self.factor
+        return np.bincount(blocks, minlength=self.block_shape[0] * self.block_shape[1]
+                           ).reshape(self.block_shape).astype(np.int64)
+
+    def update(self, threshold):
+        position = threshold_position(self.index, threshold, self.above)
+        low, high = sorted((self.position, position))
+        if low != high:
+            # Below mode selects [:position], above mode selects [position:]
+            selected = (position > self.position) != self.above
+            cells = self.index.order[low:high]
+            self.mask.flat[cells] = selected
+            if self.factor > 1:
+                change = self._block_counts(cells)
+                self.counts += change if selected else -change
+        self.position = position
+        return self.mask
+
+    def coverage(self):
+        # Fraction of the valid cells of each block that are selected
+        if self.factor == 1:
+            return self.mask.astype(np.float32)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.counts / self.totals).astype(np.float32)
@@ -0,0 +1,300 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.warp import reproject, transform_bounds
+
+from geo_utils.cache import LRUCache
+from geo_utils.mesh import block_mean
+from geo_utils.raster_io import SCRATCH_DIR, cache_budget
+from geo_utils.render import colorize, encode_image, value_range
+
+
+TILE_SIZE = 256
+
+# Half the width of the Web Mercator (EPSG:3857) world, in metres
+MERCATOR_EXTENT = 20037508.342789244
+
+# Rendered tiles are kept on disk under their own budget
+TILE_CACHE_DIR = os.path.join(SCRATCH_DIR, 'tiles')
+TILE_CACHE_MAX_BYTES = int(os.environ.get(
+    'GEO_APP_TILE_CACHE_MB', '512')) * 1024 * 1024
+
+# Address the tile server binds to, and the URL browsers use to reach it
+# when the app runs behind a proxy or on another host
+TILE_HOST = os.environ.get('GEO_APP_TILE_HOST', '127.0.0.1')
+TILE_PORT = int(os.environ.get('GEO_APP_TILE_PORT', '0'))
+TILE_PUBLIC_URL = os.environ.get('GEO_APP_TILE_URL')
+
+# Layers the tile server keeps; the least recently registered are dropped
+MAX_TILE_LAYERS = 64
+
+# Memory the registry may pin in arrays it alone holds (e.g. threshold
+# masks built by a page); the newest layer is always kept
+TILE_LAYER_BYTES = cache_budget('tile_layers')
+
+# Array, georeferencing and colour style of a layer served as tiles
+TileLayer = namedtuple('TileLayer', ['array', 'transform', 'crs', 'nodata', 'style',
+                                     'mercator_bounds'])
+
+# Most layers reference arrays other caches already own and only count
+# against MAX_TILE_LAYERS; arrays registered as `owned` are also counted
+# against TILE_LAYER_BYTES
+_layers = OrderedDict()
+_owned_bytes = {}
+_layers_lock = threading.Lock()
+_level_cache = LRUCache(cache_budget('tile_levels'))
+
+_tile_cache_lock = threading.Lock()
+_tile_cache_bytes = None
+
+_server_lock = threading.Lock()
+_server_url = None
+
+_TILE_PATH = re.compile(r'^/tiles/(\w+)/(\d+)/(\d+)/(\d+)\.png$')
+
+
+def register_layer(dem, array=None, product='elevation', cmap='terrain', vmin=None,
+                   vmax=None, categorical=False, owned=False):
+    # Publish a raster (a DemData, or a derived `array` on the DEM grid) as
+    # a tile layer and return its id. The id hashes the source content, the
+    # product and the style, so a restyled layer gets fresh tiles while an
+    # unchanged one reuses the tiles already on disk. `owned` marks an
+    # array no cache holds, whose memory the registry then accounts for.
+    if dem.crs is None:
+        raise ValueError('A tile layer needs a georeferenced raster')
+    array = dem.array if array is None else array
+    if vmin is None or vmax is None:
+        low, high = value_range(array, dem.nodata)
+        vmin = low if vmin is None else vmin
+        vmax = high if vmax is None else vmax
+    style = (cmap, float(vmin), float(vmax), bool(categorical))
+
+    layer_id = hashlib.blake2b(repr((dem.key, product, array.shape, tuple(dem.transform),
+                                     style)).encode(), digest_size=8).hexdigest()
+    with _layers_lock:
+        if layer_id in _layers:
+            _layers.move_to_end(layer_id)
+            return layer_id
+
+    rows, cols = array.shape
+    left, top = dem.transform * (0, 0)
+    right, bottom = dem.transform * (cols, rows)
+    mercator_bounds = transform_bounds(
+        dem.crs, 'EPSG:3857', min(left, right), min(top, bottom),
+        max(left, right), max(top, bottom))
+    with _layers_lock:
+        _layers[layer_id] = TileLayer(array, dem.transform, dem.crs, dem.nodata,
+                                      style, mercator_bounds)
+        if owned:
+            _owned_bytes[layer_id] = array.nbytes
+        while len(_layers) > 1 and (len(_layers) > MAX_TILE_LAYERS or
+                                    sum(_owned_bytes.values()) > TILE_LAYER_BYTES):
+            dropped, _ = _layers.popitem(last=False)
+            _owned_bytes.pop(dropped, None)
+    return layer_id
+
+
+def _layer(layer_id):
+    # Registered layer, or None when it is unknown or has been dropped
+    with _layers_lock:
+        return _layers.get(layer_id)
+
+
+def layer_bounds(layer_id):
+    # [[south, west], [north, east]] of a layer, as folium fit_bounds
+    # expects, or None when the layer is not registered
+    layer = _layer(layer_id)
+    if layer is None:
+        return None
+    west, south, east, north = transform_bounds(
+        'EPSG:3857', 'EPSG:4326', *layer.mercator_bounds)
+    return [[south, west], [north, east]]
+
+
+def tile_bounds(z, x, y):
+    # Web Mercator bounds (left, bottom, right, top) of an XYZ tile
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    left = -MERCATOR_EXTENT + x * size
+    top = MERCATOR_EXTENT - y * size
+    return left, top - size, left + size, top
+
+
+def _source_level(layer_id, layer, tile_resolution):
+    # Block-averaged copy of the layer whose cells are no smaller than the
+    # tile pixels, so low zoom levels never resample the full-size array
+    left, bottom, right, top = layer.mercator_bounds
+    source_resolution = (right - left) / layer.array.shape[1]
+    factor = 1
+    while factor * 2 * source_resolution <= tile_resolution and \
+            min(layer.array.shape) // (factor * 2) >= 1:
+        factor *= 2
+    if factor == 1:
+        return layer.array, layer.transform, layer.nodata
+
+    def compute():
+        return block_mean(layer.array, factor, layer.nodata)
+
+    array = _level_cache.get_or_compute((layer_id, factor), compute)
+    return array, layer.transform * Affine.scale(factor), None
+
+
+def _tile_footprint(array, transform, crs, bounds):
+    # Crop the source to the cells under a tile (plus a small margin for
+    # the resampling kernel) so each tile only converts what it shows
+    west, south, east, north = transform_bounds('EPSG:3857', crs, *bounds)
+    cols, rows = ~transform * (np.array([west, east, west, east]),
+                               np.array([south, south, north, north]))
+    row_start = max(int(np.floor(rows.min())) - 2, 0)
+    row_stop = min(int(np.ceil(rows.max())) + 2, array.shape[0])
+    col_start = max(int(np.floor(cols.min())) - 2, 0)
+    col_stop = min(int(np.ceil(cols.max())) + 2, array.shape[1])
+    if row_stop <= row_start or col_stop <= col_start:
+        return array[:1, :1], transform
+    return (array[row_start:row_stop, col_start:col_stop],
+            transform * Affine.translation(col_start, row_start))
+
+
+def render_tile(layer_id, z, x, y):
+    # PNG bytes of one tile, or None when the layer is unknown. Tiles
+    # outside the layer are transparent.
+    layer = _layer(layer_id)
+    if layer is None:
+        return None
+
+    left, bottom, right, top = tile_bounds(z, x, y)
+    layer_left, layer_bottom, layer_right, layer_top = layer.mercator_bounds
+    tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+    if left < layer_right and right > layer_left and bottom < layer_top and top > layer_bottom:
+        array, transform, nodata = _source_level(
+            layer_id, layer, (right - left) / TILE_SIZE)
+        array, transform = _tile_footprint(array, transform, layer.crs,
+                                           (left, bottom, right, top))
+        categorical = layer.style[3]
+        reproject(
+            source=np.asarray(array, dtype=np.float32), destination=tile,
+            src_transform=transform, src_crs=layer.crs, src_nodata=nodata,
+            dst_transform=from_bounds(left, bottom, right, top, TILE_SIZE, TILE_SIZE),
+            dst_crs='EPSG:3857', dst_nodata=np.nan,
+            resampling=Resampling.nearest if categorical else Resampling.bilinear)
+
+    cmap, vmin, vmax, _ = layer.style
+    return encode_image(colorize(tile, cmap, vmin, vmax))
+
+
+def _tile_path(layer_id, z, x, y):
+    return os.path.join(TILE_CACHE_DIR, layer_id, str(z), str(x), '{}.png'.format(y))
+
+
+def cached_tile(layer_id, z, x, y):
+    # Tile from the on-disk cache, rendered and stored on a miss
+    path = _tile_path(layer_id, z, x, y)
+    try:
+        with open(path, 'rb') as tile_file:
+            data = tile_file.read()
+        os.utime(path)
+        return data
+    except OSError:
+        pass
+
+    data = render_tile(layer_id, z, x, y)
+    if data is None:
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = '{}.{}.part'.format(path, threading.get_ident())
+    with open(partial_path, 'wb') as tile_file:
+        tile_file.write(data)
+    os.replace(partial_path, path)
+    _account_tile(len(data))
+    return data
+
+
+def _account_tile(nbytes):
+    # Track the cache size in memory and only scan the directory when the
+    # budget is exceeded
+    global _tile_cache_bytes
+    with _tile_cache_lock:
+        if _tile_cache_bytes is None:
+            _tile_cache_bytes = sum(size for _, size, _ in _tile_files())
+        else:
+            _tile_cache_bytes += nbytes
+        if _tile_cache_bytes <= TILE_CACHE_MAX_BYTES:
+            return
+
+        # Drop the least recently used tiles down to 90% of the budget
+        entries = sorted(_tile_files())
+        _tile_cache_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if _tile_cache_bytes <= 0.9 * TILE_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            _tile_cache_bytes -= size
+
+
+def _tile_files():
+    for directory, _, names in os.walk(TILE_CACHE_DIR):
+        for name in names:
+            if name.endswith('.png'):
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    # GET /tiles/<layer>/<z>/<x>/<y>.png
+
+    def do_GET(self):
+        match = _TILE_PATH.match(self.path)
+        data = None
+        if match:
+            layer_id, z, x, y = match.group(1), *map(int, match.groups()[1:])
+            if 0 <= x < 2 ** z and 0 <= y < 2 ** z:
+                data = cached_tile(layer_id, z, x, y)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Tile requests are too frequent to log
+        pass
+
+
+def tile_server():
+    # Base URL of the process-wide tile server, started on first use in a
+    # daemon thread next to the Streamlit server
+    global _server_url
+    with _server_lock:
+        if _server_url is None:
+            server = ThreadingHTTPServer((TILE_HOST, TILE_PORT), _TileHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            host, port = server.server_address[:2]
+            if host in ('0.0.0.0', ''):
+                host = '127.0.0.1'
+            _server_url = TILE_PUBLIC_URL or 'http://{}:{}'.format(host, port)
+    return _server_url
+
+
+def tile_url(layer_id):
+    # XYZ URL template of a layer, for folium TileLayer or a pydeck TileLayer
+    return '{}/tiles/{}/{{z}}/{{x}}/{{y}}.png'.format(tile_server().rstrip('/'), layer_id)
@@ -0,0 +1,84 @@
+# Streamlit widgets shared by several pages. Only pages import this module;
+# the rest of geo_utils stays free of Streamlit.
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from geo_utils.indices import NDVI_CLASSES, class_counts, classify_index
+from geo_utils.overlay import (OVERLAY_FACTORS, RECLASS_TABLES, cached_reclassify, dem_factor,
+                               ndvi_factor, weighted_overlay)
+from geo_utils.raster_io import load_dem
+from geo_utils.render import render_class_legend, render_classes, render_legend, render_raster
+
+
+def plot_ndvi_classes(ndvi, thresholds, colors, pixel_size):
+    # NDVI section of the NDVI pages: one uint8 label raster, counted with
+    # a single bincount and drawn as one categorical image with its legend
+    # and a per-class area table
+    labels = classify_index(ndvi, thresholds)
+    counts = class_counts(labels, len(NDVI_CLASSES))
+    st.image(render_classes(labels, colors), caption="NDVI Classes", use_column_width=True)
+    st.image(render_class_legend(NDVI_CLASSES, colors))
+
+    total = max(int(counts.sum()), 1)
+    st.table(pd.DataFrame({
+        "Class": NDVI_CLASSES,
+        "Pixels": counts,
+        "Share (%)": np.round(100 * counts / total, 2),
+        "Area (ha)": np.round(counts * pixel_size ** 2 / 1e4, 4),
+    }))
+
+
+def factor_label(name):
+    return name.replace('_', ' ').title()
+
+
+def multi_criteria_overlay(dem, elevation_index, table_name, cmap, title):
+    # Multi-criteria section of the suitability and susceptibility pages:
+    # weighted overlay of reclassified factors. Factor rasters and their
+    # reclassification are cached, so moving a weight slider only redoes
+    # the final weighted sum.
+    st.subheader(title)
+    table = RECLASS_TABLES[table_name]
+
+    # Optional red and NIR bands on the DEM grid for the NDVI factor
+    factors = [name for name in OVERLAY_FACTORS if name != 'ndvi']
+    red_file = st.file_uploader(f"{title}: Red Band GeoTIFF (optional)", type=["tif", "tiff"])
+    nir_file = st.file_uploader(f"{title}: NIR Band GeoTIFF (optional)", type=["tif", "tiff"])
+    ndvi = None
+    if red_file and nir_file:
+        red, nir = load_dem(red_file), load_dem(nir_file)
+        if red.array.shape != dem.array.shape or nir.array.shape != dem.array.shape:
+            st.error("Error: The Red and NIR bands must have the same grid as the DEM.")
+        else:
+            ndvi = ndvi_factor(red, nir)
+            factors.append('ndvi')
+
+    # Elevation classes follow the quantiles of this DEM
+    elevation_breaks = tuple(float(value) for value in np.quantile(
+        elevation_index.values, [0.2, 0.4, 0.6, 0.8]))
+
+    scored_factors, weights = [], []
+    for name in factors:
+        weight = st.sidebar.slider(
+            f"{title}: {factor_label(name)} Weight", min_value=0.0, max_value=1.0,
+            value=0.5 if name in ('slope', 'elevation') else 0.2, step=0.05)
+        if weight == 0:
+            continue
+        breaks = table[name]['breaks'] or elevation_breaks
+        scores = table[name]['scores']
+        if name == 'ndvi':
+            key, array, nodata = (red.key, nir.key, 'ndvi'), ndvi, None
+        else:
+            key, array = (dem.key, dem.array.shape, name), dem_factor(dem, name)
+            nodata = dem.nodata if name == 'elevation' else None
+        scored_factors.append(cached_reclassify(key, array, breaks, scores, nodata))
+        weights.append(weight)
+
+    if not scored_factors:
+        st.warning("Give at least one factor a weight above zero.")
+        return
+
+    overlay = weighted_overlay(scored_factors, weights)
+    st.image(render_raster(overlay, cmap, 1, 5), caption=title, use_column_width=True)
+    st.image(render_legend(cmap, 1, 5, 'Score (1 = low, 5 = high)'))
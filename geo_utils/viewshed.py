@@ -0,0 +1,173 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geo_utils.terrain import EARTH_RADIUS
+
+
+# Standard atmospheric refraction coefficient used with earth curvature
+REFRACTION_COEFFICIENT = 0.13
+
+# Upper bound on ray samples processed at once, to keep memory bounded
+RAY_CHUNK_SAMPLES = 4_000_000
+
+
+def _perimeter(top, bottom, left, right):
+    # Cells on the border of a bounding box, each listed once
+    rows = np.concatenate([np.full(right - left + 1, top), np.full(right - left + 1, bottom),
+                           np.arange(top + 1, bottom), np.arange(top + 1, bottom)])
+    cols = np.concatenate([np.arange(left, right + 1), np.arange(left, right + 1),
+                           np.full(max(bottom - top - 1, 0), left),
+                           np.full(max(bottom - top - 1, 0), right)])
+    cells = np.unique(np.column_stack([rows, cols]), axis=0)
+    return cells[:, 0], cells[:, 1]
+
+
+def viewshed(dem_array, observer, cell_size=(1.0, 1.0), observer_height=1.7,
+             target_height=0.0, max_distance=None, earth_curvature=True,
+             refraction=REFRACTION_COEFFICIENT, nodata=None):
+    # Cells visible from `observer` (row, col), computed with the R2 sweep:
+    # rays are cast from the observer to every cell on the perimeter of the
+    # area of interest and a running maximum of the elevation angle along
+    # each ray decides which cells it passes over are visible. Rays are
+    # processed in vectorised chunks. `cell_size` is (dx, dy) in metres and
+    # `max_distance` limits the analysis radius in metres.
+    rows, cols = dem_array.shape
+    observer_row, observer_col = int(observer[0]), int(observer[1])
+    dx, dy = cell_size
+    visible = np.zeros((rows, cols), dtype=bool)
+    if not (0 <= observer_row < rows and 0 <= observer_col < cols):
+        return visible
+
+    observer_elevation = float(dem_array[observer_row, observer_col])
+    if nodata is not None and observer_elevation == nodata:
+        return visible
+    observer_elevation += observer_height
+    visible[observer_row, observer_col] = True
+
+    # Area of interest: the whole raster or a box around the radius
+    top, bottom, left, right = 0, rows - 1, 0, cols - 1
+    if max_distance is not None:
+        radius_rows = int(np.ceil(max_distance / dy))
+        radius_cols = int(np.ceil(max_distance / dx))
+        top, bottom = max(0, observer_row - radius_rows), min(rows - 1, observer_row + radius_rows)
+        left, right = max(0, observer_col - radius_cols), min(cols - 1, observer_col + radius_cols)
+
+    target_rows, target_cols = _perimeter(top, bottom, left, right)
+    row_steps = target_rows - observer_row
+    col_steps = target_cols - observer_col
+    lengths = np.maximum(np.abs(row_steps), np.abs(col_steps))
+    keep = lengths > 0
+    row_steps, col_steps, lengths = row_steps[keep], col_steps[keep], lengths[keep]
+    if not lengths.size:
+        return visible
+
+    # Drop in apparent elevation caused by earth curvature (with refraction)
+    curvature_factor = (1 - refraction) / (2 * EARTH_RADIUS) if earth_curvature else 0.0
+
+    max_length = int(lengths.max())
+    chunk = max(1, RAY_CHUNK_SAMPLES // max_length)
+    steps = np.arange(1, max_length + 1, dtype=np.float32)
+    for start in range(0, lengths.size, chunk):
+        ray_rows = row_steps[start:start + chunk, None]
+        ray_cols = col_steps[start:start + chunk, None]
+        ray_lengths = lengths[start:start + chunk, None]
+
+        # Cells crossed by every ray, one per step along its major axis
+        fraction = steps[None, :] / ray_lengths
+        on_ray = fraction <= 1
+        sample_rows = np.clip(np.rint(observer_row + ray_rows * fraction), 0, rows - 1).astype(np.intp)
+        sample_cols = np.clip(np.rint(observer_col + ray_cols * fraction), 0, cols - 1).astype(np.intp)
+
+        elevation = dem_array[sample_rows, sample_cols].astype(np.float32)
+        if nodata is not None:
+            # Nodata cells neither block the view nor are ever visible
+            on_ray &= elevation != nodata
+
+        distance = np.hypot((sample_rows - observer_row) * dy,
+                            (sample_cols - observer_col) * dx).astype(np.float32)
+        distance[distance == 0] = np.float32(min(dx, dy))
+        if curvature_factor:
+            elevation -= distance * distance * np.float32(curvature_factor)
+        if max_distance is not None:
+            on_ray &= distance <= max_distance
+
+        # Tangent of the elevation angle to each cell and the horizon seen
+        # before reaching it
+        tangent = (elevation - observer_elevation) / distance
+        tangent[~on_ray] = -np.inf
+        horizon = np.maximum.accumulate(tangent, axis=1)
+        horizon[:, 1:] = horizon[:, :-1]
+        horizon[:, 0] = -np.inf
+
+        target_tangent = (elevation + target_height - observer_elevation) / distance
+        seen = on_ray & (target_tangent >= horizon)
+        visible[sample_rows[seen], sample_cols[seen]] = True
+
+    return visible
+
+
+def line_of_sight(distances, elevations, observer_height=1.7, target_height=0.0,
+                  earth_curvature=True, refraction=REFRACTION_COEFFICIENT):
+    # Visibility of every sample of a terrain profile from its first sample
+    distances = np.asarray(distances, dtype=np.float64)
+    elevations = np.asarray(elevations, dtype=np.float64).copy()
+    if earth_curvature:
+        elevations -= distances ** 2 * (1 - refraction) / (2 * EARTH_RADIUS)
+
+    visible = np.ones(distances.shape, dtype=bool)
+    if distances.size < 2:
+        return visible
+
+    observer_elevation = elevations[0] + observer_height
+    ahead = distances[1:] > 0
+    tangent = np.full(distances.size - 1, -np.inf)
+    tangent[ahead] = (elevations[1:][ahead] - observer_elevation) / distances[1:][ahead]
+    tangent = np.where(np.isnan(tangent), -np.inf, tangent)
+    horizon = np.concatenate([[-np.inf], np.maximum.accumulate(tangent)[:-1]])
+
+    target_tangent = np.full(distances.size - 1, np.inf)
+    target_tangent[ahead] = (elevations[1:][ahead] + target_height -
+                             observer_elevation) / distances[1:][ahead]
+    visible[1:] = target_tangent >= horizon
+    return visible
+
+
+# DEM and settings shared with pool workers, sent once per worker process
+_worker_state = {}
+
+
+def _init_worker(dem_array, settings):
+    _worker_state['dem'] = dem_array
+    _worker_state['settings'] = settings
+
+
+def _worker_viewshed(observer):
+    return np.packbits(viewshed(_worker_state['dem'], observer,
+                                **_worker_state['settings']))
+
+
+def cumulative_viewshed(dem_array, observers, workers=None, **settings):
+    # Number of observers that see each cell. Observers run in parallel on
+    # a process pool; the DEM is sent to each worker once and visibility
+    # masks come back bit-packed.
+    counts = np.zeros(dem_array.shape, dtype=np.uint16)
+    observers = [tuple(observer) for observer in observers]
+    if not observers:
+        return counts
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(observers) == 1:
+        for observer in observers:
+            counts += viewshed(dem_array, observer, **settings)
+        return counts
+
+    dem_array = np.ascontiguousarray(dem_array)
+    with ProcessPoolExecutor(max_workers=min(workers, len(observers)),
+                             initializer=_init_worker,
+                             initargs=(dem_array, settings)) as executor:
+        for packed in executor.map(_worker_viewshed, observers):
+            counts += np.unpackbits(packed, count=dem_array.size).reshape(
+                dem_array.shape).astype(bool)
+    return counts
@@ -0,0 +1,232 @@
+import os
+import tempfile
+import zipfile
+from collections import namedtuple
+
+import geopandas as gpd
+import numpy as np
+import shapely
+from rasterio.features import rasterize
+from rasterio.windows import Window, transform as window_transform
+
+from geo_utils.cache import LRUCache
+from geo_utils.raster_io import EXPORT_BLOCK_ROWS, cache_budget, file_digest
+
+
+# Statistics every zonal summary has; percentiles are optional
+ZONAL_STATISTICS = ('count', 'mean', 'min', 'max', 'std')
+
+# Statistics of angles (e.g. aspect in degrees), where the linear minimum,
+# maximum and percentiles mean nothing
+CIRCULAR_STATISTICS = ('count', 'mean', 'std')
+
+# Zone id of cells outside every polygon (polygon i has id i + 1)
+NO_ZONE = 0
+
+# Zones are rasterized and summarised in strips of this many rows
+ZONE_STRIP_ROWS = EXPORT_BLOCK_ROWS
+
+# Polygon ids burnt onto a raster grid. `strips` holds (row_start,
+# col_start, ids) for every strip that any polygon touches, where ids is
+# a uint32 block covering only the columns those polygons span.
+ZoneGrid = namedtuple('ZoneGrid', ['strips', 'shape', 'zone_count'])
+
+_zonal_cache = LRUCache(cache_budget('zonal'))
+
+
+def read_polygons(shapefile_zip, crs=None):
+    # GeoDataFrame of the first .shp in a ZIP archive, brought into `crs`
+    # when both sides have one; None when the archive holds no shapefile.
+    # The archive is extracted into a temporary directory removed afterwards.
+    with tempfile.TemporaryDirectory() as directory:
+        with zipfile.ZipFile(shapefile_zip, 'r') as archive:
+            archive.extractall(directory)
+        shp_file = next((os.path.join(root, name) for root, _, names in os.walk(directory)
+                         for name in names if name.lower().endswith('.shp')), None)
+        if shp_file is None:
+            return None
+        gdf = gpd.read_file(shp_file)
+    if gdf.crs is not None and crs is not None:
+        gdf = gdf.to_crs(crs)
+    return gdf
+
+
+def cached_polygons(shapefile_zip, crs=None):
+    # read_polygons cached by the archive's content hash and the target
+    # CRS, so widget changes never re-extract or reproject the parcels
+    key = (file_digest(shapefile_zip), 'polygons', str(crs))
+
+    def sizeof(gdf):
+        if gdf is None:
+            return 0
+        coordinates = int(shapely.get_num_coordinates(gdf.geometry.values).sum())
+        return int(gdf.memory_usage(index=True, deep=True).sum()) + coordinates * 16
+
+    return _zonal_cache.get_or_compute(key, lambda: read_polygons(shapefile_zip, crs), sizeof)
+
+
+def _pixel_bounds(geometries, transform, shape):
+    # Row and column ranges (stop exclusive, clipped to the grid) of the
+    # bounding box of every geometry
+    minx, miny, maxx, maxy = shapely.bounds(geometries).T
+    inverse = ~transform
+    corner_cols, corner_rows = [], []
+    for x, y in ((minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy)):
+        col, row = inverse * (x, y)
+        corner_cols.append(col)
+        corner_rows.append(row)
+    corner_rows, corner_cols = np.array(corner_rows), np.array(corner_cols)
+    row_start = np.clip(np.floor(corner_rows.min(axis=0)), 0, shape[0]).astype(np.int64)
+    row_stop = np.clip(np.ceil(corner_rows.max(axis=0)), 0, shape[0]).astype(np.int64)
+    col_start = np.clip(np.floor(corner_cols.min(axis=0)), 0, shape[1]).astype(np.int64)
+    col_stop = np.clip(np.ceil(corner_cols.max(axis=0)), 0, shape[1]).astype(np.int64)
+    return row_start, row_stop, col_start, col_stop
+
+
+def rasterize_zones(geometries, shape, transform, strip_rows=ZONE_STRIP_ROWS):
+    # Burn polygon ids onto the grid of a raster, strip by strip. Each strip
+    # only rasterizes the polygons whose bounds reach it, over the columns
+    # they span, so memory follows the area the polygons cover. Where
+    # polygons overlap, the later one wins.
+    geometries = np.asarray(geometries, dtype=object)
+    row_start, row_stop, col_start, col_stop = _pixel_bounds(geometries, transform, shape)
+    present = (row_stop > row_start) & (col_stop > col_start)
+    present &= ~(shapely.is_empty(geometries) | shapely.is_missing(geometries))
+
+    strips = []
+    for start in range(0, shape[0], strip_rows):
+        stop = min(start + strip_rows, shape[0])
+        selected = np.flatnonzero(present & (row_start < stop) & (row_stop > start))
+        if not selected.size:
+            continue
+        left, right = col_start[selected].min(), col_stop[selected].max()
+        window = Window(left, start, right - left, stop - start)
+        ids = rasterize(
+            zip(geometries[selected], (selected + 1).tolist()),
+            out_shape=(stop - start, right - left),
+            transform=window_transform(window, transform),
+            fill=NO_ZONE, dtype='uint32')
+        strips.append((start, int(left), ids))
+    return ZoneGrid(strips, tuple(shape), len(geometries))
+
+
+def cached_zones(key, geometries, shape, transform):
+    # rasterize_zones cached by the identity of the polygons and the grid,
+    # so every layer summarised over the same parcels reuses one rasterization
+    cache_key = (key, 'zones', tuple(shape), tuple(transform))
+
+    def compute():
+        zones = rasterize_zones(geometries, shape, transform)
+        for _, _, ids in zones.strips:
+            ids.flags.writeable = False
+        return zones
+
+    return _zonal_cache.get_or_compute(cache_key, compute)
+
+
+def _grouped_percentiles(zone_values, zone_ids, counts, percentiles):
+    # Percentiles of every zone with np.percentile's linear interpolation,
+    # from one sort of all values grouped by zone
+    order = np.argsort(zone_values, kind='stable')
+    order = order[np.argsort(zone_ids[order], kind='stable')]
+    ordered = zone_values[order]
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    results = {}
+    has_values = counts > 0
+    for percent in percentiles:
+        position = percent / 100 * np.maximum(counts - 1, 0)
+        below = np.floor(position).astype(np.int64)
+        above = np.ceil(position).astype(np.int64)
+        values = np.full(len(counts), np.nan)
+        low = ordered[(offsets + below)[has_values]]
+        high = ordered[(offsets + above)[has_values]]
+        values[has_values] = low + (high - low) * (position - below)[has_values]
+        results['p{:g}'.format(percent)] = values
+    return results
+
+
+def circular_zonal_stats(zones, array, nodata=None):
+    # Count, circular mean (0..360) and circular standard deviation of
+    # angles in degrees inside every zone, from the summed sines and
+    # cosines of the valid cells
+    if tuple(array.shape) != zones.shape:
+        raise ValueError('The raster does not match the grid the zones were rasterized on')
+    bins = zones.zone_count + 1
+    counts = np.zeros(bins, dtype=np.int64)
+    sines = np.zeros(bins, dtype=np.float64)
+    cosines = np.zeros(bins, dtype=np.float64)
+
+    for row_start, col_start, ids in zones.strips:
+        block = np.asarray(array[row_start:row_start + ids.shape[0],
+                                 col_start:col_start + ids.shape[1]], dtype=np.float64)
+        valid = (ids != NO_ZONE) & np.isfinite(block)
+        if nodata is not None:
+            valid &= block != nodata
+        zone_ids, angles = ids[valid], np.radians(block[valid])
+
+        counts += np.bincount(zone_ids, minlength=bins)
+        sines += np.bincount(zone_ids, weights=np.sin(angles), minlength=bins)
+        cosines += np.bincount(zone_ids, weights=np.cos(angles), minlength=bins)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.degrees(np.arctan2(sines, cosines)) % 360
+        resultant = np.minimum(np.hypot(sines, cosines) / counts, 1)
+        deviations = np.degrees(np.sqrt(np.maximum(-2 * np.log(resultant), 0)))
+    empty = counts == 0
+    means[empty], deviations[empty] = np.nan, np.nan
+    return {'count': counts[1:], 'mean': means[1:], 'std': deviations[1:]}
+
+
+def zonal_stats(zones, array, nodata=None, percentiles=()):
+    # Count, mean, min, max, std (and the requested percentiles) of the
+    # valid cells of `array` inside every zone, as {statistic: array with
+    # one value per polygon}. Only the windows covered by polygons are
+    # read, and each strip is reduced with bincount / ufunc.at grouped by
+    # zone id instead of one mask per polygon.
+    if tuple(array.shape) != zones.shape:
+        raise ValueError('The raster does not match the grid the zones were rasterized on')
+    bins = zones.zone_count + 1
+    counts = np.zeros(bins, dtype=np.int64)
+    sums = np.zeros(bins, dtype=np.float64)
+    squares = np.zeros(bins, dtype=np.float64)
+    minimums = np.full(bins, np.inf)
+    maximums = np.full(bins, -np.inf)
+    collected_values, collected_ids = [], []
+
+    for row_start, col_start, ids in zones.strips:
+        block = np.asarray(array[row_start:row_start + ids.shape[0],
+                                 col_start:col_start + ids.shape[1]], dtype=np.float64)
+        valid = (ids != NO_ZONE) & np.isfinite(block)
+        if nodata is not None:
+            valid &= block != nodata
+        zone_ids, values = ids[valid], block[valid]
+
+        counts += np.bincount(zone_ids, minlength=bins)
+        sums += np.bincount(zone_ids, weights=values, minlength=bins)
+        squares += np.bincount(zone_ids, weights=values * values, minlength=bins)
+        np.minimum.at(minimums, zone_ids, values)
+        np.maximum.at(maximums, zone_ids, values)
+        if percentiles:
+            collected_values.append(values.astype(np.float32))
+            collected_ids.append(zone_ids)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        variances = np.maximum(squares / counts - means * means, 0)
+    empty = counts == 0
+    minimums[empty], maximums[empty] = np.nan, np.nan
+
+    stats = {
+        'count': counts[1:],
+        'mean': means[1:],
+        'min': minimums[1:],
+        'max': maximums[1:],
+        'std': np.sqrt(variances)[1:],
+    }
+    if percentiles:
+        zone_values = np.concatenate(collected_values) if collected_values else np.empty(0, np.float32)
+        zone_ids = np.concatenate(collected_ids) if collected_ids else np.empty(0, np.uint32)
+        grouped = _grouped_percentiles(zone_values, zone_ids, counts, percentiles)
+        stats.update({name: values[1:] for name, values in grouped.items()})
+    return stats
@@ -1,30 +1,94 @@
 import streamlit as st
 import pandas as pd
-from shapely.geometry import Point
-import geopandas as gpd
+import numpy as np
+import pydeck as pdk
+import pyarrow as pa
+from geo_utils.points import (AGGREGATE_CELL_PIXELS, RAW_POINT_BUDGET, cached_aggregates,
+                              cached_mercator, cached_points, cell_polygons, csv_preview,
+                              fit_zoom, from_mercator, in_view, to_mercator, view_bounds,
+                              zoom_resolution)
+from geo_utils.raster_io import file_digest
 
 # Function to create GeoDataFrame from CSV data
 
 
-def create_geodataframe(data, latitude_col, longitude_col, label_col):
-    if latitude_col not in data.columns or longitude_col not in data.columns:
+def create_geodataframe(uploaded_file, columns, latitude_col, longitude_col, label_col,
+                        attribute_cols):
+    if latitude_col not in columns or longitude_col not in columns:
         st.error(
             "Error: Selected latitude or longitude columns not found in the DataFrame.")
         return None
 
-    geometry = [Point(xy)
-                for xy in zip(data[longitude_col], data[latitude_col])]
-    gdf = gpd.GeoDataFrame(data, geometry=geometry)
-
-    # Set the coordinate reference system to WGS84
-    gdf.crs = 'EPSG:4326'
+    # Stream only the needed columns, dropping rows whose coordinates are
+    # missing or out of range; the points are built in one vectorized call
+    # and use the WGS84 coordinate reference system
+    wanted = list(attribute_cols) + ([label_col] if label_col else [])
+    gdf, dropped = cached_points(uploaded_file, latitude_col, longitude_col, wanted)
+    if dropped:
+        st.warning(f"Dropped {dropped} rows with missing or out-of-range coordinates.")
 
     # Set the label column
-    if label_col and label_col in data.columns:
-        gdf['label'] = data[label_col]
+    if label_col and label_col in gdf.columns:
+        gdf = gdf.assign(label=gdf[label_col])
 
     return gdf
 
+
+def show_point_map(key, gdf, latitude_col, longitude_col):
+    # Raw points when few enough are in view, otherwise hexagon or grid
+    # counts aggregated on the server for the chosen zoom level
+    if gdf.empty:
+        st.info("No points to map.")
+        return
+    x, y = cached_mercator(key, gdf[longitude_col].to_numpy(), gdf[latitude_col].to_numpy())
+
+    st.sidebar.subheader("Map View")
+    map_mode = st.sidebar.selectbox("Map Mode", ["Auto", "Hexagons", "Grid", "Points"])
+    zoom = st.sidebar.slider("Zoom Level", min_value=0, max_value=20, value=fit_zoom(x, y))
+    center_lon, center_lat = from_mercator((x.min() + x.max()) / 2, (y.min() + y.max()) / 2)
+    center_lat = st.sidebar.number_input("Center Latitude", -90.0, 90.0, float(center_lat))
+    center_lon = st.sidebar.number_input("Center Longitude", -180.0, 180.0, float(center_lon))
+
+    bounds = view_bounds(*to_mercator(center_lon, center_lat), zoom)
+    visible = in_view(x, y, bounds)
+    visible_count = int(visible.sum())
+    if map_mode == "Auto":
+        map_mode = "Points" if visible_count <= RAW_POINT_BUDGET else "Hexagons"
+    if map_mode == "Points" and visible_count > RAW_POINT_BUDGET:
+        st.warning(f"{visible_count} points in view; showing hexagons above "
+                   f"{RAW_POINT_BUDGET} points.")
+        map_mode = "Hexagons"
+
+    if map_mode == "Points":
+        # Only the coordinates of the points in view are sent
+        points = pd.DataFrame({
+            'lon': gdf[longitude_col].to_numpy()[visible].astype(np.float32),
+            'lat': gdf[latitude_col].to_numpy()[visible].astype(np.float32)})
+        layer = pdk.Layer("ScatterplotLayer", points, get_position=['lon', 'lat'],
+                          get_fill_color=[255, 80, 0, 160], radius_min_pixels=2)
+        tooltip = None
+    else:
+        kind = 'hexagon' if map_mode == "Hexagons" else 'grid'
+        centre_x, centre_y, counts = cached_aggregates(key, x, y, zoom, kind)
+        # Keep cells whose centre lies within one cell of the view
+        cell_size = AGGREGATE_CELL_PIXELS * zoom_resolution(zoom)
+        left, bottom, right, top = bounds
+        shown = in_view(centre_x, centre_y, (left - cell_size, bottom - cell_size,
+                                             right + cell_size, top + cell_size))
+        cells = pd.DataFrame({
+            'polygon': cell_polygons(centre_x[shown], centre_y[shown], cell_size, kind),
+            'count': counts[shown]})
+        scale = np.log1p(cells['count']) / np.log1p(max(int(counts.max()), 1))
+        cells['color'] = [[int(255 * value), int(200 * (1 - value)), 60, 170] for value in scale]
+        layer = pdk.Layer("PolygonLayer", cells, get_polygon='polygon',
+                          get_fill_color='color', stroked=False, pickable=True)
+        tooltip = {"text": "{count} points"}
+
+    st.pydeck_chart(pdk.Deck(
+        layers=[layer], map_style=None, tooltip=tooltip,
+        initial_view_state=pdk.ViewState(latitude=center_lat, longitude=center_lon, zoom=zoom)))
+    st.caption(f"{visible_count} of {len(gdf)} points in view ({map_mode.lower()}).")
+
 # Streamlit app
 
 
@@ -37,9 +101,8 @@ def main():
     if uploaded_file is not None and uploaded_file.readable():
         # Allow users to select latitude, longitude, and label columns
         try:
-            data = pd.read_csv(uploaded_file)
-            columns = data.columns
-        except pd.errors.EmptyDataError:
+            columns, preview = csv_preview(uploaded_file)
+        except pa.ArrowInvalid:
             st.error("Error: The CSV file is empty.")
             return
 
@@ -48,19 +111,28 @@ def main():
             "Select Longitude Column", options=columns)
         label_col = st.selectbox(
             "Select Label Column (Optional)", options=[""] + list(columns))
+        attribute_cols = st.multiselect(
+            "Other Columns to Keep (Optional)",
+            options=[column for column in columns if column not in (latitude_col, longitude_col)])
 
         st.sidebar.subheader("Data Preview")
-        st.sidebar.write(data.head())
+        st.sidebar.write(preview)
 
         st.sidebar.subheader("Map Preview")
-        gdf = create_geodataframe(data, latitude_col, longitude_col, label_col)
+        gdf = create_geodataframe(uploaded_file, columns, latitude_col, longitude_col,
+                                  label_col, attribute_cols)
 
         if gdf is not None:
-            st.map(gdf)
+            show_point_map((file_digest(uploaded_file), latitude_col, longitude_col),
+                           gdf, latitude_col, longitude_col)
 
+            # The map only reads the selected columns; the saved file keeps
+            # every column of the CSV
             st.sidebar.subheader("Save GeoDataFrame")
             if st.button("Save GeoDataFrame"):
-                gdf.to_file("output.shp", driver="ESRI Shapefile")
+                output = create_geodataframe(uploaded_file, columns, latitude_col, longitude_col,
+                                             label_col, columns)
+                output.to_file("output.shp", driver="ESRI Shapefile")
                 st.success("GeoDataFrame saved successfully!")
 
 
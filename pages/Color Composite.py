@@ -1,13 +1,35 @@
 import streamlit as st
-import numpy as np
+import io
 import tifffile
-from PIL import Image
-from skimage import exposure, img_as_ubyte
-from skimage.filters import unsharp_mask
-
-
-def main():
-    st.title("RGB Composite TIFF Image Viewer")
+from geo_utils.enhance import display_preview, enhance_image
+from geo_utils.raster_io import band_count, file_digest, geotiff_bytes, load_dem, load_image
+from geo_utils.render import cached_composite
+
+
+def pick_band(label, band_total, default):
+    return st.selectbox(label, range(1, band_total + 1), index=min(default, band_total) - 1)
+
+
+def load_composite_bands():
+    # Red, green and blue bands from one multi-band GeoTIFF (only the
+    # picked bands are read) or from three single-band files. The first
+    # band's georeferencing is returned for exports (None for plain TIFFs),
+    # together with a key identifying the selected bands.
+    input_mode = st.radio(
+        "Input", ["One Multi-band GeoTIFF", "Separate Band Files"])
+
+    if input_mode == "One Multi-band GeoTIFF":
+        stack_file = st.file_uploader(
+            "Upload Multi-band GeoTIFF (e.g. Sentinel-2 / Landsat stack)", type=["tif", "tiff"])
+        if not stack_file:
+            return None, None, None
+        band_total = band_count(stack_file)
+        red_band = pick_band("Red Band", band_total, 3)
+        green_band = pick_band("Green Band", band_total, 2)
+        blue_band = pick_band("Blue Band", band_total, 1)
+        bands = [load_dem(stack_file, band=band) for band in (red_band, green_band, blue_band)]
+        return ([band.array for band in bands], bands[0],
+                (bands[0].key, red_band, green_band, blue_band))
 
     # File upload section
     red_tif_file = st.file_uploader(
@@ -16,28 +38,34 @@ def main():
         "Upload Green Grayscale TIFF Image", type=["tif", "tiff"])
     blue_tif_file = st.file_uploader(
         "Upload Blue Grayscale TIFF Image", type=["tif", "tiff"])
+    if not (red_tif_file and green_tif_file and blue_tif_file):
+        return None, None, None
+
+    # Load TIFF images
+    band_files = (red_tif_file, green_tif_file, blue_tif_file)
+    return ([load_image(band_file) for band_file in band_files], None,
+            tuple(file_digest(band_file) for band_file in band_files))
+
+
+def main():
+    st.title("RGB Composite TIFF Image Viewer")
 
-    if red_tif_file and green_tif_file and blue_tif_file:
-        # Load TIFF images
-        red_image = tifffile.imread(red_tif_file)
-        green_image = tifffile.imread(green_tif_file)
-        blue_image = tifffile.imread(blue_tif_file)
+    bands, georeference, key = load_composite_bands()
 
-        # Normalize pixel values to [0, 255] range
-        normalized_red = (red_image - red_image.min()) / \
-            (red_image.max() - red_image.min()) * 255
-        normalized_green = (green_image - green_image.min()) / \
-            (green_image.max() - green_image.min()) * 255
-        normalized_blue = (blue_image - blue_image.min()) / \
-            (blue_image.max() - blue_image.min()) * 255
+    if bands is not None:
+        # Normalize pixel values to [0, 255] range and stack them into an
+        # RGB composite, block by block (built once per band selection).
+        # Clipping a percentage of each band's extremes helps 16-bit scenes.
+        band_clip = st.slider(
+            "Band Stretch Clip (%)", min_value=0.0, max_value=5.0, value=0.0, step=0.5)
+        rgb_image = cached_composite(key, *bands, clip=band_clip)
 
-        # Stack normalized images to create RGB composite
-        rgb_image = np.stack(
-            [normalized_red, normalized_green, normalized_blue], axis=-1).astype(np.uint8)
+        # Sliders only ever work on a display-sized copy of the composite
+        preview = display_preview((key, band_clip), rgb_image)
 
         # Display the RGB composite image
         st.subheader("Original RGB Composite Image")
-        st.image(rgb_image, use_column_width=True)
+        st.image(preview, use_column_width=True)
 
         # Enhancement sliders
         st.subheader("Enhancement Controls")
@@ -54,36 +82,46 @@ def main():
         contrast_stretching = st.slider(
             "Contrast Stretching", min_value=0, max_value=10, value=0, step=1)
 
-        # Apply brightness adjustment
-        enhanced_image = exposure.adjust_gamma(
-            rgb_image, brightness_adjustment / 10)
-
-        # Apply histogram equalization
-        if histogram_equalization == 1:
-            enhanced_image = exposure.equalize_hist(enhanced_image)
-
-        # Apply gamma correction
-        enhanced_image = exposure.adjust_gamma(
-            enhanced_image, gamma_correction)
-
-        # Apply sharpness enhancement
-        enhanced_image = img_as_ubyte(unsharp_mask(
-            enhanced_image, radius=1, amount=sharpness))
-
-        # Apply contrast stretching
-        if contrast_stretching > 0:
-            p2, p98 = np.percentile(
-                enhanced_image, (contrast_stretching, 100 - contrast_stretching))
-            enhanced_image = exposure.rescale_intensity(
-                enhanced_image, in_range=(p2, p98))
-
-        # Apply enhancement to the image
-        enhanced_image = exposure.adjust_gamma(
-            enhanced_image, enhancement_level)
+        # Brightness, histogram equalization, gamma correction, sharpness,
+        # contrast stretching and the overall enhancement level, in that order
+        settings = dict(brightness=brightness_adjustment / 10,
+                        equalize=histogram_equalization == 1,
+                        gamma=gamma_correction, sharpness=sharpness,
+                        stretch=contrast_stretching, level=enhancement_level)
 
         # Display the enhanced RGB composite image
         st.subheader("Enhanced RGB Composite Image")
-        st.image(enhanced_image, use_column_width=True)
+        st.image(enhance_image(preview, **settings), use_column_width=True)
+
+        # The full-resolution chain only runs when an export is requested
+        st.subheader("Export")
+        if st.button("Prepare Full-Resolution Export"):
+            enhanced_image = enhance_image(rgb_image, **settings)
+            if georeference is not None:
+                # Keep the georeferencing of the source scene
+                layers = [enhanced_image[..., channel] for channel in range(3)]
+                st.download_button(
+                    label="Download Enhanced Composite as GeoTIFF",
+                    data=geotiff_bytes(layers, georeference.transform, georeference.crs),
+                    file_name="enhanced_composite.tif",
+                    mime="image/tiff"
+                )
+                st.download_button(
+                    label="Download Composite as GeoTIFF",
+                    data=geotiff_bytes([rgb_image[..., channel] for channel in range(3)],
+                                       georeference.transform, georeference.crs),
+                    file_name="composite.tif",
+                    mime="image/tiff"
+                )
+            else:
+                buffer = io.BytesIO()
+                tifffile.imwrite(buffer, enhanced_image, photometric='rgb')
+                st.download_button(
+                    label="Download Enhanced Composite as TIFF",
+                    data=buffer.getvalue(),
+                    file_name="enhanced_composite.tif",
+                    mime="image/tiff"
+                )
 
 
 if __name__ == '__main__':
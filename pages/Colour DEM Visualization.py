@@ -1,10 +1,13 @@
 import streamlit as st
 from PIL import Image
-from io import BytesIO
-import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import ListedColormap
+from geo_utils.raster_io import raster_shape, read_dem_preview, read_dem_window
+from geo_utils.render import (colorize, composite, display_sample, display_step, draw_markers,
+                              encode_image, mask_layer, render_legend, render_raster)
+from geo_utils.terrain import cell_size
+from geo_utils.viewshed import cumulative_viewshed, viewshed
 
 
 def main():
@@ -14,13 +17,23 @@ def main():
         "Upload a TIF image", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
+        # Read a display-sized DEM from the file overviews so large rasters
+        # never have to be decoded in full
+        display_size = st.sidebar.slider(
+            "Display Resolution (pixels)", min_value=256, max_value=4096, value=1024, step=256)
+        dem = read_dem_preview(uploaded_file, display_size)
+        dem_array, transform = dem.array, dem.transform
 
-        # Open the image using BytesIO
-        dem_data = rasterio.open(BytesIO(file_contents))
-        dem_array = dem_data.read(1)
-        transform = dem_data.transform
+        # Optionally replace the preview with a full-resolution region
+        height, width = raster_shape(uploaded_file)
+        if st.sidebar.checkbox("Full-Resolution Region"):
+            row_start, row_stop = st.sidebar.slider(
+                "Rows", min_value=0, max_value=height, value=(0, min(height, display_size)))
+            col_start, col_stop = st.sidebar.slider(
+                "Columns", min_value=0, max_value=width, value=(0, min(width, display_size)))
+            dem = read_dem_window(
+                uploaded_file, row_start, row_stop, col_start, col_stop)
+            dem_array, transform = dem.array, dem.transform
 
         # Set default elevation range
         elevation_min, elevation_max = np.min(dem_array), np.max(dem_array)
@@ -38,14 +51,71 @@ def main():
         # Update colormap based on user selection
         colormap = plt.cm.get_cmap(colormap_name)
 
-        # Apply the colormap to the DEM array
-        plt.imshow(dem_array, cmap=colormap,
-                   vmin=elevation_min, vmax=elevation_max)
-        plt.colorbar(label='Elevation (meters)')
-        plt.title('Digital Elevation Model with Colormap')
-        st.pyplot()
+        # Apply the colormap to the DEM array through a LUT
+        st.image(render_raster(dem_array, colormap, elevation_min, elevation_max, dem.nodata),
+                 caption='Digital Elevation Model with Colormap', use_column_width=True)
+        st.image(render_legend(colormap, elevation_min, elevation_max, 'Elevation (meters)'))
 
-        # Continue with the rest of your code for visibility analysis
+        # Visibility analysis on the displayed DEM
+        st.subheader("Viewshed Analysis")
+        observer_mode = st.radio(
+            "Observers", ["Single Observer", "Multiple Observers (Cumulative)"])
+        observer_height = st.number_input(
+            "Observer Height (meters)", min_value=0.0, value=1.7)
+        target_height = st.number_input(
+            "Target Height (meters)", min_value=0.0, value=0.0)
+        max_distance = st.number_input(
+            "Maximum Distance (meters, 0 = unlimited)", min_value=0.0, value=0.0)
+        earth_curvature = st.checkbox("Correct for Earth Curvature", value=True)
+
+        dx, dy = cell_size(transform, dem.crs, dem_array.shape)
+        settings = dict(cell_size=(dx, dy), observer_height=observer_height,
+                        target_height=target_height, max_distance=max_distance or None,
+                        earth_curvature=earth_curvature, nodata=dem.nodata)
+        rows, cols = dem_array.shape
+
+        if observer_mode == "Single Observer":
+            observer_col = st.number_input(
+                "Observer Column", min_value=0, max_value=cols - 1, value=cols // 2)
+            observer_row = st.number_input(
+                "Observer Row", min_value=0, max_value=rows - 1, value=rows // 2)
+
+            visible = viewshed(dem_array, (observer_row, observer_col), **settings)
+
+            # Composite only the cells that are displayed
+            step = display_step(dem_array.shape)
+            image = composite(colorize(display_sample(dem_array), 'gray', nodata=dem.nodata),
+                              mask_layer(display_sample(visible), 'red', alpha=0.5))
+            image = draw_markers(image, observer_row // step, observer_col // step, 'blue')
+            st.image(encode_image(image), caption='Visible Area', use_column_width=True)
+            st.write(
+                f"Visible area: {visible.sum() * dx * dy / 1e6:.3f} km²")
+        else:
+            observers_text = st.text_area(
+                "Observer Points (one 'column, row' pair per line)")
+            try:
+                observers = [(int(float(row)), int(float(col)))
+                             for col, row in (line.split(',') for line in observers_text.splitlines()
+                                              if line.strip())]
+            except ValueError:
+                st.error("Error: Observer points must be 'column, row' pairs.")
+                observers = []
+
+            if observers and st.button("Compute Cumulative Viewshed"):
+                # Observers run in parallel on a process pool
+                counts = cumulative_viewshed(dem_array, observers, **settings)
+
+                step = display_step(dem_array.shape)
+                image = composite(
+                    colorize(display_sample(dem_array), 'gray', nodata=dem.nodata),
+                    colorize(display_sample(counts), 'viridis', 1, len(observers),
+                             nodata=0, alpha=0.7))
+                observer_rows, observer_cols = zip(*observers)
+                image = draw_markers(image, np.array(observer_rows) // step,
+                                     np.array(observer_cols) // step, 'red', size=4)
+                st.image(encode_image(image), caption='Cumulative Viewshed',
+                         use_column_width=True)
+                st.image(render_legend('viridis', 1, len(observers), 'Number of Observers'))
 
 
 if __name__ == "__main__":
@@ -1,10 +1,11 @@
 import streamlit as st
 from PIL import Image
-from io import BytesIO
-import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 from matplotlib.colors import ListedColormap
+from geo_utils.contours import MAX_CONTOUR_LEVELS, contours_geojson, contours_geopackage, dem_contours
+from geo_utils.raster_io import load_dem
 
 
 def main():
@@ -14,16 +15,13 @@ def main():
         "Upload a TIF image", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
-
-        # Open the image using BytesIO
-        dem_data = rasterio.open(BytesIO(file_contents))
-        dem_array = dem_data.read(1)
-        transform = dem_data.transform
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+        dem_array, transform = dem.array, dem.transform
 
         # Set default elevation range
         elevation_min, elevation_max = np.min(dem_array), np.max(dem_array)
+        dem_span = float(elevation_max - elevation_min)
 
         # Set default colormap
         colormap_option = st.selectbox(
@@ -43,49 +41,85 @@ def main():
             "Elevation Range", elevation_min, elevation_max, (elevation_min, elevation_max))
 
         # Calculate default contour line spacing
-        contour_spacing_default = (elevation_max - elevation_min) / 10
-
-        # Add slider for contour line spacing
+        elevation_span = max(float(elevation_max - elevation_min), 1.0)
+        contour_spacing_default = max(elevation_span / 10, 1.0)
+
+        # Add slider for contour line spacing; lines are traced over the
+        # whole DEM, so finer spacings than MAX_CONTOUR_LEVELS allows are
+        # not offered
+        spacing_min = float(max(np.ceil(dem_span / (MAX_CONTOUR_LEVELS - 1)), 1.0))
+        elevation_span = max(elevation_span, spacing_min)
         contour_spacing = st.slider(
-            "Contour Line Spacing", float(elevation_min), float(elevation_max), float(contour_spacing_default))
+            "Contour Line Spacing", spacing_min, elevation_span,
+            float(min(max(contour_spacing_default, spacing_min), elevation_span)))
 
         # Round contour spacing to the nearest integer
-        contour_spacing = round(contour_spacing)
+        contour_spacing = max(round(contour_spacing), 1)
 
         # Add checkboxes to toggle contour lines and elevation annotations
         show_contours = st.checkbox("Show Contour Lines")
         show_elevation = st.checkbox("Show Elevation Annotations")
 
-        # Apply the colormap to the DEM array
-        plt.imshow(dem_array, cmap=colormap,
-                   vmin=elevation_min, vmax=elevation_max)
-
-        if show_contours:
-            # Add contour lines
-            contour_levels = np.arange(
-                elevation_min, elevation_max, contour_spacing)
-            plt.contour(dem_array, levels=contour_levels,
-                        colors='black', linewidths=0.5)
+        # Optional generalisation of the traced lines (map units)
+        simplify_tolerance = st.sidebar.number_input(
+            "Simplify Tolerance (map units)", min_value=0.0, value=0.0)
+        smooth_iterations = st.sidebar.slider(
+            "Smoothing Iterations", min_value=0, max_value=5, value=0)
+
+        # Apply the colormap to the DEM array, in map coordinates so the
+        # contour vectors can be drawn on top without conversion
+        left, top = transform * (0, 0)
+        right, bottom = transform * (dem_array.shape[1], dem_array.shape[0])
+        plt.imshow(dem_array, cmap=colormap, vmin=elevation_min, vmax=elevation_max,
+                   extent=(left, right, bottom, top))
+
+        contours = []
+        if show_contours or show_elevation:
+            # Contours are traced once per DEM and spacing, then cached
+            try:
+                traced = dem_contours(dem, contour_spacing, 0.0, simplify_tolerance,
+                                      smooth_iterations)
+            except ValueError as error:
+                st.error(f"Error: {error}")
+                traced = []
+            contours = [(level, line) for level, line in traced
+                        if elevation_min <= level <= elevation_max]
+            plt.gca().add_collection(LineCollection(
+                [np.asarray(line.coords) for _, line in contours],
+                colors='black', linewidths=0.5))
 
         if show_elevation:
-            if show_contours:  # Ensure DEM is not displayed twice
-                plt.clf()  # Clear the existing plot
-            # Display the DEM
-            plt.imshow(dem_array, cmap=colormap,
-                       vmin=elevation_min, vmax=elevation_max)
-            # Add contour lines
-            contour_levels = np.arange(
-                elevation_min, elevation_max, contour_spacing)
-            contour = plt.contour(dem_array, levels=contour_levels,
-                                  colors='black', linewidths=0.5)
-            # Annotate contour lines with elevation values
-            plt.clabel(contour, inline=True, fontsize=8, fmt='%1.0f')
+            # Annotate contour lines with elevation values at their midpoint
+            for level, line in contours:
+                if line.length > 0:
+                    label_point = line.interpolate(0.5, normalized=True)
+                    plt.text(label_point.x, label_point.y, f'{level:1.0f}', fontsize=8,
+                             ha='center', va='center',
+                             bbox=dict(boxstyle='round,pad=0.1', fc='white', ec='none', alpha=0.7))
 
         plt.colorbar(label='Elevation (meters)')
         plt.title('Digital Elevation Model')
         plt.axis('off')  # Disable axis
         st.pyplot()
 
+        # Export the contour vectors
+        if contours:
+            # Both files are only encoded when an export is requested
+            st.subheader("Export Contour Lines")
+            if st.button("Prepare Contour Exports"):
+                st.download_button(
+                    label="Download Contours as GeoJSON",
+                    data=contours_geojson(contours, dem.crs),
+                    file_name="contours.geojson",
+                    mime="application/geo+json"
+                )
+                st.download_button(
+                    label="Download Contours as GeoPackage",
+                    data=contours_geopackage(contours, dem.crs),
+                    file_name="contours.gpkg",
+                    mime="application/geopackage+sqlite3"
+                )
+
 
 if __name__ == "__main__":
     main()
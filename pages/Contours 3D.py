@@ -1,20 +1,16 @@
 import streamlit as st
 import numpy as np
-import rasterio
-from io import BytesIO
 import plotly.graph_objects as go
+from geo_utils.mesh import DEFAULT_VERTEX_BUDGET, crop_dem, decimate_dem, mesh_coordinates
+from geo_utils.raster_io import load_dem
 
 
-def read_dem(dem_path):
-    with rasterio.open(dem_path) as dataset:
-        elevation = dataset.read(1)
-        transform = dataset.transform
-        return elevation, transform
-
-
-def plot_3d_contour(dem_array, contour_levels):
-    rows, cols = dem_array.shape
-    x, y = np.meshgrid(np.arange(0, cols), np.arange(0, rows))
+def plot_3d_contour(mesh, contour_levels):
+    # `mesh` is a decimated DemData, so the figure size follows the vertex
+    # budget rather than the DEM size
+    dem_array = mesh.array
+    x_axis, y_axis = mesh_coordinates(mesh)
+    x, y = np.meshgrid(x_axis, y_axis)
 
     fig = go.Figure()
 
@@ -34,10 +30,12 @@ def plot_3d_contour(dem_array, contour_levels):
     # Add contour lines
     fig.add_trace(go.Contour(
         z=dem_array,
+        x=x_axis,
+        y=y_axis,
         colorscale='Viridis',  # Use the same colorscale
         opacity=0.6,
-        contours=dict(showlines=True, start=np.min(dem_array),
-                      end=np.max(dem_array), size=contour_levels)
+        contours=dict(showlines=True, start=np.nanmin(dem_array),
+                      end=np.nanmax(dem_array), size=contour_levels)
     ))
 
     fig.update_layout(scene=dict(aspectmode="manual",
@@ -56,11 +54,9 @@ def main():
         "Upload a TIF image", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
-
-        # Open the image using BytesIO
-        dem_array, transform = read_dem(BytesIO(file_contents))
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+        dem_array, transform = dem.array, dem.transform
 
         # Display the 3D contour plot with contour lines using Plotly
         st.subheader("3D Contour Plot with Contour Lines")
@@ -69,7 +65,26 @@ def main():
         contour_levels = st.slider(
             "Contour Levels", min_value=1, max_value=50, value=10)
 
-        plot_3d_contour(dem_array, contour_levels)
+        # Level of detail: the DEM is block-averaged down to the vertex budget
+        vertex_budget = st.sidebar.slider(
+            "Vertex Budget", min_value=10_000, max_value=1_000_000,
+            value=DEFAULT_VERTEX_BUDGET, step=10_000)
+
+        # Optionally re-mesh a zoomed region at full detail
+        height, width = dem_array.shape
+        if st.sidebar.checkbox("Refine Region"):
+            row_start, row_stop = st.sidebar.slider(
+                "Rows", min_value=0, max_value=height, value=(0, min(height, 500)))
+            col_start, col_stop = st.sidebar.slider(
+                "Columns", min_value=0, max_value=width, value=(0, min(width, 500)))
+            if row_stop > row_start and col_stop > col_start:
+                dem = crop_dem(dem, row_start, row_stop, col_start, col_stop)
+
+        mesh = decimate_dem(dem, vertex_budget)
+        st.caption(f"Showing {mesh.array.shape[1]} x {mesh.array.shape[0]} vertices "
+                   f"of a {dem.array.shape[1]} x {dem.array.shape[0]} DEM")
+
+        plot_3d_contour(mesh, contour_levels)
 
 
 if __name__ == "__main__":
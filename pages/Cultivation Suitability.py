@@ -1,8 +1,11 @@
 import streamlit as st
-import rasterio
-from io import BytesIO
+import math
 import numpy as np
 import plotly.graph_objects as go
+from geo_utils.mesh import decimate_dem, decimation_factor
+from geo_utils.raster_io import load_dem
+from geo_utils.threshold import ThresholdMask, dem_sorted_index, threshold_stats, value_bounds
+from geo_utils.ui import multi_criteria_overlay
 
 
 def main():
@@ -12,36 +15,54 @@ def main():
         "Upload a GeoTIFF DEM file", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
-
-        # Open the GeoTIFF using BytesIO
-        with BytesIO(file_contents) as byte_io:
-            dem_data = rasterio.open(byte_io)
-            dem_array = dem_data.read(1)
-
-            # Add sliders to adjust elevation values
-            min_elevation = int(np.min(dem_array))
-            max_elevation = int(np.max(dem_array))
-            elevation_threshold = st.slider(
-                "Cultivation Suitability Elevation", min_value=min_elevation, max_value=max_elevation, value=max_elevation, step=1)
-
-            # Clip elevation values based on sliders
-            dem_array = np.clip(dem_array, min_elevation, max_elevation)
-
-            # Normalize data to [0, 255]
-            normalized_data = normalize_to_255(dem_array)
-
-            # Display 2D Terrain and Cultivation Suitability
-            plot_2d_terrain(normalized_data)
-            plot_cultivation_suitability(dem_array, elevation_threshold)
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+
+        # Sort the elevations once per DEM; thresholds are then answered by
+        # binary search
+        elevation_index = dem_sorted_index(dem)
+
+        # Add sliders to adjust elevation values
+        bounds = value_bounds(elevation_index)
+        if bounds is None:
+            st.error("Error: The DEM has no valid elevation cells.")
+            return
+        min_elevation = math.floor(bounds[0])
+        max_elevation = math.ceil(bounds[1])
+        elevation_threshold = st.slider(
+            "Cultivation Suitability Elevation", min_value=min_elevation, max_value=max_elevation, value=max_elevation, step=1)
+
+        # Normalize the decimated terrain to [0, 255] for the surface plot
+        normalized_data = normalize_to_255(decimate_dem(dem).array)
+
+        # The suitability mask lives in the session and a slider move only
+        # flips the cells between the previous and the new threshold
+        suitability = st.session_state.get("cultivation_mask")
+        if suitability is None or suitability.index is not elevation_index:
+            suitability = ThresholdMask(
+                elevation_index, factor=decimation_factor(elevation_index.shape))
+            st.session_state["cultivation_mask"] = suitability
+        suitability.update(elevation_threshold)
+
+        # Display 2D Terrain and Cultivation Suitability
+        plot_2d_terrain(normalized_data)
+        plot_cultivation_suitability(suitability.coverage(), elevation_threshold)
+
+        stats = threshold_stats(elevation_index, elevation_threshold)
+        st.write(f"Suitable area: {stats['hectares']:,.2f} ha "
+                 f"({stats['percent']:.1f}% of the DEM)")
+
+        # Combine several factors instead of the single elevation cutoff
+        if st.checkbox("Multi-Criteria Suitability"):
+            multi_criteria_overlay(dem, elevation_index, 'cultivation', 'RdYlGn',
+                                   "Multi-Criteria Cultivation Suitability")
 
 
 def normalize_to_255(data):
-    # Normalize data to [0, 255]
-    min_val, max_val = np.min(data), np.max(data)
-    normalized_data = 255 * (data - min_val) / (max_val - min_val)
-    return normalized_data.astype(np.uint8)
+    # Normalize data to [0, 255]; nodata (NaN) cells map to 0
+    min_val, max_val = np.nanmin(data), np.nanmax(data)
+    normalized_data = 255 * (data - min_val) / max(max_val - min_val, 1e-9)
+    return np.nan_to_num(normalized_data).astype(np.uint8)
 
 
 def plot_2d_terrain(data):
@@ -62,11 +83,10 @@ def plot_2d_terrain(data):
     st.plotly_chart(fig_2d, use_container_width=True)
 
 
-def plot_cultivation_suitability(data, threshold):
-    # Create a Cultivation Suitability plot using Plotly
-    cultivation_suitability = np.zeros_like(data)
-    # Set areas below the threshold to 1 (suitable for cultivation)
-    cultivation_suitability[data <= threshold] = 1
+def plot_cultivation_suitability(cultivation_suitability, threshold):
+    # Create a Cultivation Suitability plot using Plotly. The input is the
+    # share of cells at or below the threshold (suitable for cultivation) in
+    # each displayed block.
 
     fig_cultivation = go.Figure(go.Surface(
         z=cultivation_suitability, colorscale='Greens'))
@@ -1,29 +1,23 @@
 import streamlit as st
-import numpy as np
 import plotly.graph_objects as go
-import rasterio
-from io import BytesIO
-import matplotlib.pyplot as plt
+from geo_utils.mesh import DEFAULT_VERTEX_BUDGET, decimate_dem, mesh_coordinates
+from geo_utils.raster_io import raster_shape, read_dem_preview, read_dem_window
+from geo_utils.render import render_legend, render_raster, value_range
 
 
-def read_dem(dem_path):
-    with rasterio.open(dem_path) as dataset:
-        elevation = dataset.read(1)
-        transform = dataset.transform
-        return elevation, transform
+def plot_dem_2d(dem_array, nodata=None):
+    # Colour through a LUT and send the PNG straight to the browser
+    vmin, vmax = value_range(dem_array, nodata)
+    st.image(render_raster(dem_array, 'terrain', vmin, vmax, nodata),
+             caption='Digital Elevation Model (DEM)', use_column_width=True)
+    st.image(render_legend('terrain', vmin, vmax, 'Elevation (meters)'))
 
 
-def plot_dem_2d(dem_array):
-    plt.imshow(dem_array, cmap='terrain')
-    plt.colorbar(label='Elevation (meters)')
-    plt.title('Digital Elevation Model (DEM)')
-    st.pyplot()
-
-
-def plot_dem_3d(dem_array, transform):
-    rows, cols = dem_array.shape
-    x, y = np.meshgrid(np.arange(0, cols), np.arange(0, rows))
-    z = dem_array
+def plot_dem_3d(dem, max_vertices=DEFAULT_VERTEX_BUDGET):
+    # Decimate to the vertex budget before building the surface
+    mesh = decimate_dem(dem, max_vertices)
+    x, y = mesh_coordinates(mesh)
+    z = mesh.array
 
     trace = go.Surface(z=z, x=x, y=y, colorscale="Viridis")
     layout = go.Layout(
@@ -46,21 +40,41 @@ def main():
         "Upload a TIF image", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
-
-        # Open the image using BytesIO
-        dem_array, transform = read_dem(BytesIO(file_contents))
+        # Read a display-sized DEM from the file overviews so large rasters
+        # never have to be decoded in full
+        display_size = st.sidebar.slider(
+            "Display Resolution (pixels)", min_value=256, max_value=4096, value=1024, step=256)
+        dem = read_dem_preview(uploaded_file, display_size)
+        dem_array, transform = dem.array, dem.transform
 
         # Display the 2D DEM
         st.subheader("2D Digital Elevation Model (DEM)")
-        plot_dem_2d(dem_array)
+        plot_dem_2d(dem_array, dem.nodata)
+
+        # Read only the selected region at full resolution
+        height, width = raster_shape(uploaded_file)
+        region = None
+        if st.checkbox("Inspect Region at Full Resolution"):
+            row_start, row_stop = st.slider(
+                "Rows", min_value=0, max_value=height, value=(0, min(height, display_size)))
+            col_start, col_stop = st.slider(
+                "Columns", min_value=0, max_value=width, value=(0, min(width, display_size)))
+            region = read_dem_window(
+                uploaded_file, row_start, row_stop, col_start, col_stop)
+            st.subheader("Full-Resolution Region")
+            plot_dem_2d(region.array, region.nodata)
+
+        # Level of detail for the 3D view; a full-resolution region, when
+        # selected, is re-meshed at full detail within the same budget
+        vertex_budget = st.sidebar.slider(
+            "3D Vertex Budget", min_value=10_000, max_value=1_000_000,
+            value=DEFAULT_VERTEX_BUDGET, step=10_000)
 
         # Display the option for 3D view
         if st.button("Switch to 3D View"):
             # Display the 3D DEM
             st.subheader("3D Digital Elevation Model (DEM)")
-            fig = plot_dem_3d(dem_array, transform)
+            fig = plot_dem_3d(region if region is not None else dem, vertex_budget)
             st.plotly_chart(fig)
 
 
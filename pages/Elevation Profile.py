@@ -1,8 +1,10 @@
 import streamlit as st
-import rasterio
-from io import BytesIO
 import numpy as np
 import matplotlib.pyplot as plt
+from geo_utils.profile import (corridor_polylines, map_to_pixel,
+                               sample_profile, sample_profiles)
+from geo_utils.raster_io import load_dem
+from geo_utils.viewshed import line_of_sight
 
 
 def main():
@@ -12,70 +14,87 @@ def main():
         "Upload a TIF image", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
-
-        # Open the image using BytesIO
-        dem_data = rasterio.open(BytesIO(file_contents))
-        dem_array = dem_data.read(1)
-        transform = dem_data.transform
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+        dem_array, transform = dem.array, dem.transform
+
+        # Choose whether the points are given as pixel or map coordinates
+        coordinate_type = st.radio(
+            "Coordinate Type", ["Pixel (column, row)", "Map (x, y)"])
+        pixel_coordinates = coordinate_type.startswith("Pixel")
+
+        if pixel_coordinates:
+            default_start, default_end = (0.0, 0.0), (100.0, 100.0)
+        else:
+            # Default to the diagonal between the first and last cell centres
+            default_start = transform * (0.5, 0.5)
+            default_end = transform * (dem_array.shape[1] - 0.5, dem_array.shape[0] - 0.5)
 
         # Get the coordinates of the two points for the line of sight analysis
-        x1 = st.number_input("Enter the X coordinate of Point 1:", value=0.0)
-        y1 = st.number_input("Enter the Y coordinate of Point 1:", value=0.0)
-        x2 = st.number_input("Enter the X coordinate of Point 2:", value=100.0)
-        y2 = st.number_input("Enter the Y coordinate of Point 2:", value=100.0)
+        x1 = st.number_input("Enter the X coordinate of Point 1:", value=float(default_start[0]))
+        y1 = st.number_input("Enter the Y coordinate of Point 1:", value=float(default_start[1]))
+        x2 = st.number_input("Enter the X coordinate of Point 2:", value=float(default_end[0]))
+        y2 = st.number_input("Enter the Y coordinate of Point 2:", value=float(default_end[1]))
 
-        # Calculate the terrain profile along the line of sight
-        profile = calculate_terrain_profile(
-            dem_array, transform, x1, y1, x2, y2)
+        # Sample bilinearly interpolated elevations along the line
+        distances, profile, xs, ys = sample_profile(
+            dem, [(x1, y1), (x2, y2)], pixel_coordinates=pixel_coordinates)
 
-        # Plot DEM data with the line of sight
+        # Plot DEM data with the line of sight (in pixel coordinates)
+        rows, cols = map_to_pixel(transform, xs[[0, -1]], ys[[0, -1]])
         plt.imshow(dem_array, cmap='gray')
-        plt.plot([x1, x2], [y1, y2], color='red',
+        plt.plot(cols, rows, color='red',
                  linewidth=2, label='Line of Sight')
         plt.colorbar()
         plt.title('Digital Elevation Model with Line of Sight')
         plt.legend()
         st.pyplot()
 
+        # Check which points of the profile are visible from Point 1
+        observer_height = st.number_input(
+            "Observer Height at Point 1 (meters)", min_value=0.0, value=1.7)
+        target_height = st.number_input(
+            "Target Height (meters)", min_value=0.0, value=0.0)
+        visible = line_of_sight(distances, profile, observer_height, target_height)
+        if visible[-1]:
+            st.success("Point 2 is visible from Point 1.")
+        else:
+            st.warning("Point 2 is not visible from Point 1.")
+
         # Plot terrain profile
         plt.figure()
-        plt.plot(profile, label='Terrain Profile')
-        plt.xlabel('Distance along Line of Sight')
+        plt.plot(distances, profile, label='Terrain Profile')
+        plt.scatter(distances[~visible], profile[~visible], color='red', s=4,
+                    label='Hidden from Point 1')
+        plt.xlabel('Distance along Line of Sight (meters)')
         plt.ylabel('Elevation')
         plt.title('Terrain Profile along Line of Sight')
         plt.legend()
         st.pyplot()
 
-
-def calculate_terrain_profile(dem_array, transform, x1, y1, x2, y2):
-    # Calculate the number of steps for iteration based on the greater of dx or dy
-    dx = x2 - x1
-    dy = y2 - y1
-    steps = max(abs(dx), abs(dy))
-
-    # Calculate the increments for x and y
-    x_inc = dx / steps
-    y_inc = dy / steps
-
-    # Start from the source point
-    x = x1
-    y = y1
-
-    # Create an array to store the elevation values along the line of sight
-    profile = []
-
-    # Iterate over the cells between source and target
-    for _ in range(int(steps)):
-        x += x_inc
-        y += y_inc
-
-        # Append the elevation of the current point to the profile array
-        elevation = dem_array[int(y), int(x)]
-        profile.append(elevation)
-
-    return profile
+        # Profile a corridor of parallel lines in one batched call
+        if st.checkbox("Show Corridor Profiles"):
+            corridor_width = st.slider(
+                "Corridor Width (pixels)", min_value=1, max_value=500, value=50)
+            line_count = st.slider(
+                "Number of Profiles", min_value=2, max_value=500, value=100)
+
+            map_line = np.column_stack([xs[[0, -1]], ys[[0, -1]]])
+            corridor = corridor_polylines(
+                map_line, corridor_width * abs(transform.a), line_count)
+            corridor_distances, corridor_profiles, _, _ = sample_profiles(
+                dem, corridor, samples=len(distances))
+
+            plt.figure()
+            plt.fill_between(corridor_distances[0], np.nanmin(corridor_profiles, axis=0),
+                             np.nanmax(corridor_profiles, axis=0), alpha=0.3, label='Min - Max')
+            plt.plot(corridor_distances[0], np.nanmean(corridor_profiles, axis=0),
+                     label='Mean Elevation')
+            plt.xlabel('Distance along Corridor (meters)')
+            plt.ylabel('Elevation')
+            plt.title('Corridor Terrain Profile')
+            plt.legend()
+            st.pyplot()
 
 
 if __name__ == "__main__":
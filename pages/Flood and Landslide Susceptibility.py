@@ -1,8 +1,25 @@
 import streamlit as st
-import rasterio
-from io import BytesIO
+import math
 import numpy as np
 import plotly.graph_objects as go
+from geo_utils.hydrology import dem_spill_levels, inundation, inundation_sweep
+from geo_utils.mesh import block_mean, decimate_dem, decimation_factor
+from geo_utils.raster_io import load_dem
+from geo_utils.render import render_legend, render_raster
+from geo_utils.terrain import cell_size, dem_terrain
+from geo_utils.threshold import ThresholdMask, dem_sorted_index, threshold_stats, value_bounds
+from geo_utils.ui import multi_criteria_overlay
+
+
+def threshold_mask(name, index, above=False):
+    # Incrementally updated mask kept in the session, so a slider move only
+    # flips the cells between the previous and the new threshold
+    state_key = f"{name}_mask"
+    mask = st.session_state.get(state_key)
+    if mask is None or mask.index is not index:
+        mask = ThresholdMask(index, above, factor=decimation_factor(index.shape))
+        st.session_state[state_key] = mask
+    return mask
 
 
 def main():
@@ -12,16 +29,28 @@ def main():
         "Upload a GeoTIFF DEM file", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+        dem_array = dem.array
 
-        # Open the GeoTIFF using BytesIO
-        dem_data = rasterio.open(BytesIO(file_contents))
-        dem_array = dem_data.read(1)
+        # Sort the elevations (and slopes) once per DEM; thresholds are then
+        # answered by binary search
+        elevation_index = dem_sorted_index(dem)
+        slope = dem_terrain(dem, products=('slope',))['slope']
+        slope_index = dem_sorted_index(dem, slope, product='slope')
 
         # Add sliders to adjust elevation values
-        min_elevation = int(np.min(dem_array))
-        max_elevation = int(np.max(dem_array))
+        bounds = value_bounds(elevation_index)
+        if bounds is None:
+            st.error("Error: The DEM has no valid elevation cells.")
+            return
+        min_elevation = math.floor(bounds[0])
+        max_elevation = math.ceil(bounds[1])
+
+        # Flood model: every cell below the level, or only the cells the
+        # water can reach from its sources
+        flood_model = st.radio(
+            "Flood Model", ["Elevation Threshold", "Connected Inundation"])
 
         # Slider for flood susceptibility
         flood_threshold = st.slider(
@@ -31,23 +60,93 @@ def main():
         landslide_threshold = st.slider(
             "Landslide Threshold Slope", min_value=0.1, max_value=45.0, value=10.0, step=0.1)
 
-        # Clip elevation values based on sliders
-        dem_array = np.clip(dem_array, min_elevation, max_elevation)
-
-        # Normalize data to [0, 255]
-        normalized_data = normalize_to_255(dem_array)
+        # Normalize the decimated terrain to [0, 255] for the surface plot
+        normalized_data = normalize_to_255(decimate_dem(dem).array)
 
         # Display 2D Terrain, Flood Susceptibility, and Landslide Susceptibility
         plot_2d_terrain(normalized_data)
-        plot_flood_susceptibility(dem_array, flood_threshold)
-        plot_landslide_susceptibility(dem_array, landslide_threshold)
+
+        if flood_model == "Elevation Threshold":
+            flood_mask = threshold_mask("flood", elevation_index)
+            flood_mask.update(flood_threshold)
+            plot_flood_susceptibility(flood_mask.coverage(), flood_threshold)
+            show_threshold_stats("Flood-prone area", elevation_index, flood_threshold)
+        else:
+            plot_inundation(dem, flood_threshold, min_elevation, max_elevation)
+
+        landslide_mask = threshold_mask("landslide", slope_index, above=True)
+        landslide_mask.update(landslide_threshold)
+        plot_landslide_susceptibility(landslide_mask.coverage(), landslide_threshold)
+        show_threshold_stats("Landslide-prone area", slope_index, landslide_threshold,
+                             above=True)
+
+        # Combine several factors instead of the single slope cutoff
+        if st.checkbox("Multi-Criteria Landslide Susceptibility"):
+            multi_criteria_overlay(dem, elevation_index, 'landslide', 'YlOrRd',
+                                   "Multi-Criteria Landslide Susceptibility")
+
+
+def water_sources():
+    # Seed options for the connected inundation model
+    sources = st.multiselect(
+        "Water Sources", ["Raster Edges", "Streams", "Seed Points"], default=["Raster Edges"])
+    stream_area = None
+    if "Streams" in sources:
+        stream_area = st.number_input(
+            "Stream Contributing Area (km²)", min_value=0.01, value=1.0) * 1e6
+    points = []
+    if "Seed Points" in sources:
+        points_text = st.text_area("Seed Points (one 'column, row' pair per line)")
+        try:
+            points = [(int(float(row)), int(float(col)))
+                      for col, row in (line.split(',') for line in points_text.splitlines()
+                                       if line.strip())]
+        except ValueError:
+            st.error("Error: Seed points must be 'column, row' pairs.")
+    return dict(points=points, edges="Raster Edges" in sources, stream_area=stream_area)
+
+
+def plot_inundation(dem, water_level, min_elevation, max_elevation):
+    # Priority-flood from the water sources: spill levels are computed once
+    # per source set, then any water level is a comparison
+    spill = dem_spill_levels(dem, **water_sources())
+    dx, dy = cell_size(dem.transform, dem.crs, dem.array.shape)
+    flooded, depth, volume = inundation(dem.array, spill, water_level, dx * dy)
+
+    factor = decimation_factor(flooded.shape)
+    coverage = block_mean(np.where(np.isfinite(spill), flooded, np.nan), factor)
+    plot_flood_susceptibility(coverage, water_level)
+    st.write(f"Inundated area: {flooded.sum() * dx * dy / 1e4:,.2f} ha, "
+             f"volume: {volume:,.0f} m³")
+
+    max_depth = max(float(water_level - min_elevation), 1.0)
+    st.image(render_raster(depth, 'Blues', 0, max_depth),
+             caption='Water Depth', use_column_width=True)
+    st.image(render_legend('Blues', 0, max_depth, 'Depth (meters)'))
+
+    # Area and volume for a sweep of water levels, from one sorted pass
+    levels = np.linspace(min_elevation, max_elevation, 50)
+    areas, volumes = inundation_sweep(dem.array, spill, levels, dx * dy)
+    fig_sweep = go.Figure()
+    fig_sweep.add_trace(go.Scatter(x=levels, y=areas / 1e4, name='Area (ha)'))
+    fig_sweep.add_trace(go.Scatter(x=levels, y=volumes, name='Volume (m³)', yaxis='y2'))
+    fig_sweep.update_layout(
+        title_text="Inundation by Water Level", xaxis_title="Water Level (meters)",
+        yaxis=dict(title="Area (ha)"),
+        yaxis2=dict(title="Volume (m³)", overlaying='y', side='right'))
+    st.plotly_chart(fig_sweep, use_container_width=True)
+
+
+def show_threshold_stats(label, index, threshold, above=False):
+    stats = threshold_stats(index, threshold, above)
+    st.write(f"{label}: {stats['hectares']:,.2f} ha ({stats['percent']:.1f}% of the DEM)")
 
 
 def normalize_to_255(data):
-    # Normalize data to [0, 255]
-    min_val, max_val = np.min(data), np.max(data)
-    normalized_data = 255 * (data - min_val) / (max_val - min_val)
-    return normalized_data.astype(np.uint8)
+    # Normalize data to [0, 255]; nodata (NaN) cells map to 0
+    min_val, max_val = np.nanmin(data), np.nanmax(data)
+    normalized_data = 255 * (data - min_val) / max(max_val - min_val, 1e-9)
+    return np.nan_to_num(normalized_data).astype(np.uint8)
 
 
 def plot_2d_terrain(data):
@@ -68,12 +167,9 @@ def plot_2d_terrain(data):
     st.plotly_chart(fig_2d, use_container_width=True)
 
 
-def plot_flood_susceptibility(data, threshold):
-    # Create a Flood Susceptibility plot using Plotly
-    flood_susceptibility = np.zeros_like(data)
-    # Set areas below the threshold to 1
-    flood_susceptibility[data <= threshold] = 1
-
+def plot_flood_susceptibility(flood_susceptibility, threshold):
+    # Create a Flood Susceptibility plot using Plotly. The input is the
+    # share of cells at or below the threshold in each displayed block.
     fig_flood = go.Figure(go.Surface(
         z=flood_susceptibility, colorscale='Blues'))
 
@@ -91,16 +187,9 @@ def plot_flood_susceptibility(data, threshold):
     st.plotly_chart(fig_flood, use_container_width=True)
 
 
-def plot_landslide_susceptibility(data, threshold):
-    # Calculate slope using central difference method
-    slope_x, slope_y = np.gradient(data)
-    slope = np.sqrt(slope_x**2 + slope_y**2)
-
-    # Create a Landslide Susceptibility plot using Plotly
-    landslide_susceptibility = np.zeros_like(data)
-    # Set areas with slope greater than the threshold to 1
-    landslide_susceptibility[slope >= threshold] = 1
-
+def plot_landslide_susceptibility(landslide_susceptibility, threshold):
+    # Create a Landslide Susceptibility plot using Plotly. The input is the
+    # share of cells with a slope at or above the threshold in each block.
     fig_landslide = go.Figure(go.Surface(
         z=landslide_susceptibility, colorscale='Reds'))
 
@@ -1,75 +1,127 @@
 import streamlit as st
-import cv2
 import numpy as np
-from sklearn.cluster import KMeans
-import matplotlib.pyplot as plt
-from io import BytesIO
-from PIL import Image  # Import the Image class from Pillow
+import pandas as pd
+from matplotlib import colormaps
+from geo_utils.classify import classify_bands
+from geo_utils.enhance import display_preview
+from geo_utils.indices import NODATA_CLASS, class_counts
+from geo_utils.raster_io import band_count, file_digest, geotiff_bytes, load_dem, load_photo
+from geo_utils.render import colorize_classes, display_sample, render_class_legend, render_classes
+from geo_utils.terrain import cell_size
 
 
-def classify_image_colors(uploaded_file, num_colors):
-    # Read the image from BytesIO
-    img = Image.open(uploaded_file).convert('RGB')
-    # Normalize pixel values to [0.0, 1.0]
-    original_image = np.array(img) / 255.0
+def load_photo_bands(uploaded_file):
+    # Red, green and blue bands of a JPEG / PNG photo as uint8 views of
+    # the decoded image, which is cached per file content
+    img = load_photo(uploaded_file)
+    return img, [img[..., channel] for channel in range(3)]
 
-    # Reshape the image to a 2D array of pixels
-    pixels = original_image.reshape((-1, 3))
 
-    # Apply k-means clustering
-    kmeans = KMeans(n_clusters=num_colors)
-    kmeans.fit(pixels)
-    dominant_colors = kmeans.cluster_centers_
-
-    # Assign each pixel to its nearest dominant color
-    labels = kmeans.predict(pixels)
-    classified_image = dominant_colors[labels].reshape(original_image.shape)
-
-    return original_image, classified_image, dominant_colors.astype(int)
-
-
-def display_color_classification(original_image, classified_image, dominant_colors):
+def display_color_classification(key, original_image, labels, dominant_colors):
     # Display the original image
-    st.image(original_image, caption='Original Image', use_column_width=True)
+    st.image(display_preview(key, original_image), caption='Original Image',
+             use_column_width=True)
 
-    # Display the classified image
-    st.image(classified_image, caption='Classified Image',
-             use_column_width=True, clamp=True)
+    # Display the classified image, every class painted its dominant color;
+    # only the display-sized sample of the labels is coloured
+    colors = [tuple(color / 255.0) for color in dominant_colors]
+    st.image(colorize_classes(display_sample(labels), colors),
+             caption='Classified Image', use_column_width=True)
 
     # Display the dominant colors as color patches
     color_patches = np.zeros(
         (100, len(dominant_colors) * 100, 3), dtype=np.uint8)
     for i, color in enumerate(dominant_colors):
-        # Normalize to [0.0, 1.0]
-        color_patches[:, i * 100:(i + 1) * 100, :] = color / 255.0
+        color_patches[:, i * 100:(i + 1) * 100, :] = color
 
     st.image(color_patches, caption='Dominant Colors',
              use_column_width=True, clamp=True)
 
+
+def display_band_classification(labels, centres, band_numbers, pixel_area):
+    # Clusters of spectral bands drawn with a qualitative palette, with
+    # their mean band values and areas
+    palette = colormaps['tab10'].colors
+    colors = [palette[i % len(palette)] for i in range(len(centres))]
+    names = [f"Class {i + 1}" for i in range(len(centres))]
+    st.image(render_classes(labels, colors), caption='Classified Image',
+             use_column_width=True)
+    st.image(render_class_legend(names, colors))
+
+    counts = class_counts(labels, len(centres))
+    table = pd.DataFrame(centres, columns=[f"Band {band}" for band in band_numbers])
+    table.insert(0, "Class", names)
+    table["Pixels"] = counts
+    table["Area (ha)"] = np.round(counts * pixel_area / 1e4, 4)
+    st.table(table)
+
 # Streamlit app
 
 
 def main():
     st.title('Image Color Classification App')
 
-    # File uploader for image
+    # File uploader for image or multi-band GeoTIFF
     uploaded_file = st.file_uploader(
-        "Choose an image file", type=["jpg", "jpeg", "png"])
+        "Choose an image file or multi-band GeoTIFF", type=["jpg", "jpeg", "png", "tif", "tiff"])
 
     # Slider for selecting the number of dominant colors
     num_colors = st.slider(
         'Select the number of dominant colors', min_value=1, max_value=10, value=5)
 
-    # Button to trigger color classification
-    if st.button('Classify Image Colors'):
-        if uploaded_file is not None:
-            # Classify image colors
-            original_image, classified_image, dominant_colors = classify_image_colors(
-                uploaded_file, num_colors)
-
-            # Display the results
+    if uploaded_file is None:
+        return
+
+    key = file_digest(uploaded_file)
+    is_geotiff = uploaded_file.name.lower().endswith(('.tif', '.tiff'))
+    if is_geotiff:
+        # Cluster any combination of spectral bands
+        all_bands = list(range(1, band_count(uploaded_file) + 1))
+        band_numbers = st.multiselect('Bands to cluster', all_bands, default=all_bands)
+        if not band_numbers:
+            st.info("Select at least one band.")
+            return
+
+    # Button to trigger color classification; results are cached per image
+    # and number of classes, so the page keeps them across reruns
+    if st.button('Classify Image Colors') or st.session_state.get('classified') == (key, num_colors):
+        st.session_state['classified'] = (key, num_colors)
+
+        if not is_geotiff:
+            original_image, bands = load_photo_bands(uploaded_file)
+            # Photos are labelled through the quantized colour lookup, which
+            # may differ from exact prediction for about 1% of pixels
+            try:
+                dominant_colors, labels = classify_bands(key, bands, num_colors, quantize=True)
+            except ValueError as error:
+                st.error(f"Error: {error}")
+                return
             display_color_classification(
-                original_image, classified_image, dominant_colors)
+                key, original_image, labels, np.clip(np.rint(dominant_colors), 0, 255).astype(np.uint8))
+            return
+
+        dems = [load_dem(uploaded_file, band=band) for band in band_numbers]
+        bands = [dem.array for dem in dems]
+        try:
+            centres, labels = classify_bands(
+                (key, tuple(band_numbers)), bands, num_colors, dems[0].nodata)
+        except ValueError as error:
+            st.error(f"Error: {error}")
+            return
+        dx, dy = cell_size(dems[0].transform, dems[0].crs, labels.shape)
+        pixel_area = dx * dy
+        display_band_classification(labels, centres, band_numbers, pixel_area)
+
+        # Class raster with the georeferencing of the scene, encoded only
+        # when an export is requested
+        if st.button("Prepare GeoTIFF Export"):
+            st.download_button(
+                label="Download Classes as GeoTIFF",
+                data=geotiff_bytes([labels], dems[0].transform, dems[0].crs,
+                                   nodata=NODATA_CLASS),
+                file_name="classes.tif",
+                mime="image/tiff"
+            )
 
 
 if __name__ == "__main__":
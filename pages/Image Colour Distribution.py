@@ -2,32 +2,35 @@ import streamlit as st
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
+from geo_utils.enhance import display_preview
+from geo_utils.raster_io import file_digest
+from geo_utils.stats import cached_channel_histograms
 
 
-def plot_color_distribution(image):
-    # Convert BGR to RGB (OpenCV reads images in BGR format)
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+def plot_color_distribution(key, image):
+    # Counts of the RGB channels and of luminance, from one cached pass
+    # over the full image (OpenCV decodes images in BGR order)
+    histograms = cached_channel_histograms(key, image, 'bgr')
+    values = np.arange(len(histograms['luminance']))
 
-    # Convert image to grayscale
-    image_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # Reshape the image to a 2D array of pixels (height * width, 3)
-    pixels_rgb = image_rgb.reshape((-1, 3))
-    pixels_gray = image_gray.reshape(-1)
+    # Only a display-sized copy is converted for the image panels
+    preview = display_preview(key, image)
+    preview_rgb = np.ascontiguousarray(preview[..., ::-1])
+    preview_gray = cv2.cvtColor(preview, cv2.COLOR_BGR2GRAY)
 
     # Plot the color distribution for Red, Green, Blue, and Grayscale channels
-    plt.figure(figsize=(15, 7))
+    fig = plt.figure(figsize=(15, 7))
 
     # Original Image
     plt.subplot(2, 3, 1)
-    plt.imshow(image_rgb)
+    plt.imshow(preview_rgb)
     plt.title('Original Image')
     plt.axis('off')
 
     # RGB Color Distribution
     plt.subplot(2, 3, 2)
-    for i, color in enumerate(['Red', 'Green', 'Blue']):
-        plt.plot(range(256), np.histogram(pixels_rgb[:, i], bins=256, range=(0, 256))[0],
+    for color in ['Red', 'Green', 'Blue']:
+        plt.plot(values, histograms[color.lower()],
                  label=f'{color} Channel', alpha=0.7, color=color.lower())
     plt.xlabel('Pixel Intensity (0 to 255)')
     plt.ylabel('Frequency')
@@ -36,13 +39,13 @@ def plot_color_distribution(image):
 
     # Grayscale Image
     plt.subplot(2, 3, 4)
-    plt.imshow(image_gray, cmap='gray')
+    plt.imshow(preview_gray, cmap='gray')
     plt.title('Grayscale Image')
     plt.axis('off')
 
     # Grayscale Color Distribution
     plt.subplot(2, 3, 5)
-    plt.plot(range(256), np.histogram(pixels_gray, bins=256, range=(0, 256))[0],
+    plt.plot(values, histograms['luminance'],
              label='Grayscale', alpha=0.7, color='gray')
     plt.xlabel('Pixel Intensity (0 to 255)')
     plt.ylabel('Frequency')
@@ -50,11 +53,11 @@ def plot_color_distribution(image):
     plt.legend()
 
     plt.tight_layout()
-    st.pyplot()
+    st.pyplot(fig)
 
 
-def display_image(image):
-    st.image(cv2.cvtColor(image, cv2.COLOR_BGR2RGB),
+def display_image(key, image):
+    st.image(np.ascontiguousarray(display_preview(key, image)[..., ::-1]),
              caption='Uploaded Image', use_column_width=True)
 
 # Streamlit app
@@ -71,14 +74,15 @@ def main():
     if st.button('Show Color Distribution and Grayscale Image'):
         if uploaded_file is not None:
             # Read the image
-            image = cv2.imdecode(np.fromstring(
-                uploaded_file.read(), np.uint8), 1)
+            key = file_digest(uploaded_file)
+            image = cv2.imdecode(np.frombuffer(
+                uploaded_file.getvalue(), np.uint8), 1)
 
             # Display the original image
-            display_image(image)
+            display_image(key, image)
 
             # Plot color distribution and grayscale image
-            plot_color_distribution(image)
+            plot_color_distribution(key, image)
 
 
 if __name__ == "__main__":
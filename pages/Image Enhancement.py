@@ -4,17 +4,23 @@ import tifffile
 from PIL import Image, ImageEnhance, ImageOps
 import io
 import matplotlib.pyplot as plt
-
-
-def plot_histogram(image, title):
-    # Flatten the image array and plot the histogram
-    plt.hist(image.flatten(), bins=256, range=[
-             0, 256], density=True, color='gray', alpha=0.7)
+from geo_utils.raster_io import file_digest, load_image
+from geo_utils.stats import (cached_channel_histograms, cached_histogram, channel_histograms,
+                             stretch_band)
+
+
+def plot_histogram(histograms, title):
+    # Plot the grayscale (luminance) counts of channel_histograms as a
+    # density over the 256 pixel values
+    counts = histograms['luminance']
+    fig = plt.figure()
+    plt.stairs(counts / max(counts.sum(), 1), np.arange(len(counts) + 1),
+               fill=True, color='gray', alpha=0.7)
     plt.title(f'Grayscale Distribution Curve - {title}')
     plt.xlabel('Pixel Value')
     plt.ylabel('Frequency')
     plt.grid(axis='y', linestyle='--', alpha=0.7)
-    st.pyplot()
+    st.pyplot(fig)
 
 
 def main():
@@ -26,14 +32,12 @@ def main():
 
     if tif_file:
         # Load TIFF image
-        tif_image = tifffile.imread(tif_file)
+        tif_image = load_image(tif_file)
 
-        # Normalize pixel values to [0, 255] range
-        normalized_image = (tif_image - tif_image.min()) / \
-            (tif_image.max() - tif_image.min()) * 255
-
-        # Convert to uint8 for display
-        uint8_image = normalized_image.astype(np.uint8)
+        # Normalize pixel values to [0, 255] range and convert to uint8 for
+        # display, with the min/max of the image's cached histogram
+        histogram = cached_histogram(file_digest(tif_file), tif_image)
+        uint8_image = stretch_band(tif_image, histogram.minimum, histogram.maximum)
 
         # Display the original image
         st.image(uint8_image, caption="Original TIFF Image",
@@ -89,10 +93,11 @@ def main():
         # Grayscale distribution curve buttons
         st.subheader("Grayscale Distribution Curves:")
         if st.button("Show Original Image Distribution Curve"):
-            plot_histogram(uint8_image, "Original")
+            plot_histogram(cached_channel_histograms(
+                (file_digest(tif_file), 'display'), uint8_image), "Original")
         if st.button("Show Enhanced Image Distribution Curve"):
             enhanced_image_uint8 = np.asarray(enhanced_image)
-            plot_histogram(enhanced_image_uint8,
+            plot_histogram(channel_histograms(enhanced_image_uint8),
                            f"{enhancement_method} Enhanced")
 
 
@@ -109,14 +114,12 @@ def main():
 
     if tif_file:
         # Load TIFF image
-        tif_image = tifffile.imread(tif_file)
-
-        # Normalize pixel values to [0, 255] range
-        normalized_image = (tif_image - tif_image.min()) / \
-            (tif_image.max() - tif_image.min()) * 255
+        tif_image = load_image(tif_file)
 
-        # Convert to uint8 for display
-        uint8_image = normalized_image.astype(np.uint8)
+        # Normalize pixel values to [0, 255] range and convert to uint8 for
+        # display, with the min/max of the image's cached histogram
+        histogram = cached_histogram(file_digest(tif_file), tif_image)
+        uint8_image = stretch_band(tif_image, histogram.minimum, histogram.maximum)
 
         # Display the original image
         st.image(uint8_image, caption="Original TIFF Image",
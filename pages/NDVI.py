@@ -1,56 +1,31 @@
 import streamlit as st
-import numpy as np
-import tifffile
-import io
-import matplotlib.pyplot as plt
-
-
-def normalize_band(band):
-    # Normalize the band to [0, 1]
-    return (band - band.min()) / (band.max() - band.min())
-
-
-def calculate_ndvi(red_band, nir_band):
-    # Normalize Red and NIR bands
-    red_band_norm = normalize_band(red_band)
-    nir_band_norm = normalize_band(nir_band)
-
-    # Ensure that the denominator is not zero
-    denominator = np.where((nir_band_norm + red_band_norm)
-                           == 0, 1, (nir_band_norm + red_band_norm))
-
-    # Calculate NDVI
-    ndvi = (nir_band_norm - red_band_norm) / denominator
-    return ndvi
-
-
-def classify_ndvi(ndvi):
-    # Thresholds for water, vegetation, and soil classification
-    water_threshold = 0.0
-    vegetation_threshold = 0.2
-    soil_threshold = 0.5
-
-    # Classify based on NDVI values
-    water_mask = ndvi < water_threshold
-    vegetation_mask = (ndvi >= water_threshold) & (ndvi < vegetation_threshold)
-    soil_mask = ndvi >= vegetation_threshold
-
-    return water_mask, vegetation_mask, soil_mask
-
-
-def plot_classified_image(image, mask, title, cmap="viridis", color="cool"):
-    # Adjust vmin and vmax based on your data
-    plt.imshow(image, cmap=cmap, vmin=-1, vmax=1)
-    plt.imshow(np.ma.masked_where(~mask, mask), cmap=color,
-               alpha=0.5)  # Adjust cmap as needed
-    plt.colorbar(label="NDVI")
-    plt.title(title)
-    plt.axis('off')
-    st.pyplot()
-
-
-def main():
-    st.title("NDVI Classification and Visualization")
+from geo_utils.bandmath import band_math
+from geo_utils.indices import NODATA_CLASS, NDVI_THRESHOLDS, cached_ndvi, classify_index
+from geo_utils.raster_io import band_count, file_digest, geotiff_bytes, load_dem, load_image
+from geo_utils.render import render_legend, render_raster, value_range
+from geo_utils.stats import cached_histogram
+from geo_utils.ui import plot_ndvi_classes
+
+
+def load_ndvi_bands():
+    # Red and NIR bands from one multi-band GeoTIFF (only the two picked
+    # bands are read) or from two single-band files. The red band's
+    # georeferencing is returned for exports (None for plain TIFFs),
+    # together with keys identifying the two bands and their nodata values.
+    input_mode = st.radio(
+        "Input", ["One Multi-band GeoTIFF", "Separate Band Files"])
+
+    if input_mode == "One Multi-band GeoTIFF":
+        stack_file = st.file_uploader(
+            "Upload Multi-band GeoTIFF (e.g. Sentinel-2 / Landsat stack)", type=["tif", "tiff"])
+        if not stack_file:
+            return None, None, None, None, None
+        band_numbers = range(1, band_count(stack_file) + 1)
+        red_band = st.selectbox("Red Band", band_numbers, index=min(3, len(band_numbers)) - 1)
+        nir_band = st.selectbox("NIR Band", band_numbers, index=min(4, len(band_numbers)) - 1)
+        red = load_dem(stack_file, band=red_band)
+        nir = load_dem(stack_file, band=nir_band)
+        return red.array, nir.array, red, (red.key, nir.key), (red.nodata, nir.nodata)
 
     # File upload section for Red band image
     red_band_file = st.file_uploader(
@@ -59,32 +34,74 @@ def main():
     # File upload section for NIR band image
     nir_band_file = st.file_uploader(
         "Upload NIR Grayscale TIFF Image", type=["tif", "tiff"])
+    if not (red_band_file and nir_band_file):
+        return None, None, None, None, None
+
+    # Load TIFF images
+    return (load_image(red_band_file), load_image(nir_band_file), None,
+            (file_digest(red_band_file), file_digest(nir_band_file)), (None, None))
+
+
+def main():
+    st.title("NDVI Classification and Visualization")
 
-    if red_band_file and nir_band_file:
-        # Load TIFF images
-        red_band_image = tifffile.imread(red_band_file)
-        nir_band_image = tifffile.imread(nir_band_file)
+    red_band_image, nir_band_image, georeference, band_keys, nodata = load_ndvi_bands()
 
-        # Calculate NDVI
-        ndvi = calculate_ndvi(red_band_image, nir_band_image)
+    if red_band_image is not None:
+        # Calculate NDVI once per pair of bands, normalising each band with
+        # the min/max of its cached histogram; nodata cells are left out of
+        # both and come out as NaN
+        histograms = [cached_histogram(key, band, band_nodata) for key, band, band_nodata
+                      in zip(band_keys, (red_band_image, nir_band_image), nodata)]
+        ndvi = cached_ndvi(band_keys, red_band_image, nir_band_image,
+                           [(histogram.minimum, histogram.maximum) for histogram in histograms],
+                           nodata)
 
         # Display the normal NDVI plot
-        plt.imshow(ndvi, cmap="viridis", vmin=-1, vmax=1)
-        plt.colorbar(label="NDVI")
-        plt.title("Normal NDVI")
-        plt.axis('off')
-        st.pyplot()
-
-        # Classify NDVI into water, vegetation, and soil
-        water_mask, vegetation_mask, soil_mask = classify_ndvi(ndvi)
-
-        # Plot and display classified images
-        plot_classified_image(
-            ndvi, water_mask, "Water Bodies", cmap="viridis", color="Blues")
-        plot_classified_image(ndvi, vegetation_mask,
-                              "Vegetation", cmap="viridis", color="Greens")
-        plot_classified_image(ndvi, soil_mask, "Soil",
-                              cmap="viridis", color="Oranges")
+        st.image(render_raster(ndvi, "viridis", -1, 1),
+                 caption="Normal NDVI", use_column_width=True)
+        st.image(render_legend("viridis", -1, 1, "NDVI"))
+
+        # Classify NDVI into water, vegetation, and soil with adjustable
+        # class boundaries
+        thresholds = st.slider(
+            "NDVI Class Thresholds (water | vegetation | soil)", min_value=-1.0,
+            max_value=1.0, value=NDVI_THRESHOLDS, step=0.05)
+        pixel_size = st.sidebar.number_input(
+            "Pixel Size (meters)", min_value=0.0, value=1.0)
+        plot_ndvi_classes(ndvi, thresholds, ['#2171b5', '#238b45', '#d94801'], pixel_size)
+
+        # Export NDVI and its classes with the georeferencing of the scene,
+        # encoded only when an export is requested
+        if georeference is not None and st.button("Prepare GeoTIFF Exports"):
+            st.download_button(
+                label="Download NDVI as GeoTIFF",
+                data=geotiff_bytes([ndvi], georeference.transform, georeference.crs),
+                file_name="ndvi.tif",
+                mime="image/tiff"
+            )
+            st.download_button(
+                label="Download NDVI Classes as GeoTIFF",
+                data=geotiff_bytes([classify_index(ndvi, thresholds)], georeference.transform,
+                                   georeference.crs, nodata=NODATA_CLASS),
+                file_name="ndvi_classes.tif",
+                mime="image/tiff"
+            )
+
+        # Any other index of the two bands, evaluated block by block
+        st.subheader("Band Math")
+        expression = st.text_input(
+            "Expression over 'red' and 'nir'", "(nir - red) / (nir + red)")
+        try:
+            result = band_math(expression, {'red': red_band_image, 'nir': nir_band_image},
+                               nodata=dict(zip(('red', 'nir'), nodata)))
+        except ValueError as error:
+            st.error(f"Error: {error}")
+        else:
+            result_min, result_max = value_range(result)
+            st.image(render_raster(result, "viridis", result_min, result_max),
+                     caption=expression, use_column_width=True)
+            st.image(render_legend("viridis", result_min, result_max, expression))
 
 
 if __name__ == '__main__':
@@ -1,53 +1,8 @@
 import streamlit as st
-import numpy as np
-import tifffile
-import io
-import matplotlib.pyplot as plt
-from matplotlib.colors import ListedColormap
-
-
-def normalize_band(band):
-    # Normalize the band to [0, 1]
-    return (band - band.min()) / (band.max() - band.min())
-
-
-def calculate_ndvi(red_band, nir_band):
-    # Normalize Red and NIR bands
-    red_band_norm = normalize_band(red_band)
-    nir_band_norm = normalize_band(nir_band)
-
-    # Ensure that the denominator is not zero
-    denominator = np.where((nir_band_norm + red_band_norm)
-                           == 0, 1, (nir_band_norm + red_band_norm))
-
-    # Calculate NDVI
-    ndvi = (nir_band_norm - red_band_norm) / denominator
-    return ndvi
-
-
-def classify_ndvi(ndvi):
-    # Thresholds for water, vegetation, and soil classification
-    water_threshold = 0.0
-    vegetation_threshold = 0.2
-    soil_threshold = 0.5
-
-    # Classify based on NDVI values
-    water_mask = ndvi < water_threshold
-    vegetation_mask = (ndvi >= water_threshold) & (ndvi < vegetation_threshold)
-    soil_mask = ndvi >= vegetation_threshold
-
-    return water_mask, vegetation_mask, soil_mask
-
-
-def plot_classified_image(image, mask, title, cmap):
-    # Adjust vmin and vmax based on your data
-    plt.imshow(image, cmap="viridis", vmin=-1, vmax=1)
-    plt.imshow(np.ma.masked_where(~mask, mask), cmap=cmap,
-               alpha=0.5)  # Adjust cmap as needed
-    plt.colorbar(label="NDVI")
-    plt.title(title)
-    plt.axis('off')
-    st.pyplot()
+from geo_utils.indices import NDVI_THRESHOLDS, cached_ndvi
+from geo_utils.raster_io import file_digest, load_image
+from geo_utils.render import render_legend, render_raster
+from geo_utils.ui import plot_ndvi_classes
 
 
 def main():
@@ -63,32 +18,26 @@ def main():
 
     if red_band_file and nir_band_file:
         # Load TIFF images
-        red_band_image = tifffile.imread(red_band_file)
-        nir_band_image = tifffile.imread(nir_band_file)
+        red_band_image = load_image(red_band_file)
+        nir_band_image = load_image(nir_band_file)
 
-        # Calculate NDVI
-        ndvi = calculate_ndvi(red_band_image, nir_band_image)
+        # Calculate NDVI (once per pair of images)
+        ndvi = cached_ndvi((file_digest(red_band_file), file_digest(nir_band_file)),
+                           red_band_image, nir_band_image)
 
         # Display the normal NDVI plot
-        plt.imshow(ndvi, cmap="viridis", vmin=-1, vmax=1)
-        plt.colorbar(label="NDVI")
-        plt.title("Normal NDVI Plot")
-        plt.axis('off')
-        st.pyplot()
-
-        # Classify NDVI into water, vegetation, and soil
-        water_mask, vegetation_mask, soil_mask = classify_ndvi(ndvi)
-
-        # Create custom colormaps for water, vegetation, and soil
-        water_cmap = ListedColormap(['blue'])
-        vegetation_cmap = ListedColormap(['green'])
-        soil_cmap = ListedColormap(['brown'])
-
-        # Plot and display classified images with eye-catching colors
-        plot_classified_image(ndvi, water_mask, "Water Bodies", water_cmap)
-        plot_classified_image(ndvi, vegetation_mask,
-                              "Vegetation", vegetation_cmap)
-        plot_classified_image(ndvi, soil_mask, "Soil", soil_cmap)
+        st.image(render_raster(ndvi, "viridis", -1, 1),
+                 caption="Normal NDVI Plot", use_column_width=True)
+        st.image(render_legend("viridis", -1, 1, "NDVI"))
+
+        # Classify NDVI into water, vegetation, and soil with adjustable
+        # class boundaries
+        thresholds = st.slider(
+            "NDVI Class Thresholds (water | vegetation | soil)", min_value=-1.0,
+            max_value=1.0, value=NDVI_THRESHOLDS, step=0.05)
+        pixel_size = st.sidebar.number_input(
+            "Pixel Size (meters)", min_value=0.0, value=1.0)
+        plot_ndvi_classes(ndvi, thresholds, ['blue', 'green', 'brown'], pixel_size)
 
 
 if __name__ == '__main__':
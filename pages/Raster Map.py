@@ -0,0 +1,89 @@
+import streamlit as st
+import math
+import numpy as np
+import folium
+from streamlit_folium import folium_static
+from geo_utils.raster_io import load_dem
+from geo_utils.terrain import dem_terrain
+from geo_utils.threshold import dem_sorted_index, value_bounds
+from geo_utils.tiles import layer_bounds, register_layer, tile_url
+
+
+def terrain_layer(dem, layer_name):
+    # Register the selected layer with the tile server and return its id
+    if layer_name == "Colour Relief":
+        return register_layer(dem, product='elevation', cmap='terrain')
+    if layer_name == "Slope":
+        slope = dem_terrain(dem, products=('slope',))['slope']
+        return register_layer(dem, slope, product='slope', cmap='viridis', vmin=0, vmax=90)
+    if layer_name == "Hillshade":
+        hillshade = dem_terrain(dem, products=('hillshade',))['hillshade']
+        return register_layer(dem, hillshade, product='hillshade', cmap='gray', vmin=0, vmax=1)
+
+    if layer_name == "Flood Susceptibility":
+        # Slider bounds from the valid cells only (the sorted index is
+        # shared with the Flood and Landslide page)
+        bounds = value_bounds(dem_sorted_index(dem))
+        if bounds is None:
+            st.error("Error: The DEM has no valid elevation cells.")
+            return None
+        min_elevation, max_elevation = math.floor(bounds[0]), math.ceil(bounds[1])
+        threshold = st.slider(
+            "Flood Threshold Elevation", min_value=min_elevation, max_value=max_elevation,
+            value=min_elevation, step=1)
+        mask = dem.array <= threshold
+        if dem.nodata is not None:
+            mask &= dem.array != dem.nodata
+        product, cmap = f'flood<={threshold}', 'Blues'
+    else:
+        threshold = st.slider(
+            "Landslide Threshold Slope", min_value=0.1, max_value=45.0, value=10.0, step=0.1)
+        mask = dem_terrain(dem, products=('slope',))['slope'] >= threshold
+        product, cmap = f'landslide>={threshold}', 'Reds'
+
+    # Cells outside the mask are NaN, which the tiles leave transparent. The
+    # mask belongs to the tile registry alone, which bounds its memory.
+    susceptible = np.where(mask, np.float32(1), np.float32(np.nan))
+    return register_layer(dem, susceptible, product=product, cmap=cmap,
+                          vmin=0, vmax=1, categorical=True, owned=True)
+
+
+def main():
+    st.title("Raster Layers on World Map")
+
+    uploaded_file = st.file_uploader(
+        "Upload a GeoTIFF DEM file", type=["tif", "tiff"])
+
+    if uploaded_file is not None:
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+        if dem.crs is None:
+            st.error("Error: The GeoTIFF has no coordinate reference system.")
+            return
+
+        layer_name = st.selectbox(
+            "Layer", ["Colour Relief", "Slope", "Hillshade",
+                      "Flood Susceptibility", "Landslide Susceptibility"])
+        opacity = st.sidebar.slider(
+            "Layer Opacity", min_value=0.0, max_value=1.0, value=0.7)
+
+        # Tiles are rendered on demand by the local tile server, reprojected
+        # to Web Mercator and cached on disk, so only visible tiles are built
+        layer_id = terrain_layer(dem, layer_name)
+        if layer_id is None:
+            return
+
+        m = folium.Map()
+        folium.TileLayer(
+            tiles=tile_url(layer_id), attr="Geo App", name=layer_name,
+            overlay=True, opacity=opacity, max_zoom=20).add_to(m)
+        folium.LayerControl().add_to(m)
+        bounds = layer_bounds(layer_id)
+        if bounds is not None:
+            m.fit_bounds(bounds)
+
+        folium_static(m)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,16 @@
 import streamlit as st
 from PIL import Image
-from io import BytesIO
-import rasterio
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import LightSource
+from geo_utils.raster_io import load_dem
+from geo_utils.render import render_legend, render_raster, value_range
+from geo_utils.terrain import dem_terrain
 
 
-def read_dem(dem_path):
-    with rasterio.open(dem_path) as dataset:
-        elevation = dataset.read(1)
-        return elevation, dataset.transform
-
-
-def calculate_slope_and_aspect(elevation):
-    gradient_x, gradient_y = np.gradient(elevation)
-    slope = np.arctan(np.sqrt(gradient_x**2 + gradient_y**2))
-    aspect = np.arctan2(-gradient_y, gradient_x)
-    aspect[aspect < 0] += 2.0 * np.pi
-    return np.degrees(slope), np.degrees(aspect)
-
-
-def calculate_curvature(elevation):
-    gradient_x, gradient_y = np.gradient(elevation)
-    gradient_xx, gradient_xy = np.gradient(gradient_x)
-    gradient_yx, gradient_yy = np.gradient(gradient_y)
-    curvature = (gradient_xx * gradient_yy - gradient_xy * gradient_yx) / \
-        (1 + gradient_x**2 + gradient_y**2)**(3/2)
-    return curvature
+def plot_raster(array, cmap, vmin, vmax, title, label=None, nodata=None):
+    # LUT-coloured PNG plus a separately rendered legend
+    st.image(render_raster(array, cmap, vmin, vmax, nodata),
+             caption=title, use_column_width=True)
+    if label:
+        st.image(render_legend(cmap, vmin, vmax, label))
 
 
 def main():
@@ -37,21 +20,21 @@ def main():
         "Upload a TIF image", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
-
-        # Open the image using BytesIO
-        dem_array, transform = read_dem(BytesIO(file_contents))
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+        dem_array, transform = dem.array, dem.transform
 
         # Display the normal DEM
         st.subheader("Digital Elevation Model (DEM)")
-        plt.imshow(dem_array, cmap='terrain')
-        plt.colorbar(label='Elevation (meters)')
-        plt.title('Digital Elevation Model (DEM)')
-        st.pyplot()
+        elevation_min, elevation_max = value_range(dem_array, dem.nodata)
+        plot_raster(dem_array, 'terrain', elevation_min, elevation_max,
+                    'Digital Elevation Model (DEM)', 'Elevation (meters)', dem.nodata)
 
-        # Compute and display the slope
-        slope, aspect = calculate_slope_and_aspect(dem_array)
+        # Compute slope, aspect and curvature in one pass using the real
+        # cell size from the transform (cached between reruns)
+        terrain = dem_terrain(dem, products=(
+            'slope', 'aspect', 'curvature', 'plan_curvature', 'profile_curvature'))
+        slope, aspect = terrain['slope'], terrain['aspect']
 
         # Toggle Slope visibility
         show_slope = st.checkbox("Show Slope", value=False)
@@ -59,10 +42,8 @@ def main():
             st.subheader("Slope Map")
             slope_min, slope_max = st.slider(
                 "Adjust Slope Range", min_value=0, max_value=90, value=(0, 90))
-            plt.imshow(np.clip(slope, slope_min, slope_max), cmap='viridis')
-            plt.colorbar(label='Slope (degrees)')
-            plt.title('Slope Map')
-            st.pyplot()
+            plot_raster(slope, 'viridis', slope_min, slope_max,
+                        'Slope Map', 'Slope (degrees)')
 
         # Toggle Aspect visibility
         show_aspect = st.checkbox("Show Aspect", value=False)
@@ -70,25 +51,20 @@ def main():
             st.subheader("Aspect Map")
             aspect_min, aspect_max = st.slider(
                 "Adjust Aspect Range", min_value=0, max_value=360, value=(0, 360))
-            plt.imshow(np.clip(aspect, aspect_min, aspect_max), cmap='hsv')
-            plt.colorbar(label='Aspect (degrees)')
-            plt.title('Aspect Map')
-            st.pyplot()
-
-        # Compute and display the curvature
-        curvature = calculate_curvature(dem_array)
+            plot_raster(aspect, 'hsv', aspect_min, aspect_max,
+                        'Aspect Map', 'Aspect (degrees)')
 
         # Toggle Curvature visibility
         show_curvature = st.checkbox("Show Curvature", value=False)
         if show_curvature:
             st.subheader("Curvature Map")
+            curvature_type = st.selectbox(
+                "Curvature Type", ["Curvature", "Plan Curvature", "Profile Curvature"])
+            curvature = terrain[curvature_type.lower().replace(' ', '_')]
             curvature_min, curvature_max = st.slider(
-                "Adjust Curvature Range", min_value=-0.1, max_value=0.1, value=(-0.1, 0.1), step=0.01)
-            plt.imshow(np.clip(curvature, curvature_min,
-                       curvature_max), cmap='coolwarm')
-            plt.colorbar(label='Curvature')
-            plt.title('Curvature Map')
-            st.pyplot()
+                "Adjust Curvature Range", min_value=-5.0, max_value=5.0, value=(-1.0, 1.0), step=0.1)
+            plot_raster(curvature, 'coolwarm', curvature_min, curvature_max,
+                        'Curvature Map', f'{curvature_type} (1/100 m)')
 
         # Toggle Hillshade visibility
         show_hillshade = st.checkbox("Show Hillshade", value=False)
@@ -96,11 +72,9 @@ def main():
             st.subheader("Hillshade")
             hillshade_intensity = st.slider(
                 "Adjust Hillshade Intensity", min_value=0.1, max_value=10.0, value=1.0, step=0.1)
-            ls = LightSource(azdeg=315, altdeg=45)
-            hillshade = ls.hillshade(dem_array, vert_exag=hillshade_intensity)
-            plt.imshow(hillshade, cmap='gray', aspect='auto')
-            plt.title('Hillshade')
-            st.pyplot()
+            hillshade = dem_terrain(dem, products=('hillshade',), azimuth=315,
+                                    altitude=45, z_factor=hillshade_intensity)['hillshade']
+            plot_raster(hillshade, 'gray', 0.0, 1.0, 'Hillshade')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+import streamlit as st
+import numpy as np
+from geo_utils.indices import SPECTRAL_BANDS, SPECTRAL_INDICES, available_indices, spectral_indices
+from geo_utils.raster_io import band_count, geotiff_bytes, load_dem
+from geo_utils.render import render_legend, render_raster
+
+
+def main():
+    st.title("Spectral Indices")
+
+    uploaded_file = st.file_uploader(
+        "Upload a multi-band GeoTIFF", type=["tif", "tiff"])
+
+    if uploaded_file is not None:
+        # Declare once which band of the scene holds which wavelength
+        st.sidebar.subheader("Band Assignment")
+        band_options = ["Not available"] + [
+            f"Band {band}" for band in range(1, band_count(uploaded_file) + 1)]
+        bands = {}
+        for role in SPECTRAL_BANDS:
+            choice = st.sidebar.selectbox(role.upper(), band_options, key=f"band_{role}")
+            if choice != "Not available":
+                bands[role] = load_dem(uploaded_file, band=int(choice.split()[1]))
+
+        # Integer products store reflectance scaled (e.g. 0.0001 for Sentinel-2)
+        scale = st.sidebar.number_input(
+            "Reflectance Scale Factor", min_value=0.0, value=1.0, format="%.6f")
+
+        names = st.multiselect(
+            "Indices", available_indices(bands), default=available_indices(bands)[:1])
+        if not names:
+            st.info("Assign the bands an index needs, then pick one or more indices.")
+            return
+
+        # All selected indices are computed in one pass over the bands
+        layers = spectral_indices(names, bands, scale=scale or 1.0)
+
+        for name in names:
+            layer = layers[name]
+            vmin, vmax = SPECTRAL_INDICES[name][1]
+            st.subheader(name)
+            st.image(render_raster(layer, "RdYlGn", vmin, vmax),
+                     caption=f"{name}: {SPECTRAL_INDICES[name][0]}", use_column_width=True)
+            st.image(render_legend("RdYlGn", vmin, vmax, name))
+            st.write(f"Mean {name}: {np.nanmean(layer):.3f}")
+
+        # GeoTIFFs are only encoded when an export is requested
+        st.subheader("Export")
+        if st.button("Prepare GeoTIFF Exports"):
+            georeference = next(iter(bands.values()))
+            for name in names:
+                st.download_button(
+                    label=f"Download {name} as GeoTIFF",
+                    data=geotiff_bytes([layers[name]], georeference.transform,
+                                       georeference.crs, nodata=np.nan),
+                    file_name=f"{name.lower()}.tif",
+                    mime="image/tiff"
+                )
+
+
+if __name__ == '__main__':
+    main()
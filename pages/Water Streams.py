@@ -1,37 +1,22 @@
 import streamlit as st
 from PIL import Image
-from io import BytesIO
-import rasterio
 import numpy as np
-import matplotlib.pyplot as plt
+from geo_utils.hydrology import dem_flow, extract_streams
+from geo_utils.raster_io import load_dem
+from geo_utils.render import render_legend, render_raster, value_range
 
 
-def read_dem(dem_path):
-    with rasterio.open(dem_path) as dataset:
-        elevation = dataset.read(1)
-        return elevation, dataset.transform
+def plot_dem(elevation, nodata=None, title='Digital Elevation Model', cmap='terrain'):
+    vmin, vmax = value_range(elevation, nodata)
+    st.image(render_raster(elevation, cmap, vmin, vmax, nodata),
+             caption=title, use_column_width=True)
+    st.image(render_legend(cmap, vmin, vmax, 'Elevation (meters)'))
 
 
-def plot_dem(elevation):
-    plt.imshow(elevation, cmap='terrain')
-    plt.colorbar(label='Elevation (meters)')
-    plt.title('Digital Elevation Model')
-    st.pyplot()
-
-
-def compute_flow_directions(elevation):
-    gradient_x, gradient_y = np.gradient(elevation)
-    flow_directions = np.arctan2(gradient_y, gradient_x)
-    flow_directions = np.degrees(flow_directions) % 360
-    flow_directions[flow_directions < 0] += 360
-    flow_direction_codes = np.ceil(flow_directions / 45).astype(int)
-    return flow_direction_codes
-
-
-def highlight_water_streams(dem_array, flow_directions, water_threshold):
-    water_streams = (flow_directions == 7) | (flow_directions == 8)
-    water_streams = water_streams & (dem_array <= water_threshold)
-    highlighted_dem = np.ma.masked_where(~water_streams, dem_array)
+def highlight_water_streams(dem_array, contributing_area, area_threshold):
+    # Keep only cells draining at least the threshold area
+    water_streams = extract_streams(contributing_area, area_threshold)
+    highlighted_dem = np.where(water_streams, dem_array, np.nan)
     return highlighted_dem
 
 
@@ -42,33 +27,32 @@ def main():
         "Upload a TIF image", type=["tif", "tiff"])
 
     if uploaded_file is not None:
-        # Read the uploaded file
-        file_contents = uploaded_file.read()
-
-        # Open the image using BytesIO
-        dem_array, transform = read_dem(BytesIO(file_contents))
+        # Load the DEM (decoded once per file content and cached)
+        dem = load_dem(uploaded_file)
+        dem_array, transform = dem.array, dem.transform
 
         # Plot DEM data
-        plot_dem(dem_array)
-
-        # Compute flow directions
-        flow_directions = compute_flow_directions(dem_array)
-
-        # Add a slider for adjusting water stream threshold
-        water_threshold = st.slider(
-            "Water Stream Threshold", min_value=np.min(dem_array), max_value=np.max(dem_array), value=np.min(dem_array)
+        plot_dem(dem_array, dem.nodata)
+
+        # Fill depressions, compute D8 flow directions and the contributing
+        # area of every cell (cached for this DEM)
+        flow = dem_flow(dem)
+        contributing_area = flow['area'] / 1e6
+        max_area = float(np.nanmax(contributing_area))
+
+        # Add a slider for the contributing area that starts a stream
+        area_threshold = st.slider(
+            "Stream Contributing Area Threshold (km²)", min_value=0.0, max_value=max_area,
+            value=max_area / 100, step=max_area / 1000, format="%.4f"
         )
 
         # Highlight water streams based on the threshold
         highlighted_dem = highlight_water_streams(
-            dem_array, flow_directions, water_threshold
+            dem_array, contributing_area, area_threshold
         )
 
         # Plot highlighted water streams
-        plt.imshow(highlighted_dem, cmap='Blues')
-        plt.colorbar(label='Elevation (meters)')
-        plt.title('Highlighted Water Streams')
-        st.pyplot()
+        plot_dem(highlighted_dem, dem.nodata, 'Highlighted Water Streams', 'Blues')
 
 
 if __name__ == "__main__":
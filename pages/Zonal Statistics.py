@@ -0,0 +1,91 @@
+import streamlit as st
+import pandas as pd
+from geo_utils.overlay import ndvi_factor
+from geo_utils.raster_io import band_count, file_digest, load_dem
+from geo_utils.terrain import dem_terrain
+from geo_utils.zonal import (CIRCULAR_STATISTICS, ZONAL_STATISTICS, cached_polygons, cached_zones,
+                             circular_zonal_stats, zonal_stats)
+
+# Layers that can be summarised per polygon
+ZONAL_LAYERS = ["Raster Values", "Slope", "Aspect", "Curvature", "NDVI"]
+
+# Layers holding angles, summarised with circular statistics
+CIRCULAR_LAYERS = ["Aspect"]
+
+
+def zonal_layer(raster_file, layer, band):
+    # Raster to summarise (with its DemData and nodata value) on the grid
+    # of the uploaded file
+    dem = load_dem(raster_file, band=band)
+    if layer == "Raster Values":
+        return dem, dem.array, dem.nodata
+    if layer == "NDVI":
+        band_numbers = range(1, band_count(raster_file) + 1)
+        red_band = st.sidebar.selectbox("Red Band", band_numbers, index=min(3, len(band_numbers)) - 1)
+        nir_band = st.sidebar.selectbox("NIR Band", band_numbers, index=min(4, len(band_numbers)) - 1)
+        red, nir = load_dem(raster_file, band=red_band), load_dem(raster_file, band=nir_band)
+        return red, ndvi_factor(red, nir), None
+    product = layer.lower()
+    # Flat cells have no aspect (-1)
+    nodata = -1 if layer == "Aspect" else None
+    return dem, dem_terrain(dem, products=(product,))[product], nodata
+
+
+def main():
+    st.title("Zonal Statistics")
+
+    shapefile_zip = st.file_uploader(
+        "Upload Polygons (Shapefile ZIP archive)", type=["zip"])
+    raster_file = st.file_uploader(
+        "Upload Raster (DEM or multi-band GeoTIFF)", type=["tif", "tiff"])
+
+    if shapefile_zip and raster_file:
+        st.sidebar.subheader("Statistics")
+        layer = st.sidebar.selectbox("Layer", ZONAL_LAYERS)
+        band = 1
+        if layer == "Raster Values":
+            band = st.sidebar.selectbox("Band", range(1, band_count(raster_file) + 1))
+        percentiles = []
+        if layer not in CIRCULAR_LAYERS:
+            percentiles = st.sidebar.multiselect(
+                "Percentiles", [5, 10, 25, 50, 75, 90, 95], default=[50])
+
+        dem, values, nodata = zonal_layer(raster_file, layer, band)
+
+        # Polygons are read and brought into the raster's CRS once per
+        # shapefile, and rasterized once per grid; every layer reuses the
+        # same zone raster
+        gdf = cached_polygons(shapefile_zip, dem.crs)
+        if gdf is None:
+            st.error("No Shapefile found in the ZIP archive.")
+            return
+        zones = cached_zones((file_digest(shapefile_zip), str(dem.crs)), gdf.geometry.values,
+                             values.shape, dem.transform)
+
+        # Aspect is an angle: its mean and spread come from the sines and
+        # cosines of the cells (359 and 1 degrees average to north)
+        if layer in CIRCULAR_LAYERS:
+            stats, names = circular_zonal_stats(zones, values, nodata), list(CIRCULAR_STATISTICS)
+        else:
+            stats = zonal_stats(zones, values, nodata, sorted(percentiles))
+            names = list(ZONAL_STATISTICS) + [f"p{percent:g}" for percent in sorted(percentiles)]
+
+        # Join the statistics to the attribute table
+        table = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+        for name in names:
+            table[f"{layer} {name}"] = stats[name]
+
+        st.write(f"{layer} per polygon ({len(table)} polygons, "
+                 f"{int((stats['count'] > 0).sum())} covered by the raster):")
+        st.dataframe(table)
+
+        st.download_button(
+            label="Download Statistics as CSV",
+            data=table.to_csv(index=False).encode('utf-8'),
+            file_name="zonal_statistics.csv",
+            mime="text/csv"
+        )
+
+
+if __name__ == '__main__':
+    main()
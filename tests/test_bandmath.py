@@ -0,0 +1,45 @@
+import numpy as np
+
+from geo_utils.bandmath import band_math, calculate_ndvi
+
+
+def _memmap(tmp_path, name, values, mode):
+    path = tmp_path / name
+    writer = np.memmap(path, dtype=np.float32, mode='w+', shape=values.shape)
+    writer[:] = values
+    writer.flush()
+    del writer
+    return np.memmap(path, dtype=np.float32, mode=mode, shape=values.shape)
+
+
+def test_scaled_read_only_memmap(tmp_path):
+    band = _memmap(tmp_path, 'band.dat', np.full((5, 4), 10, dtype=np.float32), 'r')
+    result = band_math('band', {'band': band}, scales={'band': 3}, offsets={'band': 1},
+                       block_rows=2)
+    np.testing.assert_array_equal(result, 31)
+    np.testing.assert_array_equal(band, 10)
+
+
+def test_scaled_writable_memmap_is_left_unchanged(tmp_path):
+    band = _memmap(tmp_path, 'band.dat', np.full((5, 4), 10, dtype=np.float32), 'r+')
+    for _ in range(2):
+        result = band_math('band', {'band': band}, scales={'band': 3})
+        np.testing.assert_array_equal(result, 30)
+    np.testing.assert_array_equal(band, 10)
+
+
+def test_ndvi_of_read_only_memmaps(tmp_path):
+    red = _memmap(tmp_path, 'red.dat', np.array([[0, 1], [2, 4]], dtype=np.float32), 'r')
+    nir = _memmap(tmp_path, 'nir.dat', np.array([[4, 2], [1, 0]], dtype=np.float32), 'r')
+    ndvi = calculate_ndvi(red, nir)
+    np.testing.assert_allclose(ndvi, [[1, 0.333333], [-0.333333, -1]], rtol=1e-5)
+    np.testing.assert_array_equal(red, [[0, 1], [2, 4]])
+
+
+def test_ndvi_leaves_out_nodata(tmp_path):
+    red = _memmap(tmp_path, 'red.dat', np.array([[0, 4], [-9999, 2]], dtype=np.float32), 'r')
+    nir = _memmap(tmp_path, 'nir.dat', np.array([[4, 0], [3, 2]], dtype=np.float32), 'r')
+    ndvi = calculate_ndvi(red, nir, nodata=(-9999, None))
+    np.testing.assert_allclose(ndvi[0], [1, -1])
+    assert np.isnan(ndvi[1, 0])
+    assert np.isfinite(ndvi[1, 1])
@@ -0,0 +1,30 @@
+import io
+
+import numpy as np
+
+from geo_utils.points import read_points
+
+
+def _csv(text, name):
+    uploaded = io.BytesIO(text.encode())
+    uploaded.name = name
+    return uploaded
+
+
+def test_attribute_changing_type_after_first_block():
+    rows = ['lat,lon,code'] + ['{},{},{}'.format(i % 80, i % 170, i) for i in range(2000)]
+    rows.append('10,20,abc')
+    uploaded = _csv('\n'.join(rows) + '\n', 'attribute_types.csv')
+    gdf, dropped = read_points(uploaded, 'lat', 'lon', ['code'], block_size=1024)
+    assert dropped == 0
+    assert len(gdf) == 2001
+    assert list(gdf['code'][-2:]) == ['1999', 'abc']
+
+
+def test_coordinates_with_text_are_dropped():
+    rows = ['lat,lon'] + ['{},{}'.format(i % 80, i % 170) for i in range(2000)]
+    rows.append('north,20')
+    uploaded = _csv('\n'.join(rows) + '\n', 'coordinate_text.csv')
+    gdf, dropped = read_points(uploaded, 'lat', 'lon', block_size=1024)
+    assert dropped == 1
+    np.testing.assert_array_equal(gdf['lat'].to_numpy()[:3], [0, 1, 2])